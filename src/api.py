@@ -1,11 +1,13 @@
+import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime
 import logging
+from typing import Optional
 
-from fastapi import FastAPI, Depends, Request, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, Request, Response, HTTPException, Query, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from pydantic import ValidationError
-import pandas as pd
 import numpy as np
 import catboost as cb
 
@@ -15,6 +17,9 @@ from backend import (
     FASTAPI_CONTACT,
     FASTAPI_LICENSE,
     FASTAPI_FAVICON_PATH,
+    FETCH_DEADLINE,
+    STREAM_REFRESH,
+    FEATURE_STORE_ENABLED,
 )
 from model import (
     MODEL_PATH,
@@ -22,9 +27,18 @@ from model import (
     THRESH_HPREC,
     THRESH_HSENS,
 )
-from model.calibration import get_venn_abers_score, X_cal, y_cal
-from backend.utils import get_real_time_data, get_availability_score
+from model.calibration import load_calibration_set
+from model.inference import FastScorer
+from backend.utils import (
+    get_real_time_data,
+    get_availability_score,
+    get_variation_centroids,
+)
 from backend.validation import InputDataModel, OutputDataModel, ResponseModel
+from backend.stream import ForecastBroadcaster
+from backend.buffer import RealTimeBuffers
+from backend.store import append_features
+from backend.tracing import stage, request_trace, get_server_timing, get_metrics
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,6 +47,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Compact subset of the forecast pushed to stream subscribers
+STREAM_FIELDS = {
+    "datetime_ref",
+    "datetime_run",
+    "prediction_score",
+    "prediction_calib",
+    "prediction_hprec",
+    "prediction_balan",
+    "prediction_hsens",
+    "input_availability_score",
+    "input_availability_alert",
+    "input_skipped_sources",
+}
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -42,13 +70,60 @@ async def lifespan(app: FastAPI):
         from_file = cb.CatBoostClassifier()
         model = from_file.load_model(MODEL_PATH)
         logger.info("Model loaded successfully")
+        # Fail at startup, rather than on each forecast, if they are missing
+        get_variation_centroids()
+        X_cal, y_cal = load_calibration_set()
+        scorer = FastScorer(model, X_cal=X_cal, y_cal=y_cal)
+        if scorer.calibrator is not None:
+            logger.info("Calibration scores cached successfully")
 
         # Assets storage
         app.state.model = model
+        app.state.scorer = scorer
+
+        # Forecast stream
+        app.state.broadcaster = ForecastBroadcaster()
+        app.state.broadcaster.bind(asyncio.get_running_loop())
+        # Recent bins of each source, so that each scheduled forecast only
+        # processes the data received since the previous one
+        app.state.buffers = RealTimeBuffers()
     except Exception as e:
         logger.error(f"Error during asset loading: {e}")
         raise RuntimeError(f"Error loading assets: {e}")
+    producer = asyncio.create_task(produce_forecasts(app))
     yield
+    producer.cancel()
+
+
+async def produce_forecasts(app: FastAPI):
+    """
+    Computes a new forecast every STREAM_REFRESH seconds, publishes it to the
+    stream subscribers and stores its features (the only writer of the feature
+    store, so that requests never wait on it)
+    """
+    while True:
+        try:
+            response = await run_in_threadpool(
+                get_forecast,
+                app.state.scorer,
+                FETCH_DEADLINE,
+                app.state.buffers,
+                FEATURE_STORE_ENABLED,
+            )
+            publish_forecast(app, response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error during scheduled forecast: {e}")
+        await asyncio.sleep(STREAM_REFRESH)
+
+
+def publish_forecast(app: FastAPI, response: ResponseModel):
+    # Serialise once: every subscriber receives the same bytes
+    app.state.broadcaster.publish(
+        response.data.model_dump_json(include=STREAM_FIELDS, exclude_none=True),
+        key=str(response.data.datetime_ref),
+    )
 
 
 def get_model(request: Request):
@@ -58,6 +133,13 @@ def get_model(request: Request):
     return model
 
 
+def get_scorer(request: Request):
+    scorer = getattr(request.app.state, "scorer", None)
+    if scorer is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    return scorer
+
+
 app = FastAPI(
     title="T-FORS",
     summary=FASTAPI_SUMMARY,
@@ -87,41 +169,39 @@ async def get_data():
         raise HTTPException(status_code=500, detail=f"Error retrieving data: {e}")
 
 
-@app.post(
-    "/predict",
-    tags=["predict"],
-    summary="Get predictions based on near real-time data using a pre-trained model",
-    response_model=ResponseModel,
-)
-def predict(model=Depends(get_model)):
+def get_forecast(
+    scorer: FastScorer,
+    deadline: float = None,
+    buffers: RealTimeBuffers = None,
+    store: bool = False,
+) -> ResponseModel:
     try:
-        df = get_real_time_data()
+        df = get_real_time_data(deadline=deadline, buffers=buffers)
+        # Keep the served features, so that they can be labelled and trained on;
+        # only the scheduled forecasts do, off the request path
+        if store:
+            with stage("store"):
+                append_features(df)
         # Check availability of near real-time data
-        input_availability_score, input_availability_thr = get_availability_score(df)
-        data_dict = df.to_dict(orient="records")[0]
+        with stage("availability"):
+            input_availability_score, input_availability_thr = get_availability_score(
+                df
+            )
+        data_dict = (
+            df.astype(object).where(df.notna(), None).to_dict(orient="records")[0]
+        )
 
         # Data validation before feeding the model
         try:
-            validated_data = InputDataModel(**data_dict)
+            with stage("validation"):
+                validated_data = InputDataModel(**data_dict)
         except ValidationError as e:
             raise HTTPException(status_code=400, detail=f"Validation error: {e}")
-        df_validated = pd.DataFrame([validated_data.model_dump()])
-
-        # Raw CatBoost score
-        prediction_score = model.predict_proba(df_validated)
-        # Calibrated score
-        prediction_calib = get_venn_abers_score(
-            p_cal=model.predict_proba(X_cal),
-            y_cal=y_cal.values,
-            p_test=prediction_score,
-        )
 
-        if isinstance(prediction_score, (list, np.ndarray)):
-            prediction_score = float(prediction_score[:, 1][0])
-        elif isinstance(prediction_score, (int, float)):
-            prediction_score = float(prediction_score[:, 1])
-        else:
-            raise HTTPException(status_code=500, detail="Unexpected prediction format")
+        # Raw CatBoost score and calibrated score, straight from NumPy buffers
+        prediction_score, prediction_calib = scorer.predict(validated_data.model_dump())
+        prediction_score = float(prediction_score[0])
+        prediction_calib = float(prediction_calib[0])
 
         # Operating modes (classification)
         prediction_hprec = 1 if prediction_score > THRESH_HPREC else 0
@@ -140,6 +220,7 @@ def predict(model=Depends(get_model)):
             "prediction_hsens": prediction_hsens,
             "input_availability_score": input_availability_score,
             "input_availability_alert": input_availability_thr,
+            "input_skipped_sources": df.attrs.get("skipped_sources", []),
             **input_data,
         }
 
@@ -158,3 +239,69 @@ def predict(model=Depends(get_model)):
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {e}")
+
+
+@app.post(
+    "/predict",
+    tags=["predict"],
+    summary="Get predictions based on near real-time data using a pre-trained model",
+    response_model=ResponseModel,
+)
+def predict(
+    response: Response,
+    deadline: Optional[float] = Query(
+        default=FETCH_DEADLINE,
+        gt=0,
+        description="Latency budget (in seconds) for data retrieval; sources answering later are treated as missing",
+    ),
+    timing: bool = Query(
+        default=False,
+        description="Whether to add a Server-Timing header with the breakdown of the request stages",
+    ),
+    scorer=Depends(get_scorer),
+):
+    with request_trace() as trace:
+        with stage("predict"):
+            forecast = get_forecast(scorer, deadline)
+    if timing:
+        response.headers["Server-Timing"] = get_server_timing(trace)
+    publish_forecast(app, forecast)
+    return forecast
+
+
+@app.get(
+    "/stream",
+    tags=["predict"],
+    summary="Stream each new prediction as Server-Sent Events",
+    response_class=StreamingResponse,
+)
+async def stream(
+    request: Request,
+    last_event_id: Optional[int] = Header(
+        default=None,
+        description="Id of the last event received, to catch up on missed predictions after a reconnection",
+    ),
+):
+    broadcaster = request.app.state.broadcaster
+
+    async def events():
+        async for frame in broadcaster.subscribe(last_id=last_event_id):
+            if await request.is_disconnected():
+                break
+            yield frame
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get(
+    "/metrics",
+    tags=["monitoring"],
+    summary="Prometheus-style metrics of the serving path",
+    response_class=PlainTextResponse,
+)
+def metrics():
+    return PlainTextResponse(get_metrics(), media_type="text/plain; version=0.0.4")
@@ -6,10 +6,53 @@ LONGITUDE = 8.682526
 ALTITUDE = 350_000
 L1_DIST = 1_500_000
 BSN_DIST = 90_000
+# Ionosondes of the TechTIDE network, and (latitude, longitude) of those in use
+IONOSONDE_STATIONS = [
+    "AT138",
+    "DB049",
+    "EB040",
+    "FF051",
+    "GR13L",
+    "HE13N",
+    "JR055",
+    "LV12P",
+    "MU12K",
+    "PQ052",
+    "RL052",
+    "RO041",
+    "SO148",
+    "VT139",
+]
+IONOSONDE_LOCATIONS = {
+    "at": (38.0, 23.5),
+    "ff": (51.7, -1.5),
+    "jr": (54.6, 13.4),
+    "pq": (50.0, 14.6),
+    "ro": (41.9, 12.5),
+    "vt": (40.6, 17.8),
+}
 
 # Data
 DATA_IN = Path("..", "data", "in")
 FEAT_IMP_PATH = Path("assets", "data", "feature_importances.pickle")
+PREPROCESS_CACHE_DIR = Path("..", "data", "cache")
+PREPROCESS_CACHE_SIZE = 2 * 2**30  # bytes
+PREPROCESS_CACHE_ENABLED = False
+# Variation centroids fitted on the training catalog, as {column: centres}; to be
+# generated along with the model (see `save_variation_centroids`), serving requires it
+VARIATION_CENTROIDS_PATH = Path("assets", "data", "variation_centroids.pickle")
+# Feature store (ML_MODEL_COLS plus targets on the 30-minute grid, one Parquet per month)
+FEATURE_STORE_PATH = Path("..", "data", "features")
+FEATURE_STORE_ENABLED = True
+FORECAST_HOURS_IN_ADVANCE = 3
+FEATURE_STORE_TARGETS = [f"tid_within_{FORECAST_HOURS_IN_ADVANCE}h"]
+
+# Solar zenith angle table (30-minute grid, at ground level)
+SZA_TABLE_PATH = Path("assets", "data", "sza_table.pickle")
+SZA_TABLE_VERSION = 1
+SZA_TABLE_START = "2014-01-01"
+SZA_TABLE_END = "2036-01-01"
+SZA_ANALYTICAL_TOLERANCE = 0.02  # degrees
 
 # MLFlow & FastAPI
 ML_SERVER_URI = "http://localhost:5000"
@@ -53,6 +96,80 @@ ML_MODEL_COLS = {
     "velocity_vt": "float",
 }
 TOP_N_FEAT = 8
+# Moving averages (time windows, in hours) and variation labels (EWM span, in steps)
+FEATURE_MOVING_AVG = {"hf": [2], "ie": [3, 12], "iu": [3, 12]}
+FEATURE_VARIATION = {"ie": 12, "iu": 12}
+# Seasonal periods of the 30-minute series (in steps): day, and Bartels solar rotation
+SEASONAL_PERIODS = {"day": 48, "rotation": 27 * 48}
+# Data-quality policy of each source: sentinel values and values out of their valid
+# range become NaN (in the raw observations, before resampling), then gaps of the
+# 30-minute series up to `max_gap` steps are filled ("ffill" also fills the trailing
+# gap, "interpolate" inner gaps only) and, if `flag` is set, missing bins are marked
+# in `{col}_gap` columns
+DATA_QUALITY_POLICY = {
+    "techtide_hf": {
+        "columns": ["hf"],
+        "fill": "interpolate",
+        "max_gap": 1,
+    },
+    "techtide_ionosondes": {
+        "columns": [
+            f"{quantity_}_{station_.lower()}"
+            for quantity_ in ["spectral_contribution", "azimuth", "velocity"]
+            for station_ in ["at", "ff", "jr", "pq", "ro", "vt"]
+        ],
+        "fill": None,
+        "flag": True,
+    },
+    "gfz_hp30": {"columns": ["hp_30"], "fill": "ffill", "max_gap": 1},
+    "gfz_f107": {"columns": ["f_107_adj"], "fill": "ffill", "max_gap": 2 * 48},
+    "noaa_l1": {
+        "columns": ["by", "bz", "speed", "rho", "newell"],
+        "sentinels": [999.99, 9999.99, 10_000, 99999.9],
+        "valid_range": {
+            "by": (-200, 200),
+            "bz": (-200, 200),
+            "speed": (0, 3_000),
+            "rho": (0, 500),
+            "newell": (0, 1_000_000),
+        },
+        "fill": "interpolate",
+        "max_gap": 2,
+        "flag": True,
+    },
+    "noaa_dst": {
+        "columns": ["dst"],
+        "sentinels": [99999],
+        "fill": "ffill",  # hourly
+        "max_gap": 12,
+    },
+    "fmi": {"columns": ["ie", "iu"], "fill": "interpolate", "max_gap": 1},
+}
+# The model was trained on a catalog built without the policy: serving keeps the
+# previous cleaning (Dst forward-fill only) until it is retrained on one built with it
+DATA_QUALITY_SERVING = False
+# Time span of each source (in hours) fetched or buffered by both live paths: what
+# its features look back on, i.e. the 2-hour moving average of HF and the 24-hour
+# FMI real-time file (12-hour moving averages, variation labels), plus one hour for
+# the gaps to be filled at its start; 12 hours of the hourly Dst for it to be
+# forward-filled; the last bin only (plus one, for Hp30 to be forward-filled) for
+# the others
+REAL_TIME_WINDOWS = {
+    "techtide_hf": 3,
+    "techtide_ionosondes": 1,
+    "gfz_hp30": 1,
+    "noaa_l1": 1,
+    "noaa_dst": 12,
+    "fmi": 24,
+}
+# Local warning levels of the ionosondes (TrL), by code
+WARNING_LEVELS = ["no data", "quiet", "weak", "moderate", "strong", "very strong"]
+FETCH_DEADLINE = 15  # seconds
+STREAM_REFRESH = 1_800  # seconds
+STREAM_HISTORY = 48
+STREAM_KEEPALIVE = 15  # seconds
+TRACING_ENABLED = True
+TRACING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
 
 # FastAPI
 FASTAPI_SUMMARY = """
@@ -62,10 +179,11 @@ funded by the European Community, Horizon Europe
 FASTAPI_DESC = """
 T-FORS is a near real-time forecasting service that exploits solar and geomagnetic
 data to forecast Travelling Ionospheric Disturbances (TIDs). This API currently
-offers two endpoints:
+offers three endpoints:
 
 - one for near real-time **data retrieval**
 - one to serve **predictions**, based on near real-time data and a pre-trained machine learning model
+- one to **stream** each new prediction to subscribers, as Server-Sent Events
 """
 FASTAPI_CONTACT = {
     "name": "The T-FORS Project",
@@ -0,0 +1,228 @@
+from threading import Lock
+from typing import Literal, Union
+
+import numpy as np
+import pandas as pd
+
+from backend import REAL_TIME_WINDOWS
+from backend.preprocess import resample_time_series
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent bins of a time series, held in a
+    preallocated (columns, 2 x capacity) array which is never reallocated
+
+    Each bin is written twice, at its slot and one capacity further, so that the
+    last `n` bins of every column are always a contiguous slice and can be read
+    as zero-copy views. Bins are addressed by timestamp: new bins push the oldest
+    ones out, bins which are still retained can be revised, and bins which were
+    never written (e.g. gaps, or history before the first update) are NaN, as
+    they would be after resampling.
+
+    Parameters
+    ----------
+    columns : list[str]
+        Column names
+    capacity : int
+        Number of bins retained
+    freq : str, optional
+        Time step of the bins, by default "30min"
+    """
+
+    def __init__(self, columns: list[str], capacity: int, freq: str = "30min"):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.freq = pd.Timedelta(freq)
+        self._step = self.freq.value
+        self._index = {col_: i_ for i_, col_ in enumerate(self.columns)}
+        self._values = np.full((len(self.columns), 2 * capacity), np.nan)
+        # Number of bins pushed so far (gaps included), and timestamp of the last one
+        self._count = 0
+        self._last = None
+
+    @property
+    def last_timestamp(self) -> pd.Timestamp:
+        return None if self._last is None else pd.Timestamp(self._last)
+
+    def _write(self, positions: np.ndarray, values: np.ndarray):
+        self._values[:, positions] = values
+        self._values[:, positions + self.capacity] = values
+
+    def advance(self, timestamp: pd.Timestamp):
+        """
+        Moves the buffer forward to a new last bin; the bins in between are empty
+        """
+        timestamp = pd.Timestamp(timestamp).value
+        if self._last is None:
+            self._count, self._last = 1, timestamp
+            return
+        n_new, remainder = divmod(timestamp - self._last, self._step)
+        if remainder:
+            raise ValueError(
+                f"Bin {pd.Timestamp(timestamp)} is off the {self.freq} grid"
+            )
+        if n_new <= 0:
+            return
+        positions = np.arange(self._count, self._count + min(n_new, self.capacity))
+        self._write(positions % self.capacity, np.nan)
+        self._count += n_new
+        self._last = timestamp
+
+    def extend(self, times: pd.DatetimeIndex, values: np.ndarray):
+        """
+        Writes bins into the buffer, advancing it if they are newer than the last
+        one; bins older than the retained ones are dropped
+
+        Parameters
+        ----------
+        times : pd.DatetimeIndex
+            Timestamps of the bins, on the grid of the buffer
+        values : np.ndarray
+            Values of the bins, with shape (time, columns)
+        """
+        if len(times) == 0:
+            return
+        times = pd.DatetimeIndex(times).as_unit("ns").asi8
+        self.advance(pd.Timestamp(times.max()))
+        lags, remainders = np.divmod(self._last - times, self._step)
+        if remainders.any():
+            raise ValueError(f"Bins are off the {self.freq} grid")
+        retained = lags < self.capacity
+        positions = (self._count - 1 - lags[retained]) % self.capacity
+        self._write(positions, np.asarray(values, dtype=float)[retained].T)
+
+    def view(self, n: int = None) -> np.ndarray:
+        """
+        Zero-copy view of the last `n` bins, with shape (columns, n)
+
+        Parameters
+        ----------
+        n : int, optional
+            Number of bins, by default None (the whole capacity)
+
+        Returns
+        -------
+        np.ndarray
+            Read-only view, oldest bin first
+        """
+        n = self.capacity if n is None else n
+        if not 0 < n <= self.capacity:
+            raise ValueError(f"Between 1 and {self.capacity} bins can be viewed")
+        end = (self._count - 1) % self.capacity + self.capacity + 1
+        view = self._values[:, end - n : end]
+        view.flags.writeable = False
+        return view
+
+    def column(self, column: str, n: int = None) -> np.ndarray:
+        """
+        Zero-copy view of the last `n` bins of a column (see `view`)
+        """
+        return self.view(n)[self._index[column]]
+
+    def times(self, n: int = None) -> pd.DatetimeIndex:
+        """
+        Timestamps of the last `n` bins (see `view`)
+        """
+        n = self.capacity if n is None else n
+        return pd.date_range(end=self.last_timestamp, periods=n, freq=self.freq)
+
+
+class RealTimeBuffers:
+    """
+    Ring buffers (see `RingBuffer`) of the recent 30-minute bins of each data
+    source, which the live features are computed from; every update only
+    resamples the observations of each source from its last bin onwards (which
+    may have been incomplete), so the forecast loop touches new data only
+
+    Parameters
+    ----------
+    windows : dict[str, float], optional
+        Time span (in hours) retained for each source, by default
+        REAL_TIME_WINDOWS
+    freq : str, optional
+        Time step of the bins, by default "30min"
+    """
+
+    def __init__(
+        self, windows: dict[str, float] = REAL_TIME_WINDOWS, freq: str = "30min"
+    ):
+        self.freq = freq
+        self.windows = windows
+        self.buffers: dict[str, RingBuffer] = {}
+        # Last bin actually observed for each source (buffers can be further ahead)
+        self.last_observed: dict[str, pd.Timestamp] = {}
+        # Feature engines fed with the settled bins of each source (see
+        # `FeatureEngine.update_buffer`)
+        self.engines: dict = {}
+        # Held by the caller across an update and the reads which follow it
+        self.lock = Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.buffers
+
+    def __getitem__(self, name: str) -> RingBuffer:
+        return self.buffers[name]
+
+    def update(
+        self,
+        name: str,
+        df: pd.DataFrame,
+        aggregation_function: Union[
+            Literal["mean", "median", "max"], dict[str, Union[str, list[str]]]
+        ],
+        decimals: int = None,
+    ):
+        """
+        Resamples the new observations of a source into its buffer
+
+        Parameters
+        ----------
+        name : str
+            Name of the source
+        df : pd.DataFrame
+            Observations retrieved from the source, indexed by time
+        aggregation_function : Union[Literal["mean", "median", "max"], dict[str, Union[str, list[str]]]]
+            Aggregation function to use for resampling
+        decimals : int, optional
+            Number of decimals the bins are rounded to, by default None
+        """
+        if name in self.last_observed:
+            df = df[df.index >= self.last_observed[name]]
+        if df.empty:
+            return
+        binned = resample_time_series(df, aggregation_function, self.freq)
+        values = binned.to_numpy(dtype=float)
+        if decimals is not None:
+            np.round(values, decimals, out=values)
+
+        if name not in self.buffers:
+            capacity = int(
+                pd.Timedelta(hours=self.windows[name]) / pd.Timedelta(self.freq)
+            )
+            self.buffers[name] = RingBuffer(binned.columns, capacity, self.freq)
+        self.buffers[name].extend(binned.index, values)
+        self.last_observed[name] = binned.index.max()
+
+    def align(self) -> pd.Timestamp:
+        """
+        Advances all the buffers to the most recent bin of any source, so that
+        their views line up (lagging sources get empty bins)
+
+        Returns
+        -------
+        pd.Timestamp
+            Most recent bin
+        """
+        latest = max(buffer_.last_timestamp for buffer_ in self.buffers.values())
+        for buffer_ in self.buffers.values():
+            buffer_.advance(latest)
+        return latest
+
+    def fetch_start(self, name: str, now: pd.Timestamp) -> pd.Timestamp:
+        """
+        Earliest time a source has to be fetched from: its last observed bin, or
+        its whole time span if it was never observed
+        """
+        span_start = pd.Timestamp(now) - pd.Timedelta(hours=self.windows[name])
+        return self.last_observed.get(name, span_start)
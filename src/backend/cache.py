@@ -0,0 +1,249 @@
+from functools import lru_cache, wraps
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable
+import inspect
+import json
+import os
+import shutil
+import sys
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from backend import (
+    PREPROCESS_CACHE_DIR,
+    PREPROCESS_CACHE_SIZE,
+    PREPROCESS_CACHE_ENABLED,
+)
+
+_settings = {
+    "enabled": PREPROCESS_CACHE_ENABLED,
+    "path": PREPROCESS_CACHE_DIR,
+    "max_bytes": PREPROCESS_CACHE_SIZE,
+}
+_SERIES_COL = "__series__"
+
+
+def set_preprocess_cache(
+    enabled: bool, path: Path = None, max_bytes: int = None
+) -> None:
+    """
+    Turns the on-disk memoisation of the preprocessing functions on or off; it is
+    meant for catalog builds, while the serving path runs uncached
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether to memoise
+    path : Path, optional
+        Cache directory, by default PREPROCESS_CACHE_DIR
+    max_bytes : int, optional
+        Size of the cache, beyond which the least recently used results are
+        evicted, by default PREPROCESS_CACHE_SIZE
+    """
+    _settings["enabled"] = enabled
+    if path is not None:
+        _settings["path"] = Path(path)
+    if max_bytes is not None:
+        _settings["max_bytes"] = max_bytes
+
+
+def _get_dependencies(module_name: str) -> list[str]:
+    # Modules of the same package the module uses (through the modules, functions
+    # and classes it imports), transitively, plus the package itself (constants)
+    package = module_name.split(".")[0]
+    found, pending = {package}, [module_name]
+    while pending:
+        name_ = pending.pop()
+        if name_ in found:
+            continue
+        found.add(name_)
+        for obj_ in vars(sys.modules[name_]).values():
+            dep_ = (
+                obj_.__name__
+                if inspect.ismodule(obj_)
+                else getattr(obj_, "__module__", None)
+            )
+            if (
+                isinstance(dep_, str)
+                and dep_.split(".")[0] == package
+                and dep_ in sys.modules
+            ):
+                pending.append(dep_)
+    return sorted(found)
+
+
+@lru_cache(maxsize=None)
+def _code_version(module_name: str) -> str:
+    # Any change to the module, or to the modules of the package it depends on,
+    # invalidates all of its cached results
+    h = sha256()
+    for name_ in _get_dependencies(module_name):
+        h.update(f"{name_}:".encode())
+        h.update(inspect.getsource(sys.modules[name_]).encode())
+    return h.hexdigest()
+
+
+def _update_hash(h, value) -> None:
+    if isinstance(value, pd.DataFrame):
+        h.update(repr((list(value.columns), list(map(str, value.dtypes)))).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        h.update(repr((value.name, str(value.dtype))).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Path):
+        # Files are identified by their size and modification time
+        stat = value.stat() if value.exists() else None
+        h.update(repr((str(value), stat and (stat.st_size, stat.st_mtime_ns))).encode())
+    elif isinstance(value, dict):
+        for key_ in sorted(value, key=repr):
+            _update_hash(h, key_)
+            _update_hash(h, value[key_])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}{len(value)}".encode())
+        for item_ in value:
+            _update_hash(h, item_)
+    else:
+        h.update(repr(value).encode())
+
+
+def _dump(result, entry: Path) -> bool:
+    parts = result if isinstance(result, tuple) else (result,)
+    kinds, names, freqs = [], [], []
+    for i_, part_ in enumerate(parts):
+        if isinstance(part_, pd.DataFrame):
+            kinds.append("frame")
+            names.append(None)
+            frame = part_
+        elif isinstance(part_, pd.Series):
+            kinds.append("series")
+            names.append(part_.name)
+            frame = part_.to_frame(_SERIES_COL)
+        elif isinstance(part_, np.ndarray) and part_.ndim == 1:
+            kinds.append("array")
+            names.append(None)
+            frame = pd.DataFrame({_SERIES_COL: part_})
+        else:
+            return False
+        # Parquet does not keep the frequency of the index
+        freqs.append(getattr(frame.index, "freqstr", None))
+        frame.to_parquet(Path(entry, f"{i_}.parquet"))
+
+    meta = {
+        "kinds": kinds,
+        "names": names,
+        "freqs": freqs,
+        "tuple": isinstance(result, tuple),
+    }
+    Path(entry, "meta.json").write_text(json.dumps(meta))
+    return True
+
+
+def _load(entry: Path):
+    meta = json.loads(Path(entry, "meta.json").read_text())
+    freqs = meta.get("freqs", [None] * len(meta["kinds"]))
+    parts = []
+    for i_, (kind_, name_, freq_) in enumerate(
+        zip(meta["kinds"], meta["names"], freqs)
+    ):
+        frame = pd.read_parquet(Path(entry, f"{i_}.parquet"))
+        if freq_ is not None:
+            frame.index = pd.DatetimeIndex(frame.index, freq=freq_)
+        if kind_ == "frame":
+            parts.append(frame)
+        elif kind_ == "series":
+            parts.append(frame[_SERIES_COL].rename(name_))
+        else:
+            parts.append(frame[_SERIES_COL].to_numpy())
+    return tuple(parts) if meta["tuple"] else parts[0]
+
+
+def _evict(path: Path, max_bytes: int) -> None:
+    # Least recently used first, i.e. by modification time of the metadata,
+    # which is refreshed at every hit
+    entries = []
+    for entry_ in path.iterdir():
+        meta = Path(entry_, "meta.json")
+        if entry_.is_dir() and meta.exists():
+            size = sum(f_.stat().st_size for f_ in entry_.iterdir())
+            entries.append((meta.stat().st_mtime_ns, size, entry_))
+    total = sum(size_ for _, size_, _ in entries)
+    for _, size_, entry_ in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_, ignore_errors=True)
+        total -= size_
+
+
+def memoize(files: Callable[..., list[Path]] = None, version: str = None) -> Callable:
+    """
+    Decorator memoising a preprocessing function on disk, when the cache is
+    enabled (see `set_preprocess_cache`); results are keyed on a hash of the
+    input data, the parameters and the source code of the function's module and
+    of the modules of the package it depends on (e.g. `backend.io`,
+    `backend.schema` and the constants), and stored in Parquet
+
+    DataFrames, Series, 1-D arrays and tuples of them are cached; other results
+    are just recomputed.
+
+    Parameters
+    ----------
+    files : Callable[..., list[Path]], optional
+        Function of the same arguments returning the input files the function
+        reads, whose changes must invalidate the cache, by default None
+    version : str, optional
+        Version of the function, to be bumped when its results change for reasons
+        the source code does not show (e.g. an upgraded dependency), by default
+        None
+
+    Returns
+    -------
+    Callable
+    """
+
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings["enabled"]:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            h = sha256(f"{func.__qualname__}:{_code_version(func.__module__)}".encode())
+            _update_hash(h, version)
+            _update_hash(h, dict(bound.arguments))
+            if files is not None:
+                _update_hash(h, list(map(Path, files(**bound.arguments))))
+            path = _settings["path"]
+            entry = Path(path, f"{func.__name__}-{h.hexdigest()[:32]}")
+
+            if Path(entry, "meta.json").exists():
+                os.utime(Path(entry, "meta.json"))
+                return _load(entry)
+
+            result = func(*args, **kwargs)
+            # Written to a temporary directory first, so that readers never see
+            # partial entries
+            tmp = Path(path, f".tmp-{uuid.uuid4().hex}")
+            tmp.mkdir(parents=True)
+            try:
+                if _dump(result, tmp):
+                    os.replace(tmp, entry)
+            except OSError:
+                pass
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            _evict(path, _settings["max_bytes"])
+
+            return result
+
+        return wrapper
+
+    return decorator
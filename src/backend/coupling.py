@@ -0,0 +1,344 @@
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from backend import L1_DIST, BSN_DIST
+
+# Physical constants (SI)
+MU_0 = 4e-7 * np.pi
+PROTON_MASS = 1.67262192e-27  # kg
+EARTH_RADIUS = 6.371e6  # m
+
+# Rows processed at once: temporaries stay small (and cache-resident), so that
+# decades of 1-minute data only cost the output array
+_CHUNK_SIZE = 2**16
+
+
+def _apply(kernel: Callable, *arrays, out: np.ndarray = None) -> np.ndarray:
+    # Evaluates a kernel chunk by chunk, writing straight into the output
+    arrays = np.broadcast_arrays(*[np.asarray(a_, dtype=float) for a_ in arrays])
+    shape = arrays[0].shape
+    arrays = [a_.ravel() for a_ in arrays]
+    if out is None:
+        out = np.empty(shape)
+    flat_out = out.reshape(-1)
+    for start_ in range(0, flat_out.size, _CHUNK_SIZE):
+        chunk = slice(start_, start_ + _CHUNK_SIZE)
+        kernel(flat_out[chunk], *[a_[chunk] for a_ in arrays])
+    return out
+
+
+def _sin2_half_clock(by: np.ndarray, bz: np.ndarray, folded: bool) -> np.ndarray:
+    # sin^2(theta / 2) = (1 - cos(theta)) / 2, with cos(theta) = Bz / B_T: no
+    # trigonometric function is needed, and it is well defined for Bz = 0
+    b_t = np.hypot(by, bz)
+    cos = np.abs(bz) if folded else bz.copy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(cos, b_t, out=cos)
+    cos[b_t == 0] = 1  # no transverse field, no coupling
+    np.subtract(1, cos, out=cos)
+    cos *= 0.5
+    return cos
+
+
+def get_clock_angle(by: np.ndarray, bz: np.ndarray, degrees: bool = True) -> np.ndarray:
+    """
+    IMF clock angle in the GSM Y-Z plane, i.e. the angle of the transverse field
+    from the northward direction (positive towards +Y), in (-180, 180]
+
+    Parameters
+    ----------
+    by : np.ndarray
+        IMF By (GSM), in nT
+    bz : np.ndarray
+        IMF Bz (GSM), in nT
+    degrees : bool, optional
+        Whether to return degrees rather than radians, by default True
+
+    Returns
+    -------
+    np.ndarray
+    """
+    theta = np.arctan2(np.asarray(by, dtype=float), np.asarray(bz, dtype=float))
+    return np.degrees(theta, out=theta) if degrees else theta
+
+
+def get_newell(
+    speed: np.ndarray,
+    by: np.ndarray,
+    bz: np.ndarray,
+    folded: bool = False,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Newell et al. (2007) coupling function, v^(4/3) B_T^(2/3) sin^(8/3)(theta/2),
+    evaluated as the single cube root of v^4 B_T^2 (sin^2(theta/2))^4
+
+    Parameters
+    ----------
+    speed : np.ndarray
+        Solar wind speed, in km/s
+    by : np.ndarray
+        IMF By (GSM), in nT
+    bz : np.ndarray
+        IMF Bz (GSM), in nT
+    folded : bool, optional
+        Whether to fold the clock angle into [0, 90] degrees (i.e. arctan(|By/Bz|),
+        ignoring the sign of Bz), which is the definition the model features were
+        built with, by default False (the clock angle of `get_clock_angle`)
+    out : np.ndarray, optional
+        Output array, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Coupling, in (km/s)^(4/3) nT^(2/3)
+    """
+
+    def kernel(out, speed, by, bz):
+        sin2 = _sin2_half_clock(by, bz, folded)
+        sin2 *= speed
+        np.square(sin2, out=sin2)
+        np.square(sin2, out=sin2)
+        np.multiply(by, by, out=out)
+        out += bz * bz
+        out *= sin2
+        np.cbrt(out, out=out)
+
+    return _apply(kernel, speed, by, bz, out=out)
+
+
+def get_akasofu_epsilon(
+    speed: np.ndarray,
+    by: np.ndarray,
+    bz: np.ndarray,
+    bx: np.ndarray = None,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Akasofu (1981) epsilon parameter, (4 pi / mu_0) v B^2 sin^4(theta/2) l_0^2
+    with l_0 = 7 Earth radii, i.e. the power delivered to the magnetosphere
+
+    Parameters
+    ----------
+    speed : np.ndarray
+        Solar wind speed, in km/s
+    by : np.ndarray
+        IMF By (GSM), in nT
+    bz : np.ndarray
+        IMF Bz (GSM), in nT
+    bx : np.ndarray, optional
+        IMF Bx (GSM), in nT, by default None (B is the transverse field only)
+    out : np.ndarray, optional
+        Output array, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Epsilon, in GW
+    """
+    # 4 pi / mu_0 [SI] x 1e3 [km/s] x 1e-18 [nT^2] x l_0^2 [m^2] x 1e-9 [GW]
+    scale = 4 * np.pi / MU_0 * 1e3 * 1e-18 * (7 * EARTH_RADIUS) ** 2 * 1e-9
+
+    def kernel(out, speed, by, bz, bx=None):
+        sin2 = _sin2_half_clock(by, bz, folded=False)
+        np.square(sin2, out=sin2)
+        np.multiply(by, by, out=out)
+        out += bz * bz
+        if bx is not None:
+            out += bx * bx
+        out *= sin2
+        out *= speed
+        out *= scale
+
+    arrays = (speed, by, bz) if bx is None else (speed, by, bz, bx)
+    return _apply(kernel, *arrays, out=out)
+
+
+def get_borovsky(
+    speed: np.ndarray,
+    rho: np.ndarray,
+    by: np.ndarray,
+    bz: np.ndarray,
+    compression_ratio: float = 4.0,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Borovsky (2008) dayside reconnection rate, in its high Mach number limit with
+    a negligible magnetospheric mass density, 0.4 (mu_0 / C)^(1/2) sin^2(theta/2)
+    (m_p n)^(1/2) v^2, where C is the compression ratio of the bow shock
+
+    Parameters
+    ----------
+    speed : np.ndarray
+        Solar wind speed, in km/s
+    rho : np.ndarray
+        Proton density, in cm^-3
+    by : np.ndarray
+        IMF By (GSM), in nT
+    bz : np.ndarray
+        IMF Bz (GSM), in nT
+    compression_ratio : float, optional
+        Compression ratio of the bow shock, by default 4
+    out : np.ndarray, optional
+        Output array, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Reconnection rate (electric field), in mV/m
+    """
+    # 0.4 (mu_0 / C)^(1/2) [SI] x (m_p 1e6 [cm^-3])^(1/2) x 1e6 [(km/s)^2] x 1e3 [mV]
+    scale = 0.4 * np.sqrt(MU_0 / compression_ratio * PROTON_MASS * 1e6) * 1e6 * 1e3
+
+    def kernel(out, speed, rho, by, bz):
+        sin2 = _sin2_half_clock(by, bz, folded=False)
+        np.sqrt(rho, out=out)
+        out *= speed
+        out *= speed
+        out *= sin2
+        out *= scale
+
+    return _apply(kernel, speed, rho, by, bz, out=out)
+
+
+def get_dynamic_pressure(
+    speed: np.ndarray, rho: np.ndarray, out: np.ndarray = None
+) -> np.ndarray:
+    """
+    Solar wind dynamic pressure, m_p n v^2 (protons only)
+
+    Parameters
+    ----------
+    speed : np.ndarray
+        Solar wind speed, in km/s
+    rho : np.ndarray
+        Proton density, in cm^-3
+    out : np.ndarray, optional
+        Output array, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Pressure, in nPa
+    """
+    # m_p [kg] x 1e6 [cm^-3] x 1e6 [(km/s)^2] x 1e9 [nPa]
+    scale = PROTON_MASS * 1e6 * 1e6 * 1e9
+
+    def kernel(out, speed, rho):
+        np.multiply(speed, speed, out=out)
+        out *= rho
+        out *= scale
+
+    return _apply(kernel, speed, rho, out=out)
+
+
+def get_coupling_functions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convenience function which adds the clock angle (`clock_angle`, in degrees),
+    the Newell coupling (`newell`, with the folded clock angle the model features
+    were built with), the Akasofu epsilon (`epsilon`), the Borovsky reconnection
+    rate (`borovsky`) and the dynamic pressure (`p_dyn`) to a DataFrame of L1
+    data, with "speed", "rho", "by" and "bz" (and optionally "bx") columns
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Solar wind and IMF data
+
+    Returns
+    -------
+    pd.DataFrame
+        New DataFrame with the added columns, all attached at once
+    """
+    speed, rho, by, bz = (
+        df[col_].to_numpy(dtype=float) for col_ in ["speed", "rho", "by", "bz"]
+    )
+    bx = df["bx"].to_numpy(dtype=float) if "bx" in df.columns else None
+    block = pd.DataFrame(
+        {
+            "clock_angle": get_clock_angle(by, bz),
+            "newell": get_newell(speed, by, bz, folded=True),
+            "epsilon": get_akasofu_epsilon(speed, by, bz, bx=bx),
+            "borovsky": get_borovsky(speed, rho, by, bz),
+            "p_dyn": get_dynamic_pressure(speed, rho),
+        },
+        index=df.index,
+    )
+
+    return pd.concat([df.drop(columns=block.columns, errors="ignore"), block], axis=1)
+
+
+def propagate_to_bow_shock(
+    df: pd.DataFrame,
+    distance: float = L1_DIST - BSN_DIST,
+    speed_col: str = "speed",
+    freq: str = None,
+    tolerance: str = None,
+) -> pd.DataFrame:
+    """
+    Propagates solar wind samples measured at L1 to the bow shock, each with its
+    own ballistic delay (distance over speed, rounded to the second)
+
+    Fast samples can overtake slower ones measured before them, so the arrival
+    times are not monotonic: samples are ordered by arrival (ties by measurement
+    time) and, for each target time, the latest-arriving sample is kept, i.e. the
+    one standing at the bow shock at that time. Without a target grid, the target
+    times are the arrival times themselves; with one, each grid time takes the
+    last sample arrived by then (as `pd.merge_asof` would, through a single
+    `searchsorted`). Either way, the index comes out monotonic.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Samples indexed by measurement time, e.g. real-time NOAA data or 1-minute
+        OMNI-style archives (in the spacecraft frame)
+    distance : float, optional
+        Propagation distance, in km, by default L1_DIST - BSN_DIST
+    speed_col : str, optional
+        Column with the solar wind speed, in km/s, by default "speed"
+    freq : str, optional
+        Time step of the target grid, by default None (no grid)
+    tolerance : str, optional
+        Maximum age of the sample taken by a grid time, beyond which it is left
+        empty, by default None (the time step of the grid)
+
+    Returns
+    -------
+    pd.DataFrame
+        Samples indexed by arrival (or grid) time, in a "datetime" index
+    """
+    speed = df[speed_col].to_numpy(dtype=float)
+    measured = pd.DatetimeIndex(df.index).as_unit("ns").asi8
+    # Samples without a valid speed cannot be propagated
+    valid = np.isfinite(speed) & (speed > 0)
+    delays = np.round(distance / speed[valid]).astype(np.int64) * 10**9
+    arrival = measured[valid] + delays
+    rows = np.flatnonzero(valid)
+
+    if not len(rows):
+        return df.iloc[:0].set_axis(pd.DatetimeIndex([], name="datetime"), axis=0)
+
+    order = np.lexsort((measured[valid], arrival))
+    arrival, rows = arrival[order], rows[order]
+
+    if freq is None:
+        # Samples arriving at the same time: the last one is kept
+        last = np.append(arrival[1:] != arrival[:-1], True)
+        index, rows = arrival[last], rows[last]
+        out = df.iloc[rows]
+    else:
+        step = pd.Timedelta(freq).value
+        tolerance = step if tolerance is None else pd.Timedelta(tolerance).value
+        index = pd.date_range(
+            pd.Timestamp(arrival[0]).ceil(freq), pd.Timestamp(arrival[-1]), freq=freq
+        ).asi8
+        latest = np.searchsorted(arrival, index, side="right") - 1
+        # Grid times come after the first arrival, so `latest` is never -1
+        is_fresh = index - arrival[latest] < tolerance
+        out = df.iloc[rows[latest]]
+        out = out.where(np.broadcast_to(is_fresh[:, np.newaxis], out.shape))
+
+    out = out.set_axis(pd.DatetimeIndex(index, name="datetime"), axis=0)
+    return out
@@ -0,0 +1,284 @@
+from typing import Iterator, Literal
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backend import FORECAST_HOURS_IN_ADVANCE
+
+
+def get_window_targets(
+    events: pd.Series,
+    horizons: list[int] = [FORECAST_HOURS_IN_ADVANCE],
+    time_interval: str = "30min",
+    name: str = "tid",
+) -> pd.DataFrame:
+    """
+    Forward-looking targets for any number of horizons at once: the target for
+    horizon `h` is 1 if an event occurs in the bin itself or in the bins of the
+    next `h` hours, 0 otherwise (as `tid_within_3h` in the training catalog, i.e.
+    a rolling sum shifted backwards); bins whose window runs past the end of the
+    series are labelled 0, as in the catalog
+
+    Events are counted with a single cumulative sum, so that each horizon only
+    costs a difference of two of its entries.
+
+    Parameters
+    ----------
+    events : pd.Series
+        Event series on a regular grid (e.g. `quality_index` of the TID catalog),
+        where values greater than 0 are events and NaN are not
+    horizons : list[int], optional
+        Horizons (in hours), by default [FORECAST_HOURS_IN_ADVANCE]
+    time_interval : str, optional
+        Time step of the grid, by default "30min"
+    name : str, optional
+        Prefix of the target names, by default "tid"
+
+    Returns
+    -------
+    pd.DataFrame
+        Integer targets `{name}_within_{h}h`, indexed as `events`
+    """
+    steps = np.array(
+        [int(pd.Timedelta(hours=h_) / pd.Timedelta(time_interval)) for h_ in horizons]
+    )
+    n_rows = len(events)
+    is_event = np.nan_to_num(events.to_numpy(dtype=float)) > 0
+    counts = np.concatenate([[0], np.cumsum(is_event)])
+
+    # Events in [t, t + steps], for every bin (rows) and horizon (columns)
+    start = np.arange(n_rows)[:, np.newaxis]
+    end = start + steps + 1
+    complete = end <= n_rows
+    targets = (counts[np.minimum(end, n_rows)] - counts[start] > 0) & complete
+
+    return pd.DataFrame(
+        targets.astype(int),
+        index=events.index,
+        columns=[f"{name}_within_{h_}h" for h_ in horizons],
+    )
+
+
+def get_lagged_features(
+    df: pd.DataFrame,
+    cols: list[str],
+    lags: list[int] = [],
+    leads: list[int] = [],
+) -> pd.DataFrame:
+    """
+    Lagged (past) and lead (future) values of the given columns, in steps of the
+    grid: the columns are padded once, each shift is a view of the padded matrix,
+    and views are copied straight into a single preallocated output
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Input DataFrame, on a regular grid
+    cols : list[str]
+        Columns to be shifted
+    lags : list[int], optional
+        Lags (in steps), by default []
+    leads : list[int], optional
+        Leads (in steps), by default []
+
+    Returns
+    -------
+    pd.DataFrame
+        Shifted columns `{col}_lag_{k}` and `{col}_lead_{k}` (NaN where they fall
+        outside of the series), indexed as `df`
+    """
+    max_lag, max_lead = max(lags, default=0), max(leads, default=0)
+    padded = np.full((max_lag + len(df) + max_lead, len(cols)), np.nan)
+    padded[max_lag : max_lag + len(df)] = df[cols].to_numpy(dtype=float)
+
+    # Shifting by k steps is a view of the padded matrix starting k rows earlier
+    # (lags) or later (leads); shifts are shift-major, as the output columns
+    offsets = [max_lag - k_ for k_ in lags] + [max_lag + k_ for k_ in leads]
+    names = [f"lag_{k_}" for k_ in lags] + [f"lead_{k_}" for k_ in leads]
+    shifted = np.empty((len(df), len(offsets) * len(cols)))
+    for i_, offset_ in enumerate(offsets):
+        shifted[:, i_ * len(cols) : (i_ + 1) * len(cols)] = padded[
+            offset_ : offset_ + len(df)
+        ]
+
+    return pd.DataFrame(
+        shifted,
+        index=df.index,
+        columns=[f"{col_}_{name_}" for name_ in names for col_ in cols],
+    )
+
+
+def get_supervised_dataset(
+    df: pd.DataFrame,
+    events: pd.Series,
+    horizons: list[int] = [FORECAST_HOURS_IN_ADVANCE],
+    lagged_cols: list[str] = None,
+    lags: list[int] = [],
+    leads: list[int] = [],
+    time_interval: str = "30min",
+    name: str = "tid",
+) -> pd.DataFrame:
+    """
+    Supervised dataset built from the aligned feature matrix: features, their
+    lagged and lead values (see `get_lagged_features`) and the forward-looking
+    targets of each horizon (see `get_window_targets`)
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Aligned features, on a regular grid
+    events : pd.Series
+        Event series, on the same grid (bins missing from it are not events)
+    horizons : list[int], optional
+        Horizons (in hours), by default [FORECAST_HOURS_IN_ADVANCE]
+    lagged_cols : list[str], optional
+        Columns to be lagged or led, by default None (all the columns of `df`)
+    lags : list[int], optional
+        Lags (in steps), by default []
+    leads : list[int], optional
+        Leads (in steps), by default []
+    time_interval : str, optional
+        Time step of the grid, by default "30min"
+    name : str, optional
+        Prefix of the target names, by default "tid"
+
+    Returns
+    -------
+    pd.DataFrame
+        Features, shifted features and targets, indexed as `df`
+    """
+    lagged_cols = list(df.columns) if lagged_cols is None else lagged_cols
+    blocks = [df]
+    if lags or leads:
+        blocks.append(get_lagged_features(df, lagged_cols, lags=lags, leads=leads))
+    blocks.append(
+        get_window_targets(
+            events.reindex(df.index),
+            horizons=horizons,
+            time_interval=time_interval,
+            name=name,
+        )
+    )
+
+    return pd.concat(blocks, axis=1)
+
+
+class SequenceDataset:
+    """
+    Mini-batches of (samples, timesteps, features) sequences over the aligned
+    30-minute feature matrix, e.g. for recurrent models: sample `s` holds the
+    `window` bins from row `s` onwards and is labelled with the target `horizon`
+    bins after its last one (0 for a target which is already forward-looking)
+
+    Sequences are never materialised as a whole: the matrix is viewed through a
+    `sliding_window_view`, and each batch gathers its own samples from the view,
+    so that only one batch is allocated at a time and memory does not grow with
+    the number of samples. It can be iterated over, or indexed by batch (as a
+    Keras `PyDataset`), and it reshuffles at the end of each epoch.
+
+    Parameters
+    ----------
+    X : pd.DataFrame
+        Features on a regular grid, e.g. already scaled
+    y : pd.Series
+        Targets, indexed as `X`
+    window : int, optional
+        Number of timesteps of each sequence, by default 960 (20 days)
+    stride : int, optional
+        Number of bins between the first rows of consecutive samples, by default 1
+    horizon : int, optional
+        Number of bins between the last row of a sample and its target, by
+        default 0
+    batch_size : int, optional
+        Number of samples of each batch, by default 320
+    shuffle : bool, optional
+        Whether the samples are shuffled at each epoch, by default True
+    nan_policy : Literal["drop", "mask"], optional
+        Treatment of missing values, by default "drop": samples with any missing
+        feature or target are skipped; with "mask", missing features are replaced
+        by `mask_value` (e.g. for a Keras `Masking` layer), while samples with a
+        missing target are still skipped
+    mask_value : float, optional
+        Value of the missing features with the "mask" policy, by default 0.0
+    seed : int, optional
+        Seed of the shuffling, by default None
+    """
+
+    def __init__(
+        self,
+        X: pd.DataFrame,
+        y: pd.Series,
+        window: int = 2 * 24 * 20,
+        stride: int = 1,
+        horizon: int = 0,
+        batch_size: int = 320,
+        shuffle: bool = True,
+        nan_policy: Literal["drop", "mask"] = "drop",
+        mask_value: float = 0.0,
+        seed: int = None,
+    ):
+        if nan_policy not in ("drop", "mask"):
+            raise ValueError(f"Unsupported NaN policy: {nan_policy}")
+        if len(X) != len(y):
+            raise ValueError("Features and targets must have the same length")
+        self.window, self.horizon = window, horizon
+        self.batch_size, self.shuffle = batch_size, shuffle
+        self.mask_value = mask_value if nan_policy == "mask" else None
+        self._rng = np.random.default_rng(seed)
+
+        values = X.to_numpy(dtype=np.float32)
+        targets = np.asarray(y, dtype=np.float32)
+        # Zero-copy (samples, timesteps, features) view of all the sequences
+        self._windows = sliding_window_view(values, window, axis=0).transpose(0, 2, 1)
+        self._targets = targets[window - 1 + horizon :]
+
+        # Samples are kept if their target (and, unless masked, all of their
+        # features) are observed; NaN are counted over each window by cumsum
+        starts = np.arange(0, max(len(values) - window - horizon + 1, 0), stride)
+        valid = ~np.isnan(self._targets[starts])
+        if nan_policy == "drop":
+            nan_rows = np.isnan(values).any(axis=1)
+            nan_counts = np.concatenate([[0], np.cumsum(nan_rows)])
+            valid &= nan_counts[starts + window] == nan_counts[starts]
+        self.samples = starts[valid]
+        self._order = self.samples.copy()
+        if shuffle:
+            self._rng.shuffle(self._order)
+        self.index = X.index[self.samples + window - 1]
+
+    def __len__(self) -> int:
+        return -(-len(self.samples) // self.batch_size)
+
+    def __getitem__(self, batch: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Batch of sequences and targets, with shapes (samples, timesteps,
+        features) and (samples, 1)
+        """
+        if not 0 <= batch < len(self):
+            raise IndexError(f"Batch {batch} out of range")
+        samples = self._order[batch * self.batch_size : (batch + 1) * self.batch_size]
+        X = self._windows[samples]
+        if self.mask_value is not None:
+            np.nan_to_num(X, copy=False, nan=self.mask_value)
+        return X, self._targets[samples, np.newaxis]
+
+    def __iter__(self) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        for batch_ in range(len(self)):
+            yield self[batch_]
+        self.on_epoch_end()
+
+    def on_epoch_end(self):
+        """
+        Reshuffles the samples, if required
+        """
+        if self.shuffle:
+            self._rng.shuffle(self._order)
+
+    @property
+    def sequences(self) -> np.ndarray:
+        """
+        Zero-copy (samples, timesteps, features) view of all the sequences,
+        including those which are skipped, e.g. for inference
+        """
+        return self._windows
@@ -0,0 +1,329 @@
+from collections import deque
+from copy import deepcopy
+from pathlib import Path
+from typing import Callable
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from backend import FEATURE_MOVING_AVG, FEATURE_VARIATION
+from backend.buffer import RingBuffer
+
+
+class _RollingMean:
+    """
+    Running mean over the last `window` values, as `rolling(window).mean().round(2)`
+    (i.e. NaN unless the window is full of observations)
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        # Kahan-compensated running sum, with separate compensations for
+        # additions and removals (as in pandas)
+        self.total, self.n_nan = 0.0, 0
+        self.comp = {1.0: 0.0, -1.0: 0.0}
+        self._undo = None
+
+    def _add(self, x: float, sign: float):
+        y = sign * x - self.comp[sign]
+        t = self.total + y
+        self.comp[sign] = (t - self.total) - y
+        self.total = t
+
+    def push(self, x: float) -> float:
+        evicted = self.values.popleft() if len(self.values) == self.window else None
+        self._undo = (evicted, self.total, dict(self.comp), self.n_nan)
+        for value_, sign_ in ((evicted, -1.0), (x, 1.0)):
+            if value_ is None:
+                continue
+            if np.isnan(value_):
+                self.n_nan += int(sign_)
+            else:
+                self._add(value_, sign_)
+        self.values.append(x)
+        return self.value
+
+    def undo(self):
+        evicted, self.total, self.comp, self.n_nan = self._undo
+        self.values.pop()
+        if evicted is not None:
+            self.values.appendleft(evicted)
+        self._undo = None
+
+    @property
+    def value(self) -> float:
+        if len(self.values) < self.window or self.n_nan > 0:
+            return np.nan
+        return np.round(self.total / self.window, 2)
+
+
+class _EWMean:
+    """
+    Exponentially-weighted mean, with the same recursion (and NaN handling) as
+    pandas' `ewm(span=span, adjust=True, ignore_na=False).mean()`
+    """
+
+    def __init__(self, span: float):
+        self.decay = 1.0 - 2.0 / (span + 1.0)
+        self.weighted, self.old_wt = np.nan, 1.0
+        self._undo = None
+
+    def push(self, x: float) -> float:
+        self._undo = (self.weighted, self.old_wt)
+        if not np.isnan(self.weighted):
+            self.old_wt *= self.decay
+            if not np.isnan(x):
+                if self.weighted != x:
+                    self.weighted = (self.old_wt * self.weighted + x) / (
+                        self.old_wt + 1.0
+                    )
+                self.old_wt += 1.0
+        elif not np.isnan(x):
+            self.weighted = x
+        return self.weighted
+
+    def undo(self):
+        self.weighted, self.old_wt = self._undo
+        self._undo = None
+
+
+class _Variation:
+    """
+    Variation label (see `get_categories`) of the last value of an EWM-smoothed
+    series, i.e. the centre (among fixed `centroids`) nearest to the
+    log-difference of its last two smoothed values; as in `get_log_diff`, values
+    are offset by the magnitude of the lowest one so far if it is negative
+    """
+
+    def __init__(self, span: float, centroids: np.ndarray):
+        self.ewm = _EWMean(span)
+        centroids = np.sort(centroids)
+        self.midpoints = (centroids[1:] + centroids[:-1]) / 2
+        self.last, self.lowest = None, np.inf
+        self.label = 0
+        self._undo = None
+
+    def push(self, x: float) -> int:
+        self._undo = (self.last, self.lowest, self.label)
+        previous, smoothed = self.last, self.ewm.push(x)
+        self.last = smoothed
+        self.lowest = np.fmin(self.lowest, smoothed)
+        # The first value of a series is labelled 0, as in get_window_features
+        if previous is None:
+            self.label = 0
+        else:
+            offset = abs(self.lowest) if self.lowest < 0 else 0.0
+            log_diff = np.log1p(smoothed + offset) - np.log1p(previous + offset)
+            self.label = int(np.searchsorted(self.midpoints, log_diff))
+        return self.label
+
+    def undo(self):
+        self.ewm.undo()
+        self.last, self.lowest, self.label = self._undo
+        self._undo = None
+
+    @property
+    def value(self) -> int:
+        return self.label
+
+
+class FeatureEngine:
+    """
+    Stateful counterpart of the feature functions in `backend.preprocess`, which
+    updates moving averages, EWM smoothing and variation labels one 30-minute bin
+    at a time, in O(1), rather than recomputing them over the whole fetched window
+
+    Fed with a sequence of bins, it returns the same values as `get_moving_avg`
+    and `get_categories` (with `zero_phase=False` and fixed centroids) applied to
+    that sequence. The last bin can be updated again (e.g. while it is still being
+    filled), and the whole state can be saved to disk and restored after a restart.
+
+    Parameters
+    ----------
+    moving_avg : dict[str, list[int]], optional
+        Columns mapped to the time windows (in hours) of their moving averages,
+        by default FEATURE_MOVING_AVG
+    variation : dict[str, int], optional
+        Columns mapped to the EWM span (in steps) used for their variation labels,
+        by default FEATURE_VARIATION
+    centroids : dict[str, np.ndarray], optional
+        Columns mapped to the variation centres fitted on the training catalog
+        (see `save_variation_centroids`), required for each column of `variation`,
+        by default None
+    freq : str, optional
+        Time step of the bins, by default "30min"
+    """
+
+    def __init__(
+        self,
+        moving_avg: dict[str, list[int]] = None,
+        variation: dict[str, int] = None,
+        centroids: dict[str, np.ndarray] = None,
+        freq: str = "30min",
+    ):
+        moving_avg = FEATURE_MOVING_AVG if moving_avg is None else moving_avg
+        variation = FEATURE_VARIATION if variation is None else variation
+        centroids = {} if centroids is None else centroids
+        missing = set(variation) - set(centroids)
+        if missing:
+            raise ValueError(f"No variation centroids for {sorted(missing)}")
+        self.freq = pd.Timedelta(freq)
+        self.last_timestamp = None
+
+        # One state for each (column, window) pair, named after the batch output
+        self.states = {}
+        for col_, windows_ in moving_avg.items():
+            for wd_ in windows_:
+                self.states[f"{col_}_mav_{wd_}h"] = (col_, _RollingMean(2 * wd_))
+        for col_, span_ in variation.items():
+            self.states[f"{col_}_variation"] = (
+                col_,
+                _Variation(span_, centroids[col_]),
+            )
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.states.keys())
+
+    @property
+    def inputs(self) -> list[str]:
+        return list(dict.fromkeys(col_ for col_, _ in self.states.values()))
+
+    @property
+    def features(self) -> dict[str, float]:
+        """
+        Features of the last bin
+        """
+        return {name_: state_.value for name_, (_, state_) in self.states.items()}
+
+    def _push(self, values: dict[str, float]) -> dict[str, float]:
+        return {
+            name_: state_.push(float(values.get(col_, np.nan)))
+            for name_, (col_, state_) in self.states.items()
+        }
+
+    def update(self, timestamp: pd.Timestamp, values: dict[str, float]) -> dict:
+        """
+        Updates the state with a new bin and returns its features; missing bins
+        in between are treated as NaN, as resampling would do
+
+        Parameters
+        ----------
+        timestamp : pd.Timestamp
+            Left edge of the bin
+        values : dict[str, float]
+            Aggregated values of the bin; missing columns are treated as NaN
+
+        Returns
+        -------
+        dict
+            Features of the bin
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if self.last_timestamp is not None:
+            if timestamp < self.last_timestamp:
+                raise ValueError(
+                    f"Bin {timestamp} is older than the last one ({self.last_timestamp})"
+                )
+            if timestamp == self.last_timestamp:
+                # The last bin is being revised: roll its contribution back
+                for _, state_ in self.states.values():
+                    state_.undo()
+            else:
+                n_missing = int((timestamp - self.last_timestamp) / self.freq) - 1
+                for _ in range(n_missing):
+                    self._push({})
+        self.last_timestamp = timestamp
+
+        return self._push(values)
+
+    def update_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Feeds all the rows of a (30-minute) DataFrame to the engine
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DataFrame indexed by bin, with (at least) the input columns
+
+        Returns
+        -------
+        pd.DataFrame
+            Features of each row
+        """
+        features = [
+            self.update(ts_, row_) for ts_, row_ in zip(df.index, df.to_dict("records"))
+        ]
+        return pd.DataFrame(features, index=df.index, columns=self.columns)
+
+    def update_buffer(
+        self,
+        buffer: RingBuffer,
+        settled: pd.Timestamp,
+        fill: Callable[[np.ndarray], np.ndarray] = None,
+    ) -> dict[str, float]:
+        """
+        Catches up with the bins of a ring buffer and returns the features of its
+        last bin; only the bins before `settled` (which can no longer be revised)
+        update the state, the later ones are applied to a copy of the engine
+
+        The engine starts from the first observed bin of the buffer; bins which
+        left the buffer before being settled are treated as NaN.
+
+        Parameters
+        ----------
+        buffer : RingBuffer
+            Bins of the source of the input columns
+        settled : pd.Timestamp
+            First bin which may still be revised
+        fill : Callable[[np.ndarray], np.ndarray], optional
+            Function applied to the (time, column) values of the buffer before
+            they are fed, e.g. to fill their gaps, by default None
+
+        Returns
+        -------
+        dict[str, float]
+            Features of the last bin of the buffer
+        """
+        values = buffer.view().T
+        if fill is not None:
+            values = fill(values)
+        values = values[:, [buffer.columns.index(col_) for col_ in self.inputs]]
+        times = buffer.times()
+
+        if self.last_timestamp is None:
+            observed = np.flatnonzero(np.isfinite(values).any(axis=1))
+            if not len(observed):
+                return {name_: np.nan for name_ in self.columns}
+            first = times[observed[0]]
+        else:
+            first = self.last_timestamp + self.freq
+        pending = np.flatnonzero(times >= first)
+        is_settled = times[pending] < pd.Timestamp(settled)
+
+        for i_ in pending[is_settled]:
+            self.update(times[i_], dict(zip(self.inputs, values[i_])))
+        engine = self
+        if not is_settled.all():
+            engine = deepcopy(self)
+            for i_ in pending[~is_settled]:
+                engine.update(times[i_], dict(zip(self.inputs, values[i_])))
+
+        return engine.features
+
+    def save(self, path: Path):
+        """
+        Persists the state of the engine
+        """
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path: Path) -> "FeatureEngine":
+        """
+        Restores a previously saved engine
+        """
+        with open(path, "rb") as f:
+            return pickle.load(f)
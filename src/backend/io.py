@@ -1,8 +1,13 @@
 import requests
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from hashlib import sha1
 from io import StringIO, BytesIO
 from pathlib import Path
-from typing import Literal
+from time import perf_counter
+from typing import Literal, Union
+import csv
 import zipfile
 from urllib.parse import quote
 import re
@@ -10,13 +15,100 @@ import re
 import pandas as pd
 import numpy as np
 
-from backend import L1_DIST, BSN_DIST
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from backend import L1_DIST, BSN_DIST, FETCH_DEADLINE
+from backend.coupling import get_newell, propagate_to_bow_shock
+from backend.tracing import observe_response
+
+# Time (`perf_counter`) by which the HTTP requests in progress must be over
+_fetch_deadline: ContextVar[float] = ContextVar("fetch_deadline", default=None)
+
+
+@contextmanager
+def fetch_deadline(seconds: float):
+    """
+    Bounds the HTTP requests made within the block, and within the contexts
+    copied from it (e.g. by the threads of `fetch_sources`), to a time budget
+    from now: each request times out when the budget is spent, so that requests
+    running late fail rather than keep their threads busy
+
+    Parameters
+    ----------
+    seconds : float
+        Time budget, or None for the default one (FETCH_DEADLINE for each request)
+    """
+    token = _fetch_deadline.set(None if seconds is None else perf_counter() + seconds)
+    try:
+        yield
+    finally:
+        _fetch_deadline.reset(token)
+
+
+def _get_timeout() -> float:
+    # Time left before the deadline, if any (see `fetch_deadline`)
+    deadline = _fetch_deadline.get()
+    if deadline is None:
+        return FETCH_DEADLINE
+    return max(deadline - perf_counter(), 0.1)
+
+
+def _read_csv_pyarrow(
+    data_in_path: Path,
+    column_names: list[str],
+    datetime_format: str,
+    index_col: str = None,
+    usecols: list = None,
+) -> pd.DataFrame:
+    # Multi-threaded parsing of the projected columns only, with timestamps
+    # parsed by Arrow itself
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError as e:
+        raise ImportError("The pyarrow engine requires pyarrow to be installed") from e
+
+    if usecols is None:
+        positions = list(range(len(column_names)))
+    else:
+        if any(isinstance(col_, str) for col_ in usecols):
+            with open(data_in_path, newline="") as f:
+                header = next(csv.reader(f))
+        positions = sorted(
+            header.index(col_) if isinstance(col_, str) else col_ for col_ in usecols
+        )
+    if len(positions) != len(column_names):
+        raise ValueError("'column_names' must match the columns to be read")
+
+    # Columns are addressed by position, as header names may be duplicated
+    selected = [f"f{pos_}" for pos_ in positions]
+    table = pa_csv.read_csv(
+        data_in_path,
+        read_options=pa_csv.ReadOptions(
+            use_threads=True, skip_rows=1, autogenerate_column_names=True
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=selected,
+            column_types={
+                src_: pa.timestamp("ns")
+                for src_, name_ in zip(selected, column_names)
+                if name_ == index_col
+            },
+            timestamp_parsers=[datetime_format],
+        ),
+    )
+    return table.rename_columns(column_names).to_pandas()
 
 
 def read_time_series(
     data_in_path: Path,
     column_names: list[str],
     datetime_format: str = "%d-%b-%Y %H:%M:%S",
+    engine: Literal["c", "pyarrow"] = "c",
+    parquet_cache: bool = False,
     **kwargs,
 ) -> pd.DataFrame:
     """
@@ -30,24 +122,58 @@ def read_time_series(
         Column names for the resulting DataFrame
     datetime_format : str, optional
         String format (according to https://docs.python.org/3/library/datetime.html#strftime-and-strptime-behavior), by default "%d-%b-%Y %H:%M:%S"
+    engine : Literal["c", "pyarrow"], optional
+        CSV parser, by default "c" (pandas); "pyarrow" parses in multiple threads,
+        reads only the `usecols` columns and parses timestamps natively, but
+        supports no other keyword argument
+    parquet_cache : bool, optional
+        Whether to store the parsed data in a Parquet file alongside the CSV, and
+        read it from there (skipping text parsing) as long as the CSV is not
+        modified, by default False
 
     Returns
     -------
     pd.DataFrame
     """
-    df = pd.read_csv(
-        filepath_or_buffer=data_in_path,
-        header=0,
-        names=column_names,
-        **kwargs,
+    data_in_path = Path(data_in_path)
+    index_col = next(
+        (col_ for col_ in ["datetime", "date"] if col_ in column_names), None
     )
+    if parquet_cache:
+        # The sidecar depends on the columns and parsing options requested
+        key = sha1(
+            repr((column_names, datetime_format, sorted(kwargs.items()))).encode()
+        ).hexdigest()[:10]
+        sidecar = data_in_path.with_name(f"{data_in_path.stem}.{key}.parquet")
+        if sidecar.exists() and sidecar.stat().st_mtime >= data_in_path.stat().st_mtime:
+            return pd.read_parquet(sidecar)
+
+    if engine == "pyarrow":
+        unsupported = set(kwargs) - {"usecols"}
+        if unsupported:
+            raise ValueError(f"Unsupported arguments for pyarrow: {unsupported}")
+        df = _read_csv_pyarrow(
+            data_in_path,
+            column_names,
+            datetime_format,
+            index_col=index_col,
+            usecols=kwargs.get("usecols"),
+        )
+    else:
+        df = pd.read_csv(
+            filepath_or_buffer=data_in_path,
+            header=0,
+            names=column_names,
+            **kwargs,
+        )
+        if index_col is not None:
+            df[index_col] = pd.to_datetime(df[index_col], format=datetime_format)
 
-    if "datetime" in df.columns:
-        df["datetime"] = pd.to_datetime(df["datetime"], format=datetime_format)
-        df = df.set_index("datetime")
-    elif "date" in df.columns:
-        df["date"] = pd.to_datetime(df["date"], format=datetime_format)
-        df = df.set_index("date")
+    if index_col is not None:
+        df = df.set_index(index_col)
+
+    if parquet_cache:
+        df.to_parquet(sidecar)
 
     return df
 
@@ -79,6 +205,8 @@ def techtide_response(
         URL,
         headers={"accept": "application/zip"},
         verify=False,  # FIXME
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
 
 
@@ -209,8 +337,10 @@ def get_gfz_f107(end_date: str = None, last_n_days: int = 10) -> pd.DataFrame:
     pd.DataFrame
     """
     response = requests.get(
-        "https://www-app3.gfz-potsdam.de/kp_index/Kp_ap_Ap_SN_F107_nowcast.txt"
+        "https://www-app3.gfz-potsdam.de/kp_index/Kp_ap_Ap_SN_F107_nowcast.txt",
         # "https://www-app3.gfz-potsdam.de/kp_index/Kp_ap_Ap_SN_F107_since_1932.txt"
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
     if response.status_code != 200:
         raise Exception(f"Error while downloading data: {response.status_code}")
@@ -271,7 +401,9 @@ def _get_gfz_hp30(start: str, stop: str) -> pd.DataFrame:
     pd.DataFrame
     """
     response = requests.get(
-        "https://kp.gfz-potsdam.de/app/files/Hp30_ap30_complete_series.txt"
+        "https://kp.gfz-potsdam.de/app/files/Hp30_ap30_complete_series.txt",
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
     if response.status_code != 200:
         raise Exception(f"Error while downloading data: {response.status_code}")
@@ -350,7 +482,9 @@ def get_gfz_hp30(
     pd.DataFrame
     """
     response = requests.get(
-        "https://www-app3.gfz-potsdam.de/kp_index/Hp30_ap30_nowcast.txt"
+        "https://www-app3.gfz-potsdam.de/kp_index/Hp30_ap30_nowcast.txt",
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
     if response.status_code != 200:
         raise Exception(f"Error while downloading data: {response.status_code}")
@@ -414,6 +548,43 @@ def get_gfz_hp30(
         return df.loc[:end_datetime].tail(last_n_half_hours)
 
 
+def decode_swpc_json(
+    content: Union[bytes, str], columns: list[str] = None
+) -> pd.DataFrame:
+    """
+    Decodes a NOAA SWPC product, i.e. a JSON list of rows whose first row is the
+    header: the payload is parsed once (with orjson, if installed), and each
+    column is converted straight to a typed NumPy array, i.e. datetime64 for
+    the time columns (those named "*time_*") and float64 for all the others
+
+    Parameters
+    ----------
+    content : Union[bytes, str]
+        Raw JSON payload, e.g. `response.content`
+    columns : list[str], optional
+        Columns to be decoded, by default None (all of them)
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    header, *rows = json_loads(content)
+    columns = header if columns is None else columns
+    # Rows have a fixed length, so they are laid out as a 2-D array in one pass
+    table = np.array(rows, dtype=object).reshape(len(rows), len(header))
+
+    data = {}
+    for col_ in columns:
+        column = table[:, header.index(col_)]
+        if "time_" in col_:
+            data[col_] = column.astype("datetime64[ns]")
+        else:
+            # Missing values are null, and numbers may be quoted
+            data[col_] = np.where(column == None, np.nan, column).astype(float)
+
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
 def _get_noaa_l1(
     end_propagated_datetime: str, include_newell: bool = True
 ) -> pd.DataFrame:
@@ -436,19 +607,12 @@ def _get_noaa_l1(
     """
     cols = ["propagated_time_tag", "density", "by", "bz", "speed"]
 
-    df = pd.read_json(
+    response = requests.get(
         "https://services.swpc.noaa.gov/products/geospace/propagated-solar-wind-1-hour.json",
-        convert_dates=False,
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
-
-    df.columns = df.iloc[0]
-    df = df[1:][cols].reset_index(drop=True)
-
-    for col_ in cols:
-        if "time_" in col_:
-            df[col_] = pd.to_datetime(df[col_])
-        else:
-            df[col_] = pd.to_numeric(df[col_])
+    df = decode_swpc_json(response.content, columns=cols)
 
     # Assuming speed ~ |vx| -- gulp!
     df["vx"] = -df["speed"]
@@ -461,11 +625,9 @@ def _get_noaa_l1(
     )
 
     if include_newell:
-        df["newell"] = (
-            df["speed"] ** (4 / 3)
-            * (df["by"] ** 2 + df["bz"] ** 2) ** (1 / 3)
-            * (np.sin(np.arctan((df["by"].div(df["bz"]).abs())) / 2) ** (8 / 3))
-        ).round(1)
+        df["newell"] = np.round(
+            get_newell(df["speed"], df["by"], df["bz"], folded=True), 1
+        )
 
     return df[df["datetime"].lt(end_propagated_datetime)].set_index("datetime")
 
@@ -474,52 +636,38 @@ def get_noaa_l1(end_propagated_datetime: str) -> pd.DataFrame:
 
     try:
         response = requests.get(
-            "https://services.swpc.noaa.gov/products/solar-wind/mag-6-hour.json"
+            "https://services.swpc.noaa.gov/products/solar-wind/mag-6-hour.json",
+            hooks={"response": observe_response},
+            timeout=_get_timeout(),
         )
-        df_mag = pd.DataFrame(response.json()[1:], columns=response.json()[0])
+        df_mag = decode_swpc_json(response.content)
         response = requests.get(
-            "https://services.swpc.noaa.gov/products/solar-wind/plasma-6-hour.json"
+            "https://services.swpc.noaa.gov/products/solar-wind/plasma-6-hour.json",
+            hooks={"response": observe_response},
+            timeout=_get_timeout(),
         )
-        df_plasma = pd.DataFrame(response.json()[1:], columns=response.json()[0])
+        df_plasma = decode_swpc_json(response.content)
     except:
         raise Exception(
             f"Error in retrieving solar wind data. Status code: {response.status_code}. Text: {response.text}"
         )
 
     df = df_mag.merge(df_plasma, on="time_tag", how="outer")
-    df.index = pd.Index(pd.to_datetime(df.pop("time_tag")), name="datetime_measure")
-    df = df.apply(pd.to_numeric).reset_index()
+    df.index = pd.Index(df.pop("time_tag"), name="datetime_measure")
 
     df.columns = df.columns.str.removesuffix("_gsm")
 
-    df["seconds_to_arrive"] = np.round((L1_DIST - BSN_DIST) / df["speed"])
-    df["datetime"] = df["datetime_measure"] + pd.to_timedelta(
-        df["seconds_to_arrive"], unit="s"
-    )
-
-    df["newell"] = (
-        df["speed"] ** (4 / 3)
-        * (df["by"] ** 2 + df["bz"] ** 2) ** (1 / 3)
-        * (np.sin(np.arctan((df["by"].div(df["bz"]).abs())) / 2) ** (8 / 3))
-    ).round(1)
+    df["newell"] = np.round(get_newell(df["speed"], df["by"], df["bz"], folded=True), 1)
 
-    return (
-        df[df["datetime"].lt(end_propagated_datetime)]
-        .drop(
-            columns=[
-                "datetime_measure",
-                "seconds_to_arrive",
-                "lon",
-                "lat",
-                "temperature",
-                "bx",
-                "bt",
-            ]
-        )
-        .rename(columns={"density": "rho"})
-        .set_index("datetime")
+    df = propagate_to_bow_shock(
+        df.drop(columns=["lon", "lat", "temperature", "bx", "bt"]).rename(
+            columns={"density": "rho"}
+        ),
+        distance=L1_DIST - BSN_DIST,
     )
 
+    return df[df.index < pd.Timestamp(end_propagated_datetime)]
+
 
 def get_noaa_dst(end_datetime: str) -> pd.DataFrame:
     """
@@ -539,19 +687,16 @@ def get_noaa_dst(end_datetime: str) -> pd.DataFrame:
     """
     cols = ["time_tag", "dst"]
 
-    df = pd.read_json(
+    response = requests.get(
         "https://services.swpc.noaa.gov/products/kyoto-dst.json",
-        convert_dates=False,
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
+    df = decode_swpc_json(response.content, columns=cols)
 
-    df.columns = df.iloc[0]
-    df = df[1:][cols].reset_index(drop=True)
-
-    for col_ in cols:
-        if "time_" in col_:
-            df[col_] = pd.to_datetime(df[col_])
-        else:
-            df[col_] = pd.to_numeric(df[col_])
+    # Dst is an integer index (in nT), as returned by NOAA, unless values are missing
+    if df["dst"].notna().all():
+        df["dst"] = df["dst"].astype("int64")
 
     df = df.rename(
         columns={
@@ -572,7 +717,9 @@ def get_fmi_iu_ie() -> pd.DataFrame:
     pd.DataFrame
     """
     response = requests.get(
-        "https://space.fmi.fi/image/realtime/eurisgic/realtime_iu_il.txt"
+        "https://space.fmi.fi/image/realtime/eurisgic/realtime_iu_il.txt",
+        hooks={"response": observe_response},
+        timeout=_get_timeout(),
     )
     if response.status_code != 200:
         raise Exception(f"Error while downloading data: {response.status_code}")
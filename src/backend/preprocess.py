@@ -1,15 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from time import perf_counter
 from typing import Literal, Union
+import logging
+import pickle
 
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
 import pvlib
+from scipy.signal import lfilter
 
-from backend import LATITUDE, LONGITUDE, ALTITUDE, DATA_IN
+from backend import (
+    LATITUDE,
+    LONGITUDE,
+    ALTITUDE,
+    DATA_IN,
+    IONOSONDE_STATIONS,
+    IONOSONDE_LOCATIONS,
+    SZA_TABLE_PATH,
+    SZA_TABLE_VERSION,
+    SZA_TABLE_START,
+    SZA_TABLE_END,
+    SZA_ANALYTICAL_TOLERANCE,
+    VARIATION_CENTROIDS_PATH,
+)
+from backend.cache import memoize
 from backend.io import read_time_series
+from backend.schema import enforce_schema
 
+logger = logging.getLogger(__name__)
 
+
+@memoize()
 def resample_time_series(
     df: pd.DataFrame,
     aggregation_function: Union[
@@ -39,12 +62,209 @@ def resample_time_series(
     return df.resample(time_interval, on=on_column).agg(aggregation_function)
 
 
+_ALIGN_AGGREGATIONS = ("mean", "median", "min", "max", "first", "last")
+
+
+def align_time_series(
+    dfs: dict[str, pd.DataFrame],
+    aggregation_functions: dict[str, Union[str, dict[str, str]]],
+    time_interval: str = "30min",
+    start: Union[str, pd.Timestamp] = None,
+    end: Union[str, pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """
+    Resamples any number of time series onto a shared time grid, writing each
+    source straight into a preallocated array; equivalent to resampling each one
+    with `resample_time_series` and chaining outer merges, without the
+    intermediate (and ever-growing) copies
+
+    Parameters
+    ----------
+    dfs : dict[str, pd.DataFrame]
+        Sources (DataFrames with a DatetimeIndex), by name
+    aggregation_functions : dict[str, Union[str, dict[str, str]]]
+        Aggregation function of each source, among "mean", "median", "min", "max",
+        "first" and "last"; either a single function for all of its columns or a
+        dictionary of column -> function (columns left out are dropped)
+    time_interval : str, optional
+        Frequency of the grid, by default "30min"
+    start : Union[str, pd.Timestamp], optional
+        First bin of the grid, by default None (the earliest bin of all sources)
+    end : Union[str, pd.Timestamp], optional
+        Last bin of the grid, by default None (the latest bin of all sources);
+        observations outside the grid are discarded
+
+    Returns
+    -------
+    pd.DataFrame
+        Float64 DataFrame indexed by the full grid (bins without observations are
+        NaN), with the columns of all the sources in order; the schema of the
+        catalog frames is not applied, see `enforce_schema`
+    """
+    freq = pd.Timedelta(time_interval)
+    rules = {}
+    for name_, df_ in dfs.items():
+        how = aggregation_functions[name_]
+        rules[name_] = (
+            {col_: how for col_ in df_.columns} if isinstance(how, str) else how
+        )
+        unknown = set(rules[name_].values()) - set(_ALIGN_AGGREGATIONS)
+        if unknown:
+            raise ValueError(f"Unsupported aggregation for {name_}: {unknown}")
+    columns = [col_ for rule_ in rules.values() for col_ in rule_]
+    if len(set(columns)) < len(columns):
+        raise ValueError("Column names must be unique across sources")
+
+    # Shared grid
+    is_bounded = start is not None or end is not None
+    non_empty = [df_.index for df_ in dfs.values() if len(df_)]
+    start = (
+        min(idx_.min() for idx_ in non_empty).floor(freq)
+        if start is None
+        else pd.Timestamp(start)
+    )
+    end = (
+        max(idx_.max() for idx_ in non_empty).floor(freq)
+        if end is None
+        else pd.Timestamp(end)
+    )
+    index = pd.date_range(start, end, freq=freq, name="datetime")
+
+    data = np.full((len(index), len(columns)), np.nan)
+    j = 0
+    for name_, df_ in dfs.items():
+        rule = rules[name_]
+        if not df_.index.is_monotonic_increasing:
+            # Time order matters for "first" and "last"
+            df_ = df_.sort_index(kind="stable")
+        if is_bounded:
+            df_ = df_.loc[start : end + freq - pd.Timedelta(1, "ns")]
+        if len(df_):
+            # Each source is binned into a contiguous run of rows of the grid
+            binned = resample_time_series(
+                df_, aggregation_functions[name_], time_interval=time_interval
+            )
+            offset = (binned.index[0] - start) // freq
+            data[offset : offset + len(binned), j : j + len(rule)] = binned.to_numpy(
+                dtype=float
+            )
+        j += len(rule)
+
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def get_rolling_means(
+    values: np.ndarray, windows: list[int], min_periods: int = None
+) -> np.ndarray:
+    """
+    Rolling means of all the columns of a 2-D array, for each window, from a
+    single pass of cumulative sums; NaNs and `min_periods` are treated as in
+    `pd.Series.rolling(window, min_periods).mean()`, and values agree with it up
+    to floating-point rounding (so they can differ once rounded, see
+    `get_moving_avg` for features which must match pandas exactly)
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (time, columns)
+    windows : list[int]
+        Window lengths, in steps
+    min_periods : int, optional
+        Minimum number of observations in a window, by default None (the window
+        length)
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (time, windows x columns), window-major
+    """
+    # Series are laid out along rows, so that the cumulative sums are contiguous
+    series = np.asarray(values, dtype=float).reshape(len(values), -1).T.copy()
+    valid = ~np.isnan(series)
+    n_cols, n_rows = series.shape
+    # Centring on the mean of each series limits the growth of the cumulative sums
+    series[~valid] = 0
+    n_valid = valid.sum(axis=1, keepdims=True)
+    offset = series.sum(axis=1, keepdims=True) / np.maximum(n_valid, 1)
+    series -= offset
+    series[~valid] = 0
+    sums = np.zeros((n_cols, n_rows + 1))
+    counts = np.zeros((n_cols, n_rows + 1), dtype=np.int64)
+    np.cumsum(series, axis=1, out=sums[:, 1:])
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+
+    means = np.empty((len(windows) * n_cols, n_rows))
+    n_obs = np.empty((n_cols, n_rows), dtype=np.int64)
+    for i_, wd_ in enumerate(windows):
+        mean = means[i_ * n_cols : (i_ + 1) * n_cols]
+        # Windows are truncated at the start of the series
+        k = min(wd_, n_rows)
+        mean[:, :k], n_obs[:, :k] = sums[:, 1 : k + 1], counts[:, 1 : k + 1]
+        np.subtract(sums[:, k + 1 :], sums[:, 1 : n_rows - k + 1], out=mean[:, k:])
+        np.subtract(counts[:, k + 1 :], counts[:, 1 : n_rows - k + 1], out=n_obs[:, k:])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean /= n_obs
+        mean += offset
+        mean[n_obs < max(wd_ if min_periods is None else min_periods, 1)] = np.nan
+    return means.T
+
+
+def get_ewm_means(
+    values: np.ndarray, spans: list[float], min_periods: int = 0
+) -> np.ndarray:
+    """
+    Exponentially-weighted means of all the columns of a 2-D array, for each
+    span, as in `pd.Series.ewm(span, min_periods).mean()` (i.e. `adjust=True`
+    and `ignore_na=False`), computed as the ratio of two linear recursions
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (time, columns)
+    spans : list[float]
+        Spans of the exponential decay, in steps
+    min_periods : int, optional
+        Minimum number of observations, by default 0
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (time, spans x columns), span-major
+    """
+    values = np.asarray(values, dtype=float).reshape(len(values), -1)
+    valid = ~np.isnan(values)
+    inputs = np.concatenate([np.where(valid, values, 0), valid], axis=1)
+    n_obs = np.cumsum(valid, axis=0)
+
+    means = np.empty((len(values), len(spans) * values.shape[1]))
+    for i_, span_ in enumerate(spans):
+        decay = 1 - 2 / (span_ + 1)
+        # Exponentially-weighted sums of the values and of their weights
+        weighted = lfilter([1.0], [1.0, -decay], inputs, axis=0)
+        sum_values, sum_weights = np.split(weighted, 2, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = sum_values / sum_weights
+        mean[n_obs < max(min_periods, 1)] = np.nan
+        means[:, i_ * values.shape[1] : (i_ + 1) * values.shape[1]] = mean
+    return means
+
+
+@memoize()
 def get_moving_avg(
-    df: pd.DataFrame, cols: list[str], windows: list[int]
+    df: pd.DataFrame,
+    cols: list[str],
+    windows: list[int],
+    kind: Literal["rolling", "ewm"] = "rolling",
+    min_periods: int = None,
 ) -> pd.DataFrame:
     """
     Adds columns to the DataFrame with moving averages for each specified column and each time window
 
+    Simple moving averages are pandas' rolling means, one call per window over all
+    the columns: unlike the single pass of cumulative sums of `get_rolling_means`,
+    they round exactly as the training catalog did, which matters for features
+    served to the model. Exponentially-weighted ones come from `get_ewm_means`.
+
     Parameters
     ----------
     df : pd.DataFrame
@@ -53,24 +273,230 @@ def get_moving_avg(
         List of columns for which to calculate the moving average
     windows : list[int]
         List of time windows (in hours) for the moving average calculation
+    kind : Literal["rolling", "ewm"], optional
+        Simple moving averages (`{col}_mav_{window}h` columns) or exponentially-
+        weighted ones with a span of the same length (`{col}_ewm_{window}h`), by
+        default "rolling"
+    min_periods : int, optional
+        Minimum number of observations, by default None (the whole window for
+        simple moving averages, one observation for exponentially-weighted ones)
 
     Returns
     -------
     pd.DataFrame
-        DataFrame with the added moving average columns
+        New DataFrame with the added moving average columns (rounded to the
+        second decimal place), all attached at once
     """
     if not hasattr(cols, "__iter__") or not hasattr(windows, "__iter__"):
         raise ValueError("'cols' and 'windows' must both be iterable")
 
     periods = [2 * wd_ for wd_ in windows]
+    if kind == "rolling":
+        # These are served to the model, so they must match the training catalog
+        # to the last digit: pandas' compensated running sums are kept, rather
+        # than the cumulative sums of `get_rolling_means`
+        means = np.hstack(
+            [
+                df[cols].rolling(per_, min_periods=min_periods).mean().to_numpy()
+                for per_ in periods
+            ]
+        )
+    else:
+        values = df[cols].to_numpy(dtype=float)
+        means = get_ewm_means(values, periods, min_periods=min_periods or 0)
 
-    for col_ in cols:
-        for per_ in periods:
-            df[f"{col_}_mav_{per_/2:.0f}h"] = (
-                df[col_].rolling(window=int(per_)).mean().round(2)
-            )
+    # Columns are grouped by input column, then by window
+    suffix = "mav" if kind == "rolling" else "ewm"
+    names = [f"{col_}_{suffix}_{per_/2:.0f}h" for col_ in cols for per_ in periods]
+    order = [
+        i_ * len(cols) + j_ for j_ in range(len(cols)) for i_ in range(len(periods))
+    ]
+    means = means.T[order]
+    np.round(means, 2, out=means)
+    block = pd.DataFrame(means.T, index=df.index, columns=names, copy=False)
 
-    return df
+    return pd.concat([df.drop(columns=names, errors="ignore"), block], axis=1)
+
+
+def _to_utc_ns(time: pd.DatetimeIndex) -> np.ndarray:
+    # Nanoseconds since the epoch (UTC is assumed for naive timestamps)
+    time = pd.DatetimeIndex(time)
+    if time.tz is not None:
+        time = time.tz_convert("UTC").tz_localize(None)
+    return time.as_unit("ns").asi8
+
+
+def get_solar_zenith_analytical(
+    time: pd.DatetimeIndex,
+    latitude: Union[float, np.ndarray] = LATITUDE,
+    longitude: Union[float, np.ndarray] = LONGITUDE,
+) -> np.ndarray:
+    """
+    Vectorised (geocentric) solar zenith angle, from the NOAA solar position
+    equations (after Meeus); over 2014-2035 it agrees with the SPA algorithm used
+    by pvlib within SZA_ANALYTICAL_TOLERANCE degrees
+
+    The terms depending on time only (declination, equation of time) are computed
+    once and broadcast against the locations, so that N sites cost about as much
+    as one.
+
+    Parameters
+    ----------
+    time : pd.DatetimeIndex
+        Must be localized or UTC will be assumed
+    latitude : Union[float, np.ndarray], optional
+        Latitude(s) in decimal degrees; positive north of equator, negative to south
+    longitude : Union[float, np.ndarray], optional
+        Longitude(s) in decimal degrees; positive east of prime meridian, negative
+        to west
+
+    Returns
+    -------
+    np.ndarray
+        Solar zenith angle in degrees, with shape (time,) for a single location
+        and (time, location) otherwise
+    """
+    seconds = _to_utc_ns(time) / 1e9
+    # Julian centuries since J2000.0
+    T = (seconds / 86_400 + 2_440_587.5 - 2_451_545.0) / 36_525
+
+    mean_long = np.radians((280.46646 + T * (36_000.76983 + T * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + T * (35_999.05029 - 0.0001537 * T))
+    eccent = 0.016708634 - T * (0.000042037 + 0.0000001267 * T)
+    eq_of_centre = (
+        np.sin(mean_anom) * (1.914602 - T * (0.004817 + 0.000014 * T))
+        + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * T)
+        + np.sin(3 * mean_anom) * 0.000289
+    )
+    omega = np.radians(125.04 - 1_934.136 * T)
+    app_long = mean_long + np.radians(eq_of_centre - 0.00569 - 0.00478 * np.sin(omega))
+    obliquity = np.radians(
+        23
+        + (26 + (21.448 - T * (46.815 + T * (0.00059 - T * 0.001813))) / 60) / 60
+        + 0.00256 * np.cos(omega)
+    )
+    declination = np.arcsin(np.sin(obliquity) * np.sin(app_long))
+
+    y = np.tan(obliquity / 2) ** 2
+    eq_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_long)
+        - 2 * eccent * np.sin(mean_anom)
+        + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+        - 0.5 * y**2 * np.sin(4 * mean_long)
+        - 1.25 * eccent**2 * np.sin(2 * mean_anom)
+    )
+    solar_minutes = (seconds % 86_400) / 60 + eq_of_time
+
+    is_grid = np.ndim(latitude) > 0 or np.ndim(longitude) > 0
+    lat, lon = np.broadcast_arrays(np.radians(latitude), np.asarray(longitude, float))
+    if is_grid:
+        # (time, 1) against (1, location)
+        solar_minutes, declination = solar_minutes[:, None], declination[:, None]
+        lat, lon = lat.ravel()[None, :], lon.ravel()[None, :]
+
+    true_solar_time = (solar_minutes + 4 * lon) % 1_440
+    hour_angle = np.radians(true_solar_time / 4 - 180)
+    cos_zenith = np.sin(lat) * np.sin(declination) + np.cos(lat) * np.cos(
+        declination
+    ) * np.cos(hour_angle)
+    return np.degrees(np.arccos(np.clip(cos_zenith, -1, 1)))
+
+
+def build_solar_zenith_table(
+    start: str = SZA_TABLE_START,
+    end: str = SZA_TABLE_END,
+    latitude: float = LATITUDE,
+    longitude: float = LONGITUDE,
+    altitude: float = 0,
+    path: Path = SZA_TABLE_PATH,
+) -> dict:
+    """
+    Precomputes (with pvlib's SPA) the solar zenith angle of a site on the
+    30-minute grid, and stores it to disk for `get_solar_position`; the table is
+    checked against the analytical approximation, which `get_solar_position`
+    falls back on outside of it, and is not stored if they differ by more than
+    SZA_ANALYTICAL_TOLERANCE degrees
+
+    Parameters
+    ----------
+    start : str, optional
+        First half hour of the table, by default SZA_TABLE_START
+    end : str, optional
+        End of the table (excluded), by default SZA_TABLE_END
+    latitude : float, optional
+        Latitude in decimal degrees; positive north of equator, negative to south
+    longitude : float, optional
+        Longitude in decimal degrees; positive east of prime meridian, negative to west
+    altitude : float, optional
+        Altitude in metres, by default 0
+    path : Path, optional
+        Output file path, by default SZA_TABLE_PATH
+
+    Returns
+    -------
+    dict
+        Table (float32 zenith angles) along with its version and site metadata
+    """
+    time = pd.date_range(start, end, freq="30min", inclusive="left")
+    zenith = pvlib.solarposition.get_solarposition(
+        time=time, latitude=latitude, longitude=longitude, altitude=altitude
+    )["zenith"].to_numpy(dtype=np.float32)
+
+    max_error = np.max(
+        np.abs(
+            zenith
+            - get_solar_zenith_analytical(time, latitude=latitude, longitude=longitude)
+        )
+    )
+    if max_error > SZA_ANALYTICAL_TOLERANCE:
+        raise ValueError(
+            f"The analytical solar zenith angle differs from the table by up to "
+            f"{max_error:.3f} degrees (tolerance: {SZA_ANALYTICAL_TOLERANCE})"
+        )
+
+    table = {
+        "version": SZA_TABLE_VERSION,
+        "latitude": latitude,
+        "longitude": longitude,
+        "altitude": altitude,
+        "start": time[0],
+        "freq": pd.Timedelta("30min"),
+        "zenith": zenith,
+    }
+    with open(path, "wb") as f:
+        pickle.dump(table, f)
+    _load_solar_zenith_table.cache_clear()
+
+    return table
+
+
+@lru_cache(maxsize=1)
+def _load_solar_zenith_table() -> dict:
+    if not SZA_TABLE_PATH.exists():
+        return None
+    with open(SZA_TABLE_PATH, "rb") as f:
+        table = pickle.load(f)
+    return table if table["version"] == SZA_TABLE_VERSION else None
+
+
+def _lookup_solar_zenith(
+    time: pd.DatetimeIndex, latitude: float, longitude: float, altitude: float
+) -> np.ndarray:
+    # Table values for the timestamps on its grid (NaN elsewhere)
+    zenith = np.full(len(time), np.nan)
+    table = _load_solar_zenith_table()
+    if table is None or (table["latitude"], table["longitude"], table["altitude"]) != (
+        latitude,
+        longitude,
+        altitude,
+    ):
+        return zenith
+
+    offset = _to_utc_ns(time) - table["start"].value
+    pos, rem = np.divmod(offset, table["freq"].value)
+    on_grid = (rem == 0) & (pos >= 0) & (pos < len(table["zenith"]))
+    zenith[on_grid] = table["zenith"][pos[on_grid]]
+    return zenith
 
 
 def get_solar_position(
@@ -83,13 +509,14 @@ def get_solar_position(
         "azimuth",
         "equation_of_time",
     ] = ["zenith"],
-    latitude: float = LATITUDE,
-    longitude: float = LONGITUDE,
+    latitude: Union[float, np.ndarray, pd.Series] = LATITUDE,
+    longitude: Union[float, np.ndarray, pd.Series] = LONGITUDE,
     altitude: float = ALTITUDE,
+    method: Literal["table", "analytical", "spa"] = "table",
     **kwargs,
 ) -> pd.DataFrame:
     """
-    Convenience wrapper for solar position data
+    Convenience wrapper for solar position data, at one or more locations
 
     Parameters
     ----------
@@ -97,36 +524,366 @@ def get_solar_position(
         Must be localized or UTC will be assumed
     columns : list[str], optional
         Solar position attributes to return, by default ["zenith"]
-    latitude : float, optional
-        Latitude in decimal degrees; positive north of equator, negative to south
-    longitude : float, optional
-        Longitude in decimal degrees; positive east of prime meridian, negative to west
+    latitude : Union[float, np.ndarray, pd.Series], optional
+        Latitude(s) in decimal degrees; positive north of equator, negative to south
+    longitude : Union[float, np.ndarray, pd.Series], optional
+        Longitude(s) in decimal degrees; positive east of prime meridian, negative
+        to west
     altitude : float, optional
         Altitude in metres
+    method : Literal["table", "analytical", "spa"], optional
+        How zenith and elevation are obtained, by default "table": a lookup into
+        the precomputed table (see `build_solar_zenith_table`) for the timestamps
+        and site it covers, and the analytical approximation (accurate within
+        SZA_ANALYTICAL_TOLERANCE degrees) elsewhere; "analytical" always uses the
+        approximation, while "spa" (or any other column, or any keyword argument)
+        calls pvlib once per location
     **kwargs
         Other keywords to be passed to the underlying solar position function
 
     Returns
     -------
     pd.DataFrame
+        For a single location, one column per attribute; for arrays of locations,
+        (attribute, site) columns, where sites are labelled by the index of
+        `latitude` (or `longitude`) if it is a Series, and by position otherwise,
+        e.g. `get_solar_position(time, "zenith", lat, lon)` is a (time x site)
+        frame
     """
-    return pvlib.solarposition.get_solarposition(
-        time=time,
-        latitude=latitude,
-        longitude=longitude,
-        altitude=altitude,
-        **kwargs,  # FIXME is SZA accurate for 350km altitude?
-    )[columns]
+    requested = [columns] if isinstance(columns, str) else list(columns)
+    use_pvlib = (
+        method == "spa" or kwargs or not set(requested) <= {"zenith", "elevation"}
+    )
+
+    if np.ndim(latitude) == 0 and np.ndim(longitude) == 0:
+        if use_pvlib:
+            return pvlib.solarposition.get_solarposition(
+                time=time,
+                latitude=latitude,
+                longitude=longitude,
+                altitude=altitude,
+                **kwargs,  # FIXME is SZA accurate for 350km altitude?
+            )[columns]
+
+        if method == "table":
+            zenith = _lookup_solar_zenith(time, latitude, longitude, altitude)
+            missing = np.isnan(zenith)
+            if missing.any():
+                zenith[missing] = get_solar_zenith_analytical(
+                    time[missing], latitude=latitude, longitude=longitude
+                )
+        else:
+            zenith = get_solar_zenith_analytical(
+                time, latitude=latitude, longitude=longitude
+            )
+
+        return pd.DataFrame({"zenith": zenith, "elevation": 90 - zenith}, index=time)[
+            columns
+        ]
+
+    # Several locations
+    labels = next(
+        (v_.index for v_ in (latitude, longitude) if isinstance(v_, pd.Series)), None
+    )
+    lat, lon = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(latitude, float)),
+        np.atleast_1d(np.asarray(longitude, float)),
+    )
+    sites = pd.RangeIndex(len(lat)) if labels is None else labels
+
+    if use_pvlib:
+        frames = [
+            pvlib.solarposition.get_solarposition(
+                time=time, latitude=lat_, longitude=lon_, altitude=altitude, **kwargs
+            )
+            for lat_, lon_ in zip(lat, lon)
+        ]
+        df = pd.concat(frames, axis=1, keys=sites).swaplevel(axis=1)
+        return df.sort_index(axis=1, level=0, sort_remaining=False)[columns]
+
+    zenith = get_solar_zenith_analytical(time, latitude=lat, longitude=lon)
+    if method == "table":
+        for i_, (lat_, lon_) in enumerate(zip(lat, lon)):
+            table_zenith = _lookup_solar_zenith(time, lat_, lon_, altitude)
+            found = ~np.isnan(table_zenith)
+            zenith[found, i_] = table_zenith[found]
+
+    df = pd.concat(
+        {
+            "zenith": pd.DataFrame(zenith, index=time, columns=sites),
+            "elevation": pd.DataFrame(90 - zenith, index=time, columns=sites),
+        },
+        axis=1,
+    )
+    return df[columns]
 
 
+def _kmeans_1d_single(x: np.ndarray, n_clusters: int) -> np.ndarray:
+    # Dynamic programming over the sorted values, with the divide-and-conquer
+    # optimisation (optimal split points are monotone), in O(k n log n)
+    n = len(x)
+    cs = np.concatenate([[0.0], np.cumsum(x)])
+    cs2 = np.concatenate([[0.0], np.cumsum(x**2)])
+
+    def cost(i, j):
+        # Within-cluster sum of squares of x[i:j]
+        s = cs[j] - cs[i]
+        return (cs2[j] - cs2[i]) - s * s / (j - i)
+
+    D = np.full((n_clusters, n), np.inf)
+    B = np.zeros((n_clusters, n), dtype=int)
+    D[0] = cost(0, np.arange(1, n + 1))
+
+    for m in range(1, n_clusters):
+        # D[m, j]: cost of m + 1 clusters over x[: j + 1], the last one starting
+        # at B[m, j]; all the intervals of a recursion level are solved at once
+        lo, hi = np.array([m]), np.array([n - 1])
+        opt_lo, opt_hi = np.array([m]), np.array([n - 1])
+        while len(lo):
+            mid = (lo + hi) // 2
+            first = np.maximum(m, opt_lo)
+            lengths = np.minimum(mid, opt_hi) - first + 1
+            seg = np.repeat(np.arange(len(mid)), lengths)
+            seg_start = np.cumsum(lengths) - lengths
+            starts = first[seg] + np.arange(len(seg)) - seg_start[seg]
+            costs = D[m - 1, starts - 1] + cost(starts, mid[seg] + 1)
+            # First (i.e. leftmost) minimum of each interval
+            is_min = costs == np.minimum.reduceat(costs, seg_start)[seg]
+            _, first_min = np.unique(seg[is_min], return_index=True)
+            best = np.flatnonzero(is_min)[first_min]
+            D[m, mid], B[m, mid] = costs[best], starts[best]
+
+            lo, hi = np.concatenate([lo, mid + 1]), np.concatenate([mid - 1, hi])
+            opt_lo = np.concatenate([opt_lo, starts[best]])
+            opt_hi = np.concatenate([starts[best], opt_hi])
+            keep = lo <= hi
+            lo, hi, opt_lo, opt_hi = lo[keep], hi[keep], opt_lo[keep], opt_hi[keep]
+
+    return B
+
+
+def _kmeans_1d_batch(X: np.ndarray, n_clusters: int) -> np.ndarray:
+    # Plain O(k n^2) dynamic programming, vectorised over the rows
+    n_rows, n = X.shape
+    cs = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(X, axis=1)], axis=1)
+    cs2 = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(X**2, axis=1)], axis=1)
+
+    # C[:, i, j]: within-cluster sum of squares of x[i : j + 1]
+    i, j = np.triu_indices(n)
+    C = np.full((n_rows, n, n), np.inf)
+    s = cs[:, j + 1] - cs[:, i]
+    C[:, i, j] = (cs2[:, j + 1] - cs2[:, i]) - s * s / (j - i + 1)
+
+    D = C[:, 0, :]
+    B = np.zeros((n_clusters, n_rows, n), dtype=int)
+    for m in range(1, n_clusters):
+        # The last cluster starts at index 1 + argmin, after m earlier clusters
+        candidates = D[:, :-1, None] + C[:, 1:, :]
+        candidates[:, : m - 1, :] = np.inf
+        B[m] = 1 + np.argmin(candidates, axis=1)
+        D = np.min(candidates, axis=1)
+
+    return B
+
+
+def kmeans_1d(values: np.ndarray, n_clusters: int = 3) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact (globally optimal) K-Means clustering of one-dimensional data, by
+    dynamic programming over the sorted values; unlike Lloyd's algorithm, it is
+    deterministic and needs no restarts
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values to cluster; if 2-D, each row is clustered independently (which is
+        convenient for many short series, e.g. rolling windows)
+    n_clusters : int, optional
+        Number of clusters, by default 3
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Labels (ordered by cluster centre, i.e. 0 for the lowest one) with the
+        same shape as `values`, and cluster centres in ascending order
+    """
+    values = np.asarray(values, dtype=float)
+    if not np.isfinite(values).all():
+        raise ValueError("'values' must not contain NaN or infinite values")
+    if values.shape[-1] < n_clusters:
+        raise ValueError(
+            f"n_samples={values.shape[-1]} should be >= n_clusters={n_clusters}"
+        )
+
+    X = np.atleast_2d(values)
+    order = np.argsort(X, axis=1, kind="stable")
+    X_sorted = np.take_along_axis(X, order, axis=1)
+    n_rows, n = X_sorted.shape
+
+    if values.ndim == 1:
+        B = _kmeans_1d_single(X_sorted[0], n_clusters)[:, None, :]
+    else:
+        B = _kmeans_1d_batch(X_sorted, n_clusters)
+
+    # Backtrack the cluster boundaries, from the last cluster to the first one
+    rows = np.arange(n_rows)
+    labels_sorted = np.zeros((n_rows, n), dtype=int)
+    centers = np.zeros((n_rows, n_clusters))
+    cs = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(X_sorted, axis=1)], axis=1)
+    end = np.full(n_rows, n)
+    positions = np.arange(n)
+    for m in range(n_clusters - 1, -1, -1):
+        start = B[m, rows, end - 1] if m > 0 else np.zeros(n_rows, dtype=int)
+        in_cluster = (positions >= start[:, None]) & (positions < end[:, None])
+        labels_sorted[in_cluster] = np.broadcast_to(m, labels_sorted.shape)[in_cluster]
+        centers[:, m] = (cs[rows, end] - cs[rows, start]) / (end - start)
+        end = start
+
+    labels = np.empty_like(labels_sorted)
+    np.put_along_axis(labels, order, labels_sorted, axis=1)
+
+    if values.ndim == 1:
+        return labels[0], centers[0]
+    return labels, centers
+
+
+def get_log_diff(values: np.ndarray) -> np.ndarray:
+    """
+    Convenience function which evaluates the log-differences of a (smoothed) time
+    series, with an offset in case of negative values
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values of the time series
+
+    Returns
+    -------
+    np.ndarray
+        Log-differences, one for each pair of consecutive values
+    """
+    if not (values < 0).sum() > 0:
+        return np.diff(np.log1p(values))
+    return np.diff(np.log1p(values + abs(np.nanmin(values))))
+
+
+def get_log_diff_labels(
+    values: np.ndarray, n_categories: int = 3, centroids: np.ndarray = None
+) -> np.ndarray:
+    """
+    Convenience function which clusters the log-differences of a (smoothed) time
+    series, returning labels ordered by cluster centre (i.e., 0 for the steepest
+    decrease and `n_categories - 1` for the steepest increase)
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values of the time series
+    n_categories : int, optional
+        Number of categories to extract, by default 3
+    centroids : np.ndarray, optional
+        Cluster centres fitted beforehand (see `fit_variation_centroids`), by
+        default None; if provided, each log-difference is assigned to the nearest
+        centre and no clustering takes place
+
+    Returns
+    -------
+    np.ndarray
+        Estimated labels (categories), one for each pair of consecutive values
+    """
+    log_diff = get_log_diff(values)
+
+    if centroids is not None:
+        centroids = np.sort(centroids)
+        return np.searchsorted((centroids[1:] + centroids[:-1]) / 2, log_diff)
+
+    labels, _ = kmeans_1d(log_diff, n_clusters=n_categories)
+    return labels
+
+
+def fit_variation_centroids(
+    series: pd.Series, window: int = 12, n_categories: int = 3
+) -> np.ndarray:
+    """
+    Convenience function which fits the variation categories once, on a whole
+    (training) time series, so that new values can be categorised without any
+    clustering; the resulting centres are meant to be stored along with the model,
+    at `VARIATION_CENTROIDS_PATH`
+
+    Parameters
+    ----------
+    series : pd.Series
+        Time series to categorise, e.g. the IE index of the training catalog
+    window : int, optional
+        Time window steps for (causal) EMA smoothing, by default 12
+    n_categories : int, optional
+        Number of categories to extract, by default 3
+
+    Returns
+    -------
+    np.ndarray
+        Cluster centres of the log-differences, in ascending order
+    """
+    log_diff = get_log_diff(series.ewm(span=window).mean().values)
+    _, centers = kmeans_1d(log_diff[np.isfinite(log_diff)], n_clusters=n_categories)
+    return centers
+
+
+def save_variation_centroids(
+    df: pd.DataFrame,
+    columns: list[str] = ["ie", "iu"],
+    window: int = 12,
+    n_categories: int = 3,
+    path: Path = VARIATION_CENTROIDS_PATH,
+) -> dict[str, np.ndarray]:
+    """
+    Fits the variation centroids of each column of the training catalog (see
+    `fit_variation_centroids`) and stores them at `path`, where serving loads
+    them from; to be run whenever the model is retrained
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Training catalog on the 30-minute grid
+    columns : list[str], optional
+        Columns whose variations are categorised, by default ["ie", "iu"]
+    window : int, optional
+        Time window steps for (causal) EMA smoothing, by default 12 (as in serving)
+    n_categories : int, optional
+        Number of categories to extract, by default 3
+    path : Path, optional
+        Output file path, by default VARIATION_CENTROIDS_PATH
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Column names mapped to their cluster centres
+    """
+    centroids = {
+        col_: fit_variation_centroids(
+            df[col_], window=window, n_categories=n_categories
+        )
+        for col_ in columns
+    }
+    with open(path, "wb") as f:
+        pickle.dump(centroids, f)
+
+    return centroids
+
+
+@memoize()
 def get_categories(
-    series: pd.Series, window: int = 10, n_categories: int = 3, zero_phase: bool = True
+    series: pd.Series,
+    window: int = 10,
+    n_categories: int = 3,
+    zero_phase: bool = True,
+    centroids: np.ndarray = None,
 ) -> tuple[pd.Series, np.ndarray]:
     """
     Convenience function which filters the time series with a exponentially-weighted
     moving average (EMA) or with a forward-backward (FB) EMA (if `zero_phase` is set
-    to True); the function then fits a K-Means algorithm and returns the smoothed
-    values along with the estimated labels (categories)
+    to True); the function then fits an exact 1-D K-Means (or uses the given
+    centroids) and returns the smoothed values along with the estimated labels
+    (categories)
 
     Parameters
     ----------
@@ -140,6 +897,9 @@ def get_categories(
         Whether or not to make the filter zero-phase (i.e., a non-causal filter),
         by default True; if the filter is zero-phase, the smoothed series is not
         appropriate for prediction due to data leakage from future values
+    centroids : np.ndarray, optional
+        Cluster centres fitted beforehand (see `fit_variation_centroids`), by
+        default None (clusters are fitted on the series itself)
 
     Returns
     -------
@@ -152,36 +912,130 @@ def get_categories(
         # Backward filtering as well
         filtered_series = filtered_series[::-1].ewm(span=window).mean()[::-1]
 
-    zeroes = filtered_series.lt(0).sum() > 0
+    labels = get_log_diff_labels(
+        filtered_series.values, n_categories=n_categories, centroids=centroids
+    )
 
-    # Evaluate log-differences (with an offset in case of negative values)
-    if not zeroes:
-        log_diff = np.diff(np.log1p(filtered_series.values))
-    else:
-        log_diff = np.diff(
-            np.log1p(filtered_series.values + abs(filtered_series.min()))
-        )
+    return filtered_series, labels
+
+
+def get_propagation_features(
+    df: pd.DataFrame, stations: list[str] = None, time_interval: str = "30min"
+) -> pd.DataFrame:
+    """
+    Network-wide TID propagation features, for each time bin: the mean propagation
+    vector of all the stations, weighted by their spectral contribution (in its
+    eastward and northward components, in m/s, and as speed and azimuth), and
+    its coherence, i.e. the length of the weighted mean of the unit propagation
+    directions (1 if all the stations agree on the direction, close to 0 if
+    directions are scattered)
+
+    Stations and samples are handled as a (station, time) tensor: per-sample sums
+    across stations are reduced into bins with a single `np.add.reduceat`, so
+    every observation in a bin counts, whatever its station.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Wide frame with `velocity_{station}`, `azimuth_{station}` (in degrees,
+        clockwise from North) and `spectral_contribution_{station}` columns, e.g.
+        as returned by `get_techtide_ionosondes`
+    stations : list[str], optional
+        Station suffixes, by default None (the keys of IONOSONDE_LOCATIONS)
+    time_interval : str, optional
+        Width of the time bins, by default "30min"
+
+    Returns
+    -------
+    pd.DataFrame
+        `tid_east`, `tid_north`, `tid_speed`, `tid_azimuth` (in degrees, in
+        [0, 360)), `tid_coherence` and `tid_n_obs` (number of observations) for
+        each bin with at least one observation (no rows, if `df` is empty)
+    """
+    stations = list(IONOSONDE_LOCATIONS) if stations is None else stations
+    df = df if df.index.is_monotonic_increasing else df.sort_index()
+
+    def tensor(quantity: str) -> np.ndarray:
+        cols = [f"{quantity}_{st_}" for st_ in stations]
+        return df.reindex(columns=cols).to_numpy(dtype=float).T
+
+    velocity, weight = tensor("velocity"), tensor("spectral_contribution")
+    azimuth = np.radians(tensor("azimuth"))
+    valid = np.isfinite(velocity) & np.isfinite(azimuth) & (weight > 0)
+    weight = np.where(valid, weight, 0.0)
+    sin, cos = np.sin(azimuth), np.cos(azimuth)
 
-    # Fit the clustering model
-    km = KMeans(n_clusters=n_categories, n_init="auto", random_state=42).fit(
-        log_diff.reshape(-1, 1)
+    # Weighted sums across stations, for each sample: (quantity, time)
+    sums = np.stack(
+        [
+            np.nansum(weight * velocity * sin, axis=0),
+            np.nansum(weight * velocity * cos, axis=0),
+            np.nansum(weight * sin, axis=0),
+            np.nansum(weight * cos, axis=0),
+            weight.sum(axis=0),
+            valid.sum(axis=0),
+        ]
     )
-    lb = km.labels_
 
-    # Change the labels to get some semblance of order
-    cluster_centers = km.cluster_centers_.flatten()
-    temp = [(cluster_centers[i], i) for i in range(n_categories)]
-    temp = sorted(temp, key=lambda x: x[0])
+    # First sample of each bin (none, for an empty frame)
+    bins = df.index.floor(time_interval)
+    starts = np.flatnonzero(np.r_[len(bins) > 0, bins[1:] != bins[:-1]])
+    east, north, sin_sum, cos_sum, weight_sum, n_obs = np.add.reduceat(
+        sums, starts, axis=1
+    )
 
-    labels = np.zeros(len(lb), dtype=int)
-    for i in range(1, n_categories):
-        old_lb = temp[i][1]
-        idx = np.where(lb == old_lb)[0]
-        labels[idx] = i
+    with np.errstate(divide="ignore", invalid="ignore"):
+        east, north = east / weight_sum, north / weight_sum
+        coherence = np.hypot(sin_sum, cos_sum) / weight_sum
+    df_tid = pd.DataFrame(
+        {
+            "tid_east": east,
+            "tid_north": north,
+            "tid_speed": np.hypot(east, north),
+            "tid_azimuth": np.degrees(np.arctan2(east, north)) % 360,
+            "tid_coherence": coherence,
+            "tid_n_obs": n_obs.astype(int),
+        },
+        index=bins[starts].rename("datetime"),
+    )
 
-    return filtered_series, labels
+    return df_tid[df_tid["tid_n_obs"] > 0]
+
+
+def get_station_solar_zenith(
+    time: pd.DatetimeIndex, stations: list[str] = None
+) -> pd.DataFrame:
+    """
+    Solar zenith angle at the location of each ionosonde (see
+    IONOSONDE_LOCATIONS), all stations being computed in a single vectorised call
+    of `get_solar_position`
+
+    Parameters
+    ----------
+    time : pd.DatetimeIndex
+        Must be localized or UTC will be assumed
+    stations : list[str], optional
+        Station suffixes, by default None (the keys of IONOSONDE_LOCATIONS)
+
+    Returns
+    -------
+    pd.DataFrame
+        `solar_zenith_angle_{station}` columns (in degrees, rounded to the first
+        decimal place as the served `solar_zenith_angle`), indexed by `time`
+    """
+    stations = list(IONOSONDE_LOCATIONS) if stations is None else stations
+    latitude, longitude = zip(*(IONOSONDE_LOCATIONS[st_] for st_ in stations))
+    zenith = get_solar_position(
+        time,
+        columns="zenith",
+        latitude=pd.Series(latitude, index=stations),
+        longitude=pd.Series(longitude, index=stations),
+    )
+
+    return zenith.round(1).add_prefix("solar_zenith_angle_")
 
 
+@memoize(files=lambda station_name, **_: [Path(DATA_IN, f"{station_name}.csv")])
 def preprocess_ionosonde_data(
     station_name: str,
     aggregation_function: Union[
@@ -219,6 +1073,8 @@ def preprocess_ionosonde_data(
             "datetime",
         ],
         usecols=[12, 13, 14, 15, 18],
+        engine="pyarrow",
+        parquet_cache=True,
     )
 
     # Make the azimuth angle smooth
@@ -231,23 +1087,96 @@ def preprocess_ionosonde_data(
         time_interval=resample_time_interval,
     )
 
-    # Categorisation of the local warning level (TrL)
-    conds = [
-        df_ionosonde_30["local_warning_level"].eq(0),
-        df_ionosonde_30["local_warning_level"].eq(1),
-        df_ionosonde_30["local_warning_level"].eq(2),
-        df_ionosonde_30["local_warning_level"].eq(3),
-        df_ionosonde_30["local_warning_level"].eq(4),
-        df_ionosonde_30["local_warning_level"].eq(5),
-    ]
-    choices = ["no data", "quiet", "weak", "moderate", "strong", "very strong"]
-    df_ionosonde_30["local_warning_level"] = np.select(
-        condlist=conds, choicelist=choices, default="X"
-    )
-
     # Adding suffixes to all columns
     df_ionosonde_30.columns = [
         col_ + f"_{station_abbreviation}" for col_ in df_ionosonde_30.columns
     ]
 
+    # Local warning levels (TrL) become categories, physical quantities float32
+    df_ionosonde_30 = enforce_schema(df_ionosonde_30, name=station_name)
+
     return df_ionosonde_30
+
+
+def _timed_preprocess_ionosonde_data(
+    station_name: str, aggregation_function, resample_time_interval: str
+) -> tuple[pd.DataFrame, float]:
+    # Worker task: the elapsed time is measured in the worker process itself
+    start = perf_counter()
+    df = preprocess_ionosonde_data(
+        station_name=station_name,
+        aggregation_function=aggregation_function,
+        resample_time_interval=resample_time_interval,
+    )
+    return df, perf_counter() - start
+
+
+def preprocess_ionosonde_network(
+    station_names: list[str] = None,
+    aggregation_function: Union[
+        Literal["mean", "median", "max"], dict[str, Union[str, list[str]]]
+    ] = "median",
+    resample_time_interval: str = "30min",
+    max_workers: int = None,
+    station_zenith: bool = True,
+) -> pd.DataFrame:
+    """
+    Convenience function that preprocesses (see `preprocess_ionosonde_data`) the
+    data of several ionosondes in a pool of processes, one station per task, and
+    joins them into a single wide DataFrame
+
+    Parameters
+    ----------
+    station_names : list[str], optional
+        Names of the ionosondes, by default None (all of IONOSONDE_STATIONS)
+    aggregation_function : Union[Literal["mean", "median", "max"], dict[str, Union[str, list[str]]]], optional
+        Aggregation function to use for resampling the original time series, by
+        default "median"
+    resample_time_interval : str, optional
+        String format (according to https://docs.python.org/3/library/datetime.html#strftime-and-strptime-behavior), by default "30min"
+    max_workers : int, optional
+        Number of worker processes, by default None (as many as the CPUs); with
+        1, stations are processed sequentially in the current process
+    station_zenith : bool, optional
+        Whether to add the solar zenith angle at each station with a known
+        location (see `get_station_solar_zenith`), by default True
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns of all the stations (with their suffixes), on the union of their
+        time indices; the processing time (in seconds) of each station is in
+        `df.attrs["station_timings"]`
+    """
+    station_names = IONOSONDE_STATIONS if station_names is None else station_names
+    tasks = [
+        (st_, aggregation_function, resample_time_interval) for st_ in station_names
+    ]
+
+    if max_workers == 1:
+        results = [_timed_preprocess_ionosonde_data(*task_) for task_ in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_timed_preprocess_ionosonde_data, *zip(*tasks)))
+
+    timings = {}
+    for station_, (_, seconds_) in zip(station_names, results):
+        timings[station_] = seconds_
+        logger.info(f"Ionosonde {station_} preprocessed in {seconds_:.2f} s")
+
+    df = pd.concat([df_ for df_, _ in results], axis=1)
+    if station_zenith:
+        stations = [
+            st_[:2].lower()
+            for st_ in station_names
+            if st_[:2].lower() in IONOSONDE_LOCATIONS
+        ]
+        if stations:
+            df = df.join(
+                enforce_schema(
+                    get_station_solar_zenith(df.index, stations), name="station SZA"
+                )
+            )
+    df.attrs["station_timings"] = timings
+
+    return df
@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+
+from backend import DATA_QUALITY_POLICY
+
+_FILL_METHODS = (None, "ffill", "interpolate")
+
+
+def get_column_policies(policy: dict[str, dict] = DATA_QUALITY_POLICY) -> dict:
+    """
+    Expands a per-source data-quality policy (see DATA_QUALITY_POLICY) into the
+    rules of each column
+
+    Parameters
+    ----------
+    policy : dict[str, dict], optional
+        Sources mapped to their policy, by default DATA_QUALITY_POLICY
+
+    Returns
+    -------
+    dict
+        Columns mapped to their "sentinels", "valid_range", "fill", "max_gap" and
+        "flag" rules
+    """
+    rules = {}
+    for name_, source_ in policy.items():
+        if source_.get("fill") not in _FILL_METHODS:
+            raise ValueError(f"Unsupported fill method for {name_}: {source_['fill']}")
+        for col_ in source_["columns"]:
+            if col_ in rules:
+                raise ValueError(f"Column {col_} has more than one policy")
+            rules[col_] = {
+                "sentinels": list(source_.get("sentinels", [])),
+                "valid_range": source_.get("valid_range", {}).get(
+                    col_, (-np.inf, np.inf)
+                ),
+                "fill": source_.get("fill"),
+                "max_gap": source_.get("max_gap", 0),
+                "flag": source_.get("flag", False),
+            }
+    return rules
+
+
+def _get_invalid(values: np.ndarray, rules: list[dict]) -> np.ndarray:
+    # Sentinels (padded with NaN, which compares unequal to anything) and values
+    # out of the valid range, for all the columns at once
+    n_sentinels = max([len(r_["sentinels"]) for r_ in rules], default=0)
+    sentinels = np.full((n_sentinels, 1, len(rules)), np.nan)
+    for j_, rule_ in enumerate(rules):
+        sentinels[: len(rule_["sentinels"]), 0, j_] = rule_["sentinels"]
+    low, high = np.array([r_["valid_range"] for r_ in rules]).reshape(-1, 2).T
+    with np.errstate(invalid="ignore"):
+        return (values == sentinels).any(axis=0) | (values < low) | (values > high)
+
+
+def mask_invalid_values(
+    df: pd.DataFrame, policy: dict[str, dict] = DATA_QUALITY_POLICY
+) -> pd.DataFrame:
+    """
+    Replaces the sentinel values and the values out of their valid range with
+    NaN, according to the data-quality policy of their columns; meant for the raw
+    observations of a source, before they are resampled (a single sentinel would
+    otherwise bias the aggregate of its bin, and go unnoticed), both in catalog
+    builds and on the live path
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Observations of a source (or of several ones)
+    policy : dict[str, dict], optional
+        Data-quality policy of each source, by default DATA_QUALITY_POLICY
+
+    Returns
+    -------
+    pd.DataFrame
+        New DataFrame, where the invalid values are NaN; their number for each
+        column is stored in `attrs["n_invalid"]`
+    """
+    rules = get_column_policies(policy)
+    cols = [col_ for col_ in df.columns if col_ in rules]
+    values = df[cols].to_numpy(dtype=float, copy=True)
+    invalid = _get_invalid(values, [rules[col_] for col_ in cols])
+    values[invalid] = np.nan
+
+    df = df.copy()
+    df[cols] = values
+    df.attrs["n_invalid"] = dict(zip(cols, invalid.sum(axis=0).tolist()))
+    return df
+
+
+def _fill_gaps(values: np.ndarray, rules: list[dict]) -> tuple[np.ndarray, ...]:
+    # Filled (time, column) values (modified in place), along with the invalid
+    # and missing bins, the length of the gap each bin lies in, and the filled bins
+    n_rows = len(values)
+
+    # Raw observations should already be masked (see `mask_invalid_values`):
+    # this only catches the bins of sources which were not
+    invalid = _get_invalid(values, rules)
+    values[invalid] = np.nan
+
+    # Last and next observation of each bin, and length of the gap it lies in
+    missing = np.isnan(values)
+    rows = np.arange(n_rows)[:, np.newaxis]
+    prev_obs = np.maximum.accumulate(np.where(missing, -1, rows), axis=0)
+    next_obs = np.where(missing, n_rows, rows)
+    next_obs = np.minimum.accumulate(next_obs[::-1], axis=0)[::-1]
+    gap_length = np.where(missing, next_obs - prev_obs - 1, 0)
+
+    max_gap = np.array([r_["max_gap"] for r_ in rules])
+    method = np.array([r_["fill"] for r_ in rules], dtype=object)
+    fillable = missing & (gap_length <= max_gap) & (prev_obs >= 0)
+    interpolated = fillable & (method == "interpolate") & (next_obs < n_rows)
+    ffilled = fillable & (method == "ffill")
+
+    prev_values = np.take_along_axis(values, np.maximum(prev_obs, 0), axis=0)
+    next_values = np.take_along_axis(values, np.minimum(next_obs, n_rows - 1), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = (rows - prev_obs) / (next_obs - prev_obs)
+    filled = np.where(ffilled, prev_values, values)
+    filled = np.where(
+        interpolated, prev_values + weights * (next_values - prev_values), filled
+    )
+
+    return filled, invalid, missing, gap_length, ffilled | interpolated
+
+
+def fill_gaps(
+    values: np.ndarray,
+    columns: list[str],
+    policy: dict[str, dict] = DATA_QUALITY_POLICY,
+) -> np.ndarray:
+    """
+    Array counterpart of `apply_quality_policy`, for series which are not held in
+    a DataFrame (e.g. ring buffers): invalid bins become NaN and the gaps are
+    filled according to the policy of their column, without any gap flag
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Series on a regular grid, with shape (time, column)
+    columns : list[str]
+        Column names; columns without a policy are left untouched
+    policy : dict[str, dict], optional
+        Data-quality policy of each source, by default DATA_QUALITY_POLICY
+
+    Returns
+    -------
+    np.ndarray
+        New array with the cleaned values
+    """
+    rules = get_column_policies(policy)
+    cols = [j_ for j_, col_ in enumerate(columns) if col_ in rules]
+    values = np.array(values, dtype=float)
+    if len(values) and cols:
+        values[:, cols] = _fill_gaps(
+            values[:, cols], [rules[columns[j_]] for j_ in cols]
+        )[0]
+    return values
+
+
+def apply_quality_policy(
+    df: pd.DataFrame, policy: dict[str, dict] = DATA_QUALITY_POLICY
+) -> pd.DataFrame:
+    """
+    Cleans the aligned 30-minute series of all the sources (see
+    `align_time_series`) according to their data-quality policy, in one
+    vectorised pass over the whole matrix: bins out of their valid range become
+    NaN, each run of missing bins (i.e. gap) is measured, and gaps up to the
+    longest allowed are forward-filled or linearly interpolated; sentinels are to
+    be masked in the raw observations beforehand, see `mask_invalid_values`
+
+    A gap is filled entirely or not at all, so that long outages are left missing
+    rather than padded with stale values; interpolation only fills gaps between
+    two observations, while forward-filling also fills the trailing gap (e.g. a
+    source with some latency). Columns without a policy are left untouched.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Series on a regular grid, one per column
+    policy : dict[str, dict], optional
+        Data-quality policy of each source, by default DATA_QUALITY_POLICY
+
+    Returns
+    -------
+    pd.DataFrame
+        New DataFrame with the cleaned columns, plus a `{col}_gap` column (1 for
+        the bins which were missing, whether filled or not) for the flagged ones;
+        gap statistics of each column are stored in `attrs["gap_stats"]`
+    """
+    rules = get_column_policies(policy)
+    cols = [col_ for col_ in df.columns if col_ in rules]
+    rules = [rules[col_] for col_ in cols]
+    values = df[cols].to_numpy(dtype=float, copy=True)
+    filled, invalid, missing, gap_length, is_filled = _fill_gaps(values, rules)
+
+    # Gaps start where a missing bin follows an observed one (or the first row)
+    starts = missing & ~np.vstack([np.zeros((1, len(cols)), bool), missing[:-1]])
+    gap_stats = pd.DataFrame(
+        {
+            "n_invalid": invalid.sum(axis=0),
+            "n_missing": missing.sum(axis=0),
+            "n_gaps": starts.sum(axis=0),
+            "longest_gap": gap_length.max(axis=0, initial=0),
+            "n_filled": is_filled.sum(axis=0),
+        },
+        index=pd.Index(cols, name="column"),
+    )
+
+    df = df.copy()
+    df[cols] = filled
+    flagged = [j_ for j_, rule_ in enumerate(rules) if rule_["flag"]]
+    flags = pd.DataFrame(
+        missing[:, flagged].astype("int8"),
+        index=df.index,
+        columns=[f"{cols[j_]}_gap" for j_ in flagged],
+    )
+    df = pd.concat([df.drop(columns=flags.columns, errors="ignore"), flags], axis=1)
+    df.attrs["gap_stats"] = gap_stats
+
+    return df
@@ -0,0 +1,113 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from backend import WARNING_LEVELS
+
+logger = logging.getLogger(__name__)
+
+WARNING_LEVEL_DTYPE = pd.CategoricalDtype(WARNING_LEVELS, ordered=True)
+VARIATION_DTYPE = pd.Int8Dtype()
+PHYSICAL_DTYPE = np.dtype("float32")
+
+
+def get_schema_dtype(column: str):
+    """
+    Dtype of a column of the intermediate (30-minute) frames: warning levels are
+    ordered categories, variation labels are small (nullable) integers, and all
+    the physical quantities are float32
+
+    Parameters
+    ----------
+    column : str
+        Column name, possibly with a station suffix (e.g. "velocity_jr")
+
+    Returns
+    -------
+    Union[np.dtype, pd.api.extensions.ExtensionDtype]
+    """
+    if column.startswith("local_warning_level"):
+        return WARNING_LEVEL_DTYPE
+    if column.endswith("_variation"):
+        return VARIATION_DTYPE
+    return PHYSICAL_DTYPE
+
+
+def to_warning_levels(codes: pd.Series) -> pd.Categorical:
+    """
+    Converts numerical warning level codes (0-5) to categories; fractional codes
+    (e.g. the median of a bin with an even number of observations, such as 2.5)
+    are floored to the lower level, and any other value (e.g. an empty bin) is
+    missing
+
+    Parameters
+    ----------
+    codes : pd.Series
+        Numerical codes, or labels already
+
+    Returns
+    -------
+    pd.Categorical
+    """
+    if not pd.api.types.is_numeric_dtype(codes):
+        return pd.Categorical(codes, dtype=WARNING_LEVEL_DTYPE)
+    values = np.floor(codes.to_numpy(dtype=float))
+    is_level = np.isin(values, np.arange(len(WARNING_LEVELS)))
+    return pd.Categorical.from_codes(
+        np.where(is_level, values, -1).astype(np.int8), dtype=WARNING_LEVEL_DTYPE
+    )
+
+
+def get_memory_usage(df: pd.DataFrame) -> int:
+    """
+    Memory used by a DataFrame (index included), in bytes
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def enforce_schema(df: pd.DataFrame, name: str = "frame") -> pd.DataFrame:
+    """
+    Casts each column of a frame to its schema dtype (see `get_schema_dtype`)
+    and its index to a tz-naive (UTC) datetime64[ns] index named "datetime";
+    memory usage before and after is logged
+
+    It applies to the frames kept at catalog scale, i.e. the resampled ionosonde
+    data (see `preprocess_ionosonde_data`) and the feature store. The live frames
+    (see `align_time_series` and `to_model_inputs`) span one day of bins only and
+    stay float64: their values are returned verbatim by the API, where float32
+    would turn e.g. 12.34 into 12.340000152587891
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Frame indexed by time
+    name : str, optional
+        Name of the frame in the log message, by default "frame"
+
+    Returns
+    -------
+    pd.DataFrame
+        New frame complying with the schema
+    """
+    before = get_memory_usage(df)
+
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    index = index.as_unit("ns").rename("datetime")
+
+    columns = {}
+    for col_ in df.columns:
+        dtype = get_schema_dtype(col_)
+        if dtype is WARNING_LEVEL_DTYPE:
+            columns[col_] = to_warning_levels(df[col_])
+        else:
+            columns[col_] = df[col_].astype(dtype).array
+    df = pd.DataFrame(columns, index=index)
+
+    after = get_memory_usage(df)
+    logger.info(
+        f"Memory usage of {name}: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB"
+    )
+    return df
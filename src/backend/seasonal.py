@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+from scipy.fft import irfft, next_fast_len, rfft
+
+from backend import SEASONAL_PERIODS
+from backend.preprocess import get_rolling_means
+
+
+def _to_array(df: pd.DataFrame) -> np.ndarray:
+    return df.to_numpy(dtype=float).reshape(len(df), -1)
+
+
+def get_acf(df: pd.DataFrame, n_lags: int = 48) -> pd.DataFrame:
+    """
+    Autocorrelation function of all the columns at once, from the FFT of the
+    series (i.e. in O(n log n) rather than O(n x lags)); missing values are
+    replaced by the mean of their series, so they do not contribute
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Time series, one per column
+    n_lags : int, optional
+        Number of lags, by default 48
+
+    Returns
+    -------
+    pd.DataFrame
+        Autocorrelations, indexed by lag (0 to `n_lags`)
+    """
+    values = _to_array(df)
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=0)
+    values = values - np.nansum(values, axis=0) / np.maximum(n_valid, 1)
+    values[~valid] = 0
+
+    # Zero-padding to twice the length turns the circular correlation into a linear one
+    n_fft = next_fast_len(2 * len(values), real=True)
+    spectrum = rfft(values, n=n_fft, axis=0)
+    acov = irfft(spectrum * spectrum.conj(), n=n_fft, axis=0)[: n_lags + 1]
+    acov /= np.maximum(n_valid, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acf = acov / acov[0]
+
+    return pd.DataFrame(
+        acf, index=pd.RangeIndex(n_lags + 1, name="lag"), columns=df.columns
+    )
+
+
+def get_pacf(df: pd.DataFrame, n_lags: int = 48) -> pd.DataFrame:
+    """
+    Partial autocorrelation function of all the columns at once, from their
+    autocorrelations (see `get_acf`) through the Durbin-Levinson recursion, which
+    runs over the lags for all the columns together
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Time series, one per column
+    n_lags : int, optional
+        Number of lags, by default 48
+
+    Returns
+    -------
+    pd.DataFrame
+        Partial autocorrelations, indexed by lag (0 to `n_lags`)
+    """
+    acf = get_acf(df, n_lags=n_lags).to_numpy()
+    pacf = np.ones_like(acf)
+    # Coefficients of the AR(k) model, for all the columns
+    phi = np.zeros((n_lags + 1, acf.shape[1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for k_ in range(1, n_lags + 1):
+            num = acf[k_] - np.einsum("jc,jc->c", phi[1:k_], acf[k_ - 1 : 0 : -1])
+            den = 1 - np.einsum("jc,jc->c", phi[1:k_], acf[1:k_])
+            pacf[k_] = num / den
+            phi[1:k_] -= pacf[k_] * phi[k_ - 1 : 0 : -1]
+            phi[k_] = pacf[k_]
+
+    return pd.DataFrame(
+        pacf, index=pd.RangeIndex(n_lags + 1, name="lag"), columns=df.columns
+    )
+
+
+def _get_trend(values: np.ndarray, period: int, causal: bool) -> np.ndarray:
+    # Moving average over a whole period, centred (or trailing, if causal)
+    if causal:
+        return get_rolling_means(values, [period], min_periods=period // 2)
+    shift = period // 2
+    padded = np.concatenate([values, np.full((shift, values.shape[1]), np.nan)])
+    return get_rolling_means(padded, [period], min_periods=period // 2)[shift:]
+
+
+def _centre(profiles: np.ndarray, axis: int) -> np.ndarray:
+    # Removes the mean of the observed phases; profiles which are not observed at
+    # all (e.g. before the first complete cycle) stay NaN, without any warning
+    valid = ~np.isnan(profiles)
+    counts = valid.sum(axis=axis, keepdims=True)
+    sums = np.where(valid, profiles, 0).sum(axis=axis, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return profiles - np.where(counts > 0, sums / counts, np.nan)
+
+
+def _get_seasonal(
+    values: np.ndarray, period: int, phase: int, causal: bool
+) -> np.ndarray:
+    # Mean of each phase of the period, across cycles (only the previous ones, if
+    # causal), centred on zero; series are folded into a (cycle, phase, column) cube
+    n_rows, n_cols = values.shape
+    n_cycles = -(-(phase + n_rows) // period)
+    cube = np.full((n_cycles * period, n_cols), np.nan)
+    cube[phase : phase + n_rows] = values
+    cube = cube.reshape(n_cycles, period, n_cols)
+    valid = ~np.isnan(cube)
+    cube[~valid] = 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if causal:
+            sums = np.cumsum(cube, axis=0) - cube
+            counts = np.cumsum(valid, axis=0) - valid
+            profiles = _centre(sums / counts, axis=1)
+            return profiles.reshape(-1, n_cols)[phase : phase + n_rows]
+
+        profiles = _centre(cube.sum(axis=0) / valid.sum(axis=0), axis=0)
+    return profiles[(phase + np.arange(n_rows)) % period]
+
+
+def get_seasonal_decomposition(
+    df: pd.DataFrame,
+    periods: dict[str, int] = SEASONAL_PERIODS,
+    n_iter: int = 2,
+    causal: bool = False,
+) -> dict[str, pd.DataFrame]:
+    """
+    Additive trend and multi-seasonal decomposition of all the columns at once:
+    the trend is a moving average over the longest period, and each seasonal
+    component is the mean profile of its period (phases are aligned to the
+    epoch, so that the daily one starts at midnight UTC); components are refined
+    by backfitting, each one being estimated on the series minus the others
+
+    This is a classical (moving-average) decomposition extended to several
+    periods, not STL: there is no LOESS smoothing, so seasonal profiles are fixed
+    over the series (or, if causal, the running mean of the previous cycles) and
+    outliers are not down-weighted. It is what can be computed for many columns
+    at once, and causally, which STL cannot.
+
+    With `causal` set to True, the trend is a trailing moving average and the
+    seasonal profiles only use the previous cycles, so that the components (and
+    the residuals) at each time depend on the past only, as required for model
+    features.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Time series on a regular grid (e.g. 30-minute), one per column
+    periods : dict[str, int], optional
+        Names of the seasonal components mapped to their periods (in steps), by
+        default SEASONAL_PERIODS (day and 27-day solar rotation)
+    n_iter : int, optional
+        Number of backfitting iterations, by default 2
+    causal : bool, optional
+        Whether to use past data only, by default False
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        "trend", "seasonal_{name}" for each period and "resid" components, with
+        the same shape as `df`
+    """
+    steps = np.diff(df.index.asi8)
+    if len(steps) and (steps != steps[0]).any():
+        raise ValueError("Time series must be on a regular grid")
+    step = steps[0] if len(steps) else 1
+
+    values = _to_array(df)
+    seasonal = {name_: np.zeros_like(values) for name_ in periods}
+    for _ in range(n_iter):
+        # Components which are not estimated yet (e.g. the first cycle, if causal)
+        # are taken as 0 when removed, so the warm-up does not grow with iterations
+        trend = _get_trend(
+            values - np.nan_to_num(sum(seasonal.values())),
+            max(periods.values()),
+            causal,
+        )
+        for name_, period_ in periods.items():
+            others = sum(s_ for n_, s_ in seasonal.items() if n_ != name_)
+            phase = int(df.index.asi8[0] // step % period_)
+            seasonal[name_] = _get_seasonal(
+                values - np.nan_to_num(trend) - np.nan_to_num(others),
+                period_,
+                phase,
+                causal,
+            )
+    resid = values - trend - sum(seasonal.values())
+
+    components = {
+        "trend": trend,
+        **{f"seasonal_{name_}": s_ for name_, s_ in seasonal.items()},
+        "resid": resid,
+    }
+    return {
+        name_: pd.DataFrame(c_, index=df.index, columns=df.columns)
+        for name_, c_ in components.items()
+    }
+
+
+def get_residual_features(
+    df: pd.DataFrame,
+    cols: list[str],
+    windows: list[int] = [6, 24],
+    periods: dict[str, int] = SEASONAL_PERIODS,
+) -> pd.DataFrame:
+    """
+    Adds deseasonalised features to the DataFrame: for each column, the residual
+    of its causal decomposition (see `get_seasonal_decomposition`),
+    `{col}_resid`, and its trailing moving average and standard deviation over
+    each time window, `{col}_resid_mav_{window}h` and `{col}_resid_std_{window}h`
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Input DataFrame, on the 30-minute grid
+    cols : list[str]
+        Columns to be decomposed
+    windows : list[int], optional
+        Time windows (in hours) of the rolling statistics, by default [6, 24]
+    periods : dict[str, int], optional
+        Seasonal periods (in steps), by default SEASONAL_PERIODS
+
+    Returns
+    -------
+    pd.DataFrame
+        New DataFrame with the added columns (rounded to the second decimal
+        place), all attached at once
+    """
+    resid = get_seasonal_decomposition(df[cols], periods=periods, causal=True)[
+        "resid"
+    ].to_numpy()
+    steps = [2 * wd_ for wd_ in windows]
+    means = get_rolling_means(resid, steps)
+    squares = get_rolling_means(resid**2, steps)
+    stds = np.sqrt(np.maximum(squares - means**2, 0))
+
+    # Rolling statistics are window-major, as returned by `get_rolling_means`
+    block = {f"{col_}_resid": resid[:, j_] for j_, col_ in enumerate(cols)}
+    for i_, wd_ in enumerate(windows):
+        for j_, col_ in enumerate(cols):
+            block[f"{col_}_resid_mav_{wd_}h"] = means[:, i_ * len(cols) + j_]
+            block[f"{col_}_resid_std_{wd_}h"] = stds[:, i_ * len(cols) + j_]
+    block = pd.DataFrame(block, index=df.index).round(2)
+
+    return pd.concat([df.drop(columns=block.columns, errors="ignore"), block], axis=1)
@@ -0,0 +1,307 @@
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+import logging
+import os
+import uuid
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from backend import (
+    ML_MODEL_COLS,
+    FEATURE_STORE_PATH,
+    FEATURE_STORE_TARGETS,
+    FORECAST_HOURS_IN_ADVANCE,
+)
+from backend.dataset import get_window_targets
+from backend.schema import enforce_schema
+
+logger = logging.getLogger(__name__)
+
+STORE_COLUMNS = [*ML_MODEL_COLS.keys(), *FEATURE_STORE_TARGETS]
+_PARTITION_PREFIX = "month="
+_PARTITION_FILE = "part.parquet"
+_LOCK_FILE = ".lock"
+_lock = Lock()
+
+
+def _partition_path(path: Path, month: pd.Period) -> Path:
+    return Path(path, f"{_PARTITION_PREFIX}{month.strftime('%Y-%m')}", _PARTITION_FILE)
+
+
+@contextmanager
+def _partition_lock(directory: Path):
+    # Partitions are read, merged and rewritten, possibly by several workers (e.g.
+    # uvicorn processes): an exclusive lock on a file of the partition serialises
+    # them; without fcntl, writes are only serialised within this process
+    directory.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(Path(directory, _LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_months(path: Path = FEATURE_STORE_PATH) -> list[pd.Period]:
+    """
+    Months held by the feature store, in chronological order
+
+    Parameters
+    ----------
+    path : Path, optional
+        Root of the store, by default FEATURE_STORE_PATH
+
+    Returns
+    -------
+    list[pd.Period]
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return []
+    return sorted(
+        pd.Period(dir_.name[len(_PARTITION_PREFIX) :], freq="M")
+        for dir_ in path.iterdir()
+        if dir_.name.startswith(_PARTITION_PREFIX)
+        and Path(dir_, _PARTITION_FILE).exists()
+    )
+
+
+def _read_partition(file: Path, columns: list[str] = None) -> pd.DataFrame:
+    df = pd.read_parquet(file, columns=columns)
+    df.index.name = "datetime"
+    return df
+
+
+def _write_partition(df: pd.DataFrame, file: Path):
+    # Written aside and then renamed, so that readers never see a partial file
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file.with_name(f".{uuid.uuid4().hex}.tmp")
+    try:
+        df.to_parquet(tmp_file)
+        os.replace(tmp_file, file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def write_features(
+    df: pd.DataFrame, path: Path = FEATURE_STORE_PATH, freq: str = "30min"
+) -> list[pd.Period]:
+    """
+    Upserts rows into the feature store: each row lands in the partition of its
+    month, replacing the stored row with the same timestamp; missing values of the
+    new rows do not overwrite stored ones (e.g. a target labelled after the fact,
+    or a live row refreshed before all of its sources came in)
+
+    Rows are cast to the schema of the intermediate frames (see `enforce_schema`),
+    which is also the precision the model is fed with, so training and serving
+    read identical features. Any of the `STORE_COLUMNS` can be missing.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Rows indexed by the left edge of their bin
+    path : Path, optional
+        Root of the store, by default FEATURE_STORE_PATH
+    freq : str, optional
+        Time step of the grid, by default "30min"
+
+    Returns
+    -------
+    list[pd.Period]
+        Months that were written
+    """
+    unknown_cols = df.columns.difference(STORE_COLUMNS)
+    if not unknown_cols.empty:
+        raise ValueError(f"Columns not in the feature store: {list(unknown_cols)}")
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError("Rows must be indexed by a DatetimeIndex")
+    if df.index.has_duplicates:
+        raise ValueError("Rows must have unique timestamps")
+    if (df.index.floor(freq) != df.index).any():
+        raise ValueError(f"Rows must lie on the {freq} grid")
+
+    df = enforce_schema(
+        df.reindex(columns=STORE_COLUMNS).sort_index(), name="feature store rows"
+    )
+    months = df.index.to_period("M")
+
+    for month_ in months.unique():
+        file = _partition_path(path, month_)
+        rows = df[months == month_]
+        with _partition_lock(file.parent):
+            if file.exists():
+                rows = rows.combine_first(_read_partition(file))[STORE_COLUMNS]
+            _write_partition(rows, file)
+
+    return list(months.unique())
+
+
+def append_features(df: pd.DataFrame, path: Path = FEATURE_STORE_PATH) -> None:
+    """
+    Appends the live rows computed by `get_real_time_data` (i.e. without targets,
+    see `label_features`) to the feature store, e.g. from the scheduled forecasts;
+    being on the serving path, failures are only logged
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Live rows, with (at least) the `ML_MODEL_COLS` columns
+    path : Path, optional
+        Root of the store, by default FEATURE_STORE_PATH
+    """
+    try:
+        write_features(df[df.columns.intersection(STORE_COLUMNS)], path=path)
+    except Exception as e:
+        logger.warning(f"Live features not stored: {e}")
+
+
+def label_features(
+    events: pd.Series,
+    df: pd.DataFrame = None,
+    path: Path = FEATURE_STORE_PATH,
+    freq: str = "30min",
+) -> list[pd.Period]:
+    """
+    Labels the rows of the feature store with the targets of an event series
+    (see `get_window_targets`), e.g. the TID catalog once it covers the served
+    rows; with `df`, all of its rows are backfilled along with their targets,
+    e.g. the features of the training catalog
+
+    Only bins whose whole forecast window is covered by `events` are labelled,
+    so that rows too recent to be known are left unlabelled rather than marked
+    as quiet; they are labelled by a later call.
+
+    Parameters
+    ----------
+    events : pd.Series
+        Event series indexed by time, where values greater than 0 are events
+        (e.g. `quality_index` of the TID catalog); bins it lacks are not events
+    df : pd.DataFrame, optional
+        Features to be backfilled, by default None (only the stored rows are
+        labelled)
+    path : Path, optional
+        Root of the store, by default FEATURE_STORE_PATH
+    freq : str, optional
+        Time step of the grid, by default "30min"
+
+    Returns
+    -------
+    list[pd.Period]
+        Months that were written
+    """
+    events = events.resample(freq).max()
+    steps = int(pd.Timedelta(hours=FORECAST_HOURS_IN_ADVANCE) / pd.Timedelta(freq))
+    targets = get_window_targets(
+        events, horizons=[FORECAST_HOURS_IN_ADVANCE], time_interval=freq
+    ).iloc[: max(len(events) - steps, 0)]
+
+    if df is not None:
+        rows = df[df.columns.intersection(ML_MODEL_COLS.keys())]
+        targets = rows.join(targets, how="left")
+    elif not targets.empty:
+        stored = read_features(
+            start=targets.index.min(),
+            end=targets.index.max(),
+            columns=FEATURE_STORE_TARGETS,
+            path=path,
+        )
+        targets = targets[targets.index.isin(stored.index)]
+    if targets.empty:
+        logger.warning("No feature store rows to be labelled")
+        return []
+
+    return write_features(targets, path=path, freq=freq)
+
+
+def read_features(
+    start: str = None,
+    end: str = None,
+    columns: list[str] = None,
+    path: Path = FEATURE_STORE_PATH,
+) -> pd.DataFrame:
+    """
+    Reads a time range of the feature store; only the partitions overlapping the
+    range, and only the requested columns of each, are read from disk
+
+    Parameters
+    ----------
+    start : str, optional
+        First timestamp (inclusive), by default None (from the first row)
+    end : str, optional
+        Last timestamp (inclusive), by default None (up to the last row)
+    columns : list[str], optional
+        Columns to be read, by default None (all of the `STORE_COLUMNS`)
+    path : Path, optional
+        Root of the store, by default FEATURE_STORE_PATH
+
+    Returns
+    -------
+    pd.DataFrame
+        Rows indexed by "datetime"
+    """
+    columns = STORE_COLUMNS if columns is None else list(columns)
+    unknown_cols = set(columns).difference(STORE_COLUMNS)
+    if unknown_cols:
+        raise ValueError(f"Columns not in the feature store: {sorted(unknown_cols)}")
+
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    months = [
+        month_
+        for month_ in get_months(path)
+        if (start is None or month_.end_time >= start)
+        and (end is None or month_.start_time <= end)
+    ]
+    if not months:
+        return enforce_schema(
+            pd.DataFrame(columns=columns, index=pd.DatetimeIndex([])),
+            name="feature store",
+        )
+
+    df = pd.concat(
+        [_read_partition(_partition_path(path, month_), columns) for month_ in months]
+    )
+    return df.loc[start:end]
+
+
+def read_training_set(
+    start: str = None,
+    end: str = None,
+    target: str = FEATURE_STORE_TARGETS[0],
+    path: Path = FEATURE_STORE_PATH,
+) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    Model inputs (in `ML_MODEL_COLS` order) and target of the labelled rows in a
+    time range, e.g. for training, calibration or hindcasts
+
+    Parameters
+    ----------
+    start : str, optional
+        First timestamp (inclusive), by default None (from the first row)
+    end : str, optional
+        Last timestamp (inclusive), by default None (up to the last row)
+    target : str, optional
+        Target column, by default the first of FEATURE_STORE_TARGETS
+    path : Path, optional
+        Root of the store, by default FEATURE_STORE_PATH
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.Series]
+        Features and (integer) target
+    """
+    df = read_features(
+        start=start, end=end, columns=[*ML_MODEL_COLS.keys(), target], path=path
+    )
+    df = df[df[target].notna()]
+    return df[list(ML_MODEL_COLS.keys())], df[target].astype(int)
@@ -0,0 +1,128 @@
+import asyncio
+from collections import deque
+from threading import Lock
+from time import time_ns
+from typing import AsyncIterator
+
+from backend import STREAM_HISTORY, STREAM_KEEPALIVE
+
+
+class ForecastBroadcaster:
+    """
+    Fans out each new forecast to any number of Server-Sent Events subscribers
+
+    Every forecast is serialised and framed as an SSE event only once, when it is
+    published; subscribers just receive the ready-made bytes, so the cost per
+    client is a single write. Events carry a strictly increasing id (epoch
+    milliseconds), which clients send back as `Last-Event-ID` to resume the
+    stream after a reconnection and catch up on the forecasts they missed.
+    Forecasts for the same reference time as the latest event are not
+    published again, so clients receive each reference time once, whichever
+    path (scheduled run or /predict) computed it first.
+
+    Parameters
+    ----------
+    history : int, optional
+        Number of past events retained for catching up, by default STREAM_HISTORY
+    keepalive : float, optional
+        Seconds of inactivity after which a comment line is sent to keep
+        connections (and proxies) alive, by default STREAM_KEEPALIVE
+    """
+
+    def __init__(
+        self, history: int = STREAM_HISTORY, keepalive: float = STREAM_KEEPALIVE
+    ):
+        self.keepalive = keepalive
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        self._last_key = None
+        self._lock = Lock()
+        self._loop = None
+        self._new_event = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """
+        Attaches the broadcaster to the event loop serving the subscribers
+        """
+        self._loop = loop
+        self._new_event = asyncio.Event()
+
+    def publish(self, payload: str, key: str = None) -> int:
+        """
+        Publishes a new forecast; it is thread-safe, so it can be called from
+        synchronous endpoints as well
+
+        Parameters
+        ----------
+        payload : str
+            Serialised (JSON) forecast
+        key : str, optional
+            Identifier of the forecast (its reference time); if it is the same as
+            the one of the latest event, nothing is published, by default None
+
+        Returns
+        -------
+        int
+            Id of the published event, i.e. its resume token (the id of the
+            latest event, if the forecast was a duplicate)
+        """
+        with self._lock:
+            if key is not None and key == self._last_key:
+                return self._last_id
+            self._last_key = key
+            self._last_id = max(self._last_id + 1, time_ns() // 1_000_000)
+            frame = f"id: {self._last_id}\nevent: forecast\ndata: {payload}\n\n"
+            self._events.append((self._last_id, frame.encode()))
+            event_id = self._last_id
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._notify)
+
+        return event_id
+
+    def _notify(self):
+        # Wake up all the current waiters and arm a new event for the next round
+        new_event, self._new_event = self._new_event, asyncio.Event()
+        new_event.set()
+
+    def _events_after(self, last_id: int) -> list[tuple[int, bytes]]:
+        with self._lock:
+            return [ev_ for ev_ in self._events if ev_[0] > last_id]
+
+    async def subscribe(self, last_id: int = None) -> AsyncIterator[bytes]:
+        """
+        Yields SSE frames: first the missed ones (or the latest forecast, if no
+        resume token is given), then each new one as soon as it is published
+
+        Parameters
+        ----------
+        last_id : int, optional
+            Id of the last event received by the client, by default None
+
+        Yields
+        ------
+        bytes
+            SSE frames, ready to be written to the response
+        """
+        if last_id is None:
+            with self._lock:
+                backlog = list(self._events)[-1:]
+        else:
+            backlog = self._events_after(last_id)
+
+        cursor = last_id or 0
+        for cursor, frame in backlog:
+            yield frame
+
+        while True:
+            # Grab the event before checking, so that no publication is missed
+            new_event = self._new_event
+            pending = self._events_after(cursor)
+            if pending:
+                for cursor, frame in pending:
+                    yield frame
+                continue
+            try:
+                await asyncio.wait_for(new_event.wait(), timeout=self.keepalive)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
@@ -0,0 +1,177 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from urllib.parse import urlparse
+
+from backend import TRACING_ENABLED, TRACING_BUCKETS
+
+_enabled = TRACING_ENABLED
+_lock = Lock()
+_NULL_STAGE = nullcontext()
+
+# Per-request stage timings, only set when a request asks for Server-Timing
+_request_trace: ContextVar = ContextVar("request_trace", default=None)
+
+# Prometheus-style histograms (cumulative counts are computed on export)
+_stage_counts = defaultdict(lambda: [0] * (len(TRACING_BUCKETS) + 1))
+_stage_sums = defaultdict(float)
+_upstream_errors = defaultdict(int)
+_upstream_bytes = defaultdict(int)
+_upstream_seconds = defaultdict(float)
+
+
+def set_tracing(enabled: bool):
+    """
+    Turns the collection of stage timings for the metrics endpoint on or off
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def _observe(name: str, seconds: float):
+    with _lock:
+        _stage_counts[name][bisect_left(TRACING_BUCKETS, seconds)] += 1
+        _stage_sums[name] += seconds
+
+
+@contextmanager
+def _timed_stage(name: str, trace: list):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        if _enabled:
+            _observe(name, elapsed)
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def stage(name: str):
+    """
+    Context manager timing a step of the serving path; when tracing is off and
+    no request trace is active, it is a shared no-op
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. "resample"
+    """
+    trace = _request_trace.get()
+    if not _enabled and trace is None:
+        return _NULL_STAGE
+    return _timed_stage(name, trace)
+
+
+@contextmanager
+def request_trace():
+    """
+    Collects the stage timings of the current request (also from the threads
+    started with a copy of the current context)
+
+    Yields
+    ------
+    list[tuple[str, float]]
+        Stage names and durations (in seconds), in order of completion
+    """
+    trace = []
+    token = _request_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _request_trace.reset(token)
+
+
+def get_server_timing(trace: list[tuple[str, float]]) -> str:
+    """
+    Formats a request trace as the value of a `Server-Timing` header; repeated
+    stages are summed up
+
+    Parameters
+    ----------
+    trace : list[tuple[str, float]]
+        Output of `request_trace`
+
+    Returns
+    -------
+    str
+    """
+    totals = defaultdict(float)
+    for name_, seconds_ in trace:
+        totals[name_] += seconds_
+    return ", ".join(f"{name_};dur={1e3 * sec_:.1f}" for name_, sec_ in totals.items())
+
+
+def count_upstream_error(source: str):
+    """
+    Increments the error counter of a data source
+    """
+    with _lock:
+        _upstream_errors[source] += 1
+
+
+def observe_response(response, *args, **kwargs):
+    """
+    `requests` response hook, recording the bytes received from each upstream
+    host along with the time spent waiting for its response
+    """
+    if _enabled:
+        host = urlparse(response.url).netloc
+        with _lock:
+            _upstream_bytes[host] += len(response.content)
+            _upstream_seconds[host] += response.elapsed.total_seconds()
+    return response
+
+
+def get_metrics() -> str:
+    """
+    Renders all the collected metrics in the Prometheus text exposition format
+
+    Returns
+    -------
+    str
+    """
+    lines = [
+        "# HELP tfors_stage_seconds Time spent in each stage of the serving path",
+        "# TYPE tfors_stage_seconds histogram",
+    ]
+    with _lock:
+        for name_, counts_ in sorted(_stage_counts.items()):
+            cumulative = 0
+            for le_, count_ in zip([*TRACING_BUCKETS, "+Inf"], counts_):
+                cumulative += count_
+                lines.append(
+                    f'tfors_stage_seconds_bucket{{stage="{name_}",le="{le_}"}} {cumulative}'
+                )
+            lines.append(
+                f'tfors_stage_seconds_sum{{stage="{name_}"}} {_stage_sums[name_]:.6f}'
+            )
+            lines.append(f'tfors_stage_seconds_count{{stage="{name_}"}} {cumulative}')
+
+        lines += [
+            "# HELP tfors_upstream_errors_total Failed or late fetches for each data source",
+            "# TYPE tfors_upstream_errors_total counter",
+        ]
+        for source_, count_ in sorted(_upstream_errors.items()):
+            lines.append(f'tfors_upstream_errors_total{{source="{source_}"}} {count_}')
+
+        lines += [
+            "# HELP tfors_upstream_bytes_total Bytes received from each upstream host",
+            "# TYPE tfors_upstream_bytes_total counter",
+        ]
+        for host_, count_ in sorted(_upstream_bytes.items()):
+            lines.append(f'tfors_upstream_bytes_total{{upstream="{host_}"}} {count_}')
+
+        lines += [
+            "# HELP tfors_upstream_seconds_total Time spent waiting for each upstream host",
+            "# TYPE tfors_upstream_seconds_total counter",
+        ]
+        for host_, sec_ in sorted(_upstream_seconds.items()):
+            lines.append(
+                f'tfors_upstream_seconds_total{{upstream="{host_}"}} {sec_:.6f}'
+            )
+
+    return "\n".join(lines) + "\n"
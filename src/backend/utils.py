@@ -1,9 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextvars import copy_context
 from datetime import datetime, timedelta
+from functools import lru_cache, partial
+from typing import Callable
+import logging
 
 import numpy as np
 import pandas as pd
 
 from backend.io import (
+    fetch_deadline,
     get_techtide_hf,
     get_techtide_ionosondes,
     get_gfz_f107,
@@ -13,106 +19,537 @@ from backend.io import (
     get_fmi_iu_ie,
 )
 from backend.preprocess import (
-    resample_time_series,
+    align_time_series,
     get_moving_avg,
     get_categories,
     get_solar_position,
 )
-from backend import ML_MODEL_COLS, TOP_N_FEAT, FEAT_IMP_PATH
+from backend.buffer import RealTimeBuffers
+from backend.features import FeatureEngine
+from backend.quality import (
+    apply_quality_policy,
+    fill_gaps,
+    get_column_policies,
+    mask_invalid_values,
+)
+from backend.tracing import stage, count_upstream_error
+from backend import (
+    ML_MODEL_COLS,
+    TOP_N_FEAT,
+    FEAT_IMP_PATH,
+    VARIATION_CENTROIDS_PATH,
+    REAL_TIME_WINDOWS,
+    DATA_QUALITY_SERVING,
+    FEATURE_MOVING_AVG,
+    FEATURE_VARIATION,
+)
 
+logger = logging.getLogger(__name__)
 
-def get_real_time_data() -> pd.DataFrame:
-    STOP_UTC_NOW = datetime.utcnow()
-    START_UTC = STOP_UTC_NOW - timedelta(hours=6)
-    STOP_UTC_NOW = STOP_UTC_NOW.strftime("%Y-%m-%d %H:%M:%S")
-    START_UTC = START_UTC.strftime("%Y-%m-%d %H:%M:%S")
-    # TechTIDE
-    df_hf = get_techtide_hf(start=START_UTC, stop=STOP_UTC_NOW)
-    df_hf_30 = resample_time_series(df_hf, aggregation_function="mean").round(2)
-    df_hf_30 = get_moving_avg(df_hf_30, ["hf"], [2])
-    df_iono = get_techtide_ionosondes(
-        START_UTC,
-        STOP_UTC_NOW,
-        iono_list=["AT138", "FF051", "JR055", "PQ052", "RO041", "VT139"],
+
+@lru_cache(maxsize=1)
+def get_variation_centroids() -> dict[str, np.ndarray]:
+    """
+    Loads the variation centroids fitted on the training catalog (see
+    `save_variation_centroids`)
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Column names mapped to their cluster centres
+
+    Raises
+    ------
+    FileNotFoundError
+        If no centroids were stored: categories fitted on a single live window
+        would not match the ones the model was trained on
+    """
+    if not VARIATION_CENTROIDS_PATH.exists():
+        raise FileNotFoundError(
+            f"No variation centroids at {VARIATION_CENTROIDS_PATH}: generate them "
+            "from the training catalog with `save_variation_centroids`"
+        )
+    return pd.read_pickle(VARIATION_CENTROIDS_PATH)
+
+
+def fetch_sources(
+    fetchers: dict[str, Callable[[], pd.DataFrame]], deadline: float = None
+) -> tuple[dict[str, pd.DataFrame], list[str]]:
+    """
+    Runs the data fetchers concurrently, under a global deadline
+
+    Parameters
+    ----------
+    fetchers : dict[str, Callable[[], pd.DataFrame]]
+        Source names mapped to argument-less functions retrieving their data
+    deadline : float, optional
+        Global time budget (in seconds) for all fetches, by default None (wait for
+        every source); sources which have not answered in time, or which failed,
+        are skipped and treated as missing
+
+    Returns
+    -------
+    tuple[dict[str, pd.DataFrame], list[str]]
+        Retrieved data for each available source, names of the skipped sources
+    """
+
+    def timed_fetch(name: str, fn: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        with stage(f"fetch_{name}"):
+            return fn()
+
+    executor = ThreadPoolExecutor(max_workers=len(fetchers))
+    # Each thread runs in a copy of the current context, to join the request trace
+    # and to bound its HTTP requests to the deadline
+    with fetch_deadline(deadline):
+        futures = {
+            executor.submit(copy_context().run, timed_fetch, name_, fn_): name_
+            for name_, fn_ in fetchers.items()
+        }
+    with stage("fetch"):
+        done, _ = wait(futures, timeout=deadline)
+    # Late fetches are left to time out in the background, but nobody waits for them
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results, skipped = {}, []
+    for future_, name_ in futures.items():
+        if future_ not in done:
+            logger.warning(
+                f"Source '{name_}' skipped: deadline of {deadline}s exceeded"
+            )
+            count_upstream_error(name_)
+            skipped.append(name_)
+        elif future_.exception() is not None:
+            count_upstream_error(name_)
+            if deadline is None:
+                raise future_.exception()
+            logger.warning(f"Source '{name_}' skipped: {future_.exception()}")
+            skipped.append(name_)
+        else:
+            results[name_] = future_.result()
+
+    return results, skipped
+
+
+# Aggregation of each source onto the 30-minute grid
+REAL_TIME_AGGREGATIONS = {
+    "techtide_hf": "mean",
+    "techtide_ionosondes": "median",
+    "gfz_hp30": "last",  # already on the grid
+    "noaa_l1": {col_: "median" for col_ in ["bz", "speed", "rho", "newell"]},
+    "noaa_dst": "median",
+    "fmi": "median",
+}
+# Sources whose bins are rounded to the second decimal place
+ROUNDED_SOURCES = ["techtide_hf", "techtide_ionosondes", "fmi"]
+# Sources which are fetched from their last buffered bin, rather than in full
+INCREMENTAL_SOURCES = ["techtide_hf", "techtide_ionosondes"]
+
+
+def get_real_time_fetchers(
+    start: dict[str, str], stop: str
+) -> dict[str, Callable[[], pd.DataFrame]]:
+    """
+    Data fetchers of all the near real-time sources (see `fetch_sources`)
+
+    Parameters
+    ----------
+    start : dict[str, str]
+        Start of the time window of each source which can be queried by time (see
+        `INCREMENTAL_SOURCES`)
+    stop : str
+        End of the time window
+
+    Returns
+    -------
+    dict[str, Callable[[], pd.DataFrame]]
+    """
+    return {
+        # TechTIDE
+        "techtide_hf": lambda: get_techtide_hf(start=start["techtide_hf"], stop=stop),
+        "techtide_ionosondes": lambda: get_techtide_ionosondes(
+            start["techtide_ionosondes"],
+            stop,
+            iono_list=["AT138", "FF051", "JR055", "PQ052", "RO041", "VT139"],
+        ),
+        # GFZ
+        "gfz_hp30": lambda: get_gfz_hp30(artificial_ffill=True),
+        "gfz_f107": get_gfz_f107,
+        # NOAA
+        "noaa_l1": lambda: get_noaa_l1(end_propagated_datetime=stop),
+        "noaa_dst": lambda: get_noaa_dst(end_datetime=stop),
+        # FMI
+        "fmi": get_fmi_iu_ie,
+    }
+
+
+def to_model_inputs(df: pd.DataFrame, skipped: list[str]) -> pd.DataFrame:
+    """
+    Turns the last row of the 30-minute features into the model inputs
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Features indexed by bin
+    skipped : list[str]
+        Names of the skipped sources, stored in `attrs["skipped_sources"]`
+
+    Returns
+    -------
+    pd.DataFrame
+        Single-row DataFrame with the `ML_MODEL_COLS` columns
+    """
+    df = (
+        df.tail(1)
+        .rename(columns={"ie": "ie_fix", "iu": "iu_fix"})
+        .reindex(columns=ML_MODEL_COLS.keys())
     )
-    df_iono_30 = resample_time_series(
-        df_iono,
-        aggregation_function="median",
-    ).round(2)
-    # GFZ
-    df_hp_30 = get_gfz_hp30(artificial_ffill=True)
-    # NOAA
-    df_l1 = get_noaa_l1(end_propagated_datetime=STOP_UTC_NOW)
-    df_l1_30 = resample_time_series(
-        df_l1,
-        aggregation_function="median",
+    # Only the skipped sources are passed on (e.g. not the gap statistics)
+    df.attrs = {}
+    # Integer columns stay float if their source is missing; the others stay
+    # float64, since they are served verbatim (see `enforce_schema`)
+    df = df.astype(
+        {
+            col_: type_ if type_ != "int" or df[col_].notna().all() else "float"
+            for col_, type_ in ML_MODEL_COLS.items()
+        }
     )
-    df_dst = get_noaa_dst(end_datetime=STOP_UTC_NOW)
-    df_dst_30 = resample_time_series(df_dst, aggregation_function="median").ffill()
+    df.attrs["skipped_sources"] = skipped
+
+    return df
+
+
+def get_window_features(
+    df_j: pd.DataFrame, raw: dict[str, pd.DataFrame]
+) -> pd.DataFrame:
+    """
+    Computes the moving averages and variation labels of the live window from
+    scratch, with the batch functions of `backend.preprocess` (frame path of
+    `get_real_time_data`)
+
+    Parameters
+    ----------
+    df_j : pd.DataFrame
+        Bins of the live window
+    raw : dict[str, pd.DataFrame]
+        Data retrieved from each available source
+
+    Returns
+    -------
+    pd.DataFrame
+        Bins of the live window, with the features of the available sources
+    """
+    # TechTIDE
+    if "techtide_hf" in raw:
+        with stage("moving_avg"):
+            df_j = get_moving_avg(df_j, ["hf"], [2])
     # FMI
-    fmi_cols = ["ie", "iu"]
-    df_fmi = get_fmi_iu_ie()
-    df_fmi_30 = resample_time_series(df_fmi, aggregation_function="median").round(2)
-    df_fmi_30 = get_moving_avg(df_fmi_30, fmi_cols, [3, 12])
-    hours = 6
-    for col_ in fmi_cols:
-        _, labels = get_categories(
-            df_fmi_30[col_],
-            window=2 * hours,
-            zero_phase=False,
-        )
-        df_fmi_30[f"{col_}_variation"] = np.insert(labels, 0, 0, axis=0)
-    # Merge all data
-    df_j = (
-        df_hf_30.merge(
-            df_iono_30,
-            how="outer",
-            left_index=True,
-            right_index=True,
-        )
-        .merge(
-            df_hp_30,
-            how="outer",
-            left_index=True,
-            right_index=True,
-        )
-        .merge(
-            df_l1_30.drop(columns=["by"]),
-            how="outer",
-            left_index=True,
-            right_index=True,
-        )
-        .merge(
-            df_dst_30,
-            how="outer",
-            left_index=True,
-            right_index=True,
-        )
-        .merge(
-            df_fmi_30,
-            how="outer",
-            left_index=True,
-            right_index=True,
+    if "fmi" in raw:
+        fmi_cols = ["ie", "iu"]
+        with stage("moving_avg"):
+            df_j = get_moving_avg(df_j, fmi_cols, [3, 12])
+        # Variations are computed over the span of the FMI data only
+        fmi_span = slice(
+            raw["fmi"].index.min().floor("30min"), raw["fmi"].index.max().floor("30min")
         )
+        hours = 6
+        with stage("categorise"):
+            for col_ in fmi_cols:
+                _, labels = get_categories(
+                    df_j.loc[fmi_span, col_],
+                    window=2 * hours,
+                    zero_phase=False,
+                    centroids=get_variation_centroids()[col_],
+                )
+                df_j.loc[fmi_span, f"{col_}_variation"] = np.insert(
+                    labels, 0, 0, axis=0
+                )
+
+    return df_j
+
+
+def get_live_features(
+    df_j: pd.DataFrame, raw: dict[str, pd.DataFrame], skipped: list[str]
+) -> pd.DataFrame:
+    """
+    Computes the model inputs of the most recent bin from the aligned 30-minute
+    bins of the live window (frame path of `get_real_time_data`)
+
+    Parameters
+    ----------
+    df_j : pd.DataFrame
+        Bins of the sources in `raw` (rounded as in `ROUNDED_SOURCES`), each one
+        over its time span in REAL_TIME_WINDOWS
+    raw : dict[str, pd.DataFrame]
+        Data retrieved from each available source (see `fetch_sources`)
+    skipped : list[str]
+        Names of the skipped sources
+
+    Returns
+    -------
+    pd.DataFrame
+        Single-row DataFrame with the `ML_MODEL_COLS` columns
+    """
+    if DATA_QUALITY_SERVING:
+        # Gaps, including the Dst and Hp30 latency, as in the catalog
+        with stage("quality"):
+            df_j = apply_quality_policy(df_j)
+    elif "dst" in df_j.columns:
+        # Dst data need to be repeated, since they're provided on an hourly basis
+        df_j["dst"] = df_j["dst"].ffill()
+    df_j = get_window_features(df_j, raw)
+
+    return get_last_bin_inputs(df_j.tail(1), raw, skipped)
+
+
+def get_last_bin_inputs(
+    df_j: pd.DataFrame, raw: dict[str, pd.DataFrame], skipped: list[str]
+) -> pd.DataFrame:
+    """
+    Completes the features of the most recent bin with the ones which do not
+    depend on the binned sources, and turns them into the model inputs; both
+    live paths (see `get_real_time_data`) go through it
+
+    Parameters
+    ----------
+    df_j : pd.DataFrame
+        Single-row DataFrame with the features of the most recent bin
+    raw : dict[str, pd.DataFrame]
+        Data retrieved from each available source (see `fetch_sources`)
+    skipped : list[str]
+        Names of the skipped sources
+
+    Returns
+    -------
+    pd.DataFrame
+        Single-row DataFrame with the `ML_MODEL_COLS` columns
+    """
+    df_j = df_j.copy()
+    # Solar data need to be repeated, since they're provided on a daily basis
+    if "gfz_f107" in raw:
+        df_j["f_107_adj"] = raw["gfz_f107"].dropna().tail(1).values[0, 0]
+    with stage("solar_position"):
+        df_j["solar_zenith_angle"] = get_solar_position(
+            df_j.index,
+            columns="zenith",
+            altitude=0,
+        ).round(1)
+
+    return to_model_inputs(df_j, skipped)
+
+
+def get_real_time_data(
+    deadline: float = None, buffers: RealTimeBuffers = None
+) -> pd.DataFrame:
+    """
+    Retrieves near real-time data from all the sources and builds the most recent
+    row of model inputs
+
+    Parameters
+    ----------
+    deadline : float, optional
+        Latency budget (in seconds) for data retrieval, by default None (wait for
+        every source); sources which miss the deadline are treated as missing, and
+        their names are listed in `df.attrs["skipped_sources"]`
+    buffers : RealTimeBuffers, optional
+        Ring buffers of the recent bins of each source, by default None (the time
+        span of each source in REAL_TIME_WINDOWS is fetched and binned from
+        scratch); if provided, only the new data are fetched (where sources allow
+        it) and binned, and the features are kept up to date by feature engines,
+        see `get_buffered_bin`
+
+    Returns
+    -------
+    pd.DataFrame
+        Single-row DataFrame with the `ML_MODEL_COLS` columns
+    """
+    STOP_UTC_NOW = datetime.utcnow()
+    if buffers is None:
+        START_UTC = {
+            name_: STOP_UTC_NOW - timedelta(hours=REAL_TIME_WINDOWS[name_])
+            for name_ in INCREMENTAL_SOURCES
+        }
+    else:
+        START_UTC = {
+            name_: buffers.fetch_start(name_, STOP_UTC_NOW)
+            for name_ in INCREMENTAL_SOURCES
+        }
+    STOP_UTC_NOW = STOP_UTC_NOW.strftime("%Y-%m-%d %H:%M:%S")
+    START_UTC = {
+        name_: start_.strftime("%Y-%m-%d %H:%M:%S")
+        for name_, start_ in START_UTC.items()
+    }
+    raw, skipped = fetch_sources(
+        get_real_time_fetchers(START_UTC, STOP_UTC_NOW), deadline=deadline
     )
-    # Solar and Dst data need to be repeated, since they're provided
-    # on a daily/hourly basis
-    df_j["dst"] = df_j["dst"].ffill()
-    df_j["f_107_adj"] = get_gfz_f107().dropna().tail(1).values[0, 0]
-    # Solar zenith angle
-    df_j["solar_zenith_angle"] = get_solar_position(
-        df_j.index,
-        columns="zenith",
-        altitude=0,
-    ).round(1)
-
-    return (
-        df_j.tail(1)
-        .rename(columns={"ie": "ie_fix", "iu": "iu_fix"})
-        .astype(ML_MODEL_COLS)[ML_MODEL_COLS.keys()]
+    if DATA_QUALITY_SERVING:
+        raw = {name_: mask_invalid_values(df_) for name_, df_ in raw.items()}
+    sources = {name_: raw[name_] for name_ in REAL_TIME_AGGREGATIONS if name_ in raw}
+    if not sources:
+        raise Exception(f"No data source available (skipped: {', '.join(skipped)})")
+
+    if buffers is not None:
+        with buffers.lock:
+            df_j = get_buffered_bin(buffers, sources)
+        return get_last_bin_inputs(df_j, raw, skipped)
+
+    # Resample all the sources onto the 30-minute grid in one go, each one over
+    # its own time span
+    with stage("align"):
+        end = max(df_.index.max() for df_ in sources.values() if len(df_))
+        end = end.floor("30min")
+        first_bins = {
+            name_: end
+            - pd.Timedelta(hours=REAL_TIME_WINDOWS[name_])
+            + pd.Timedelta("30min")
+            for name_ in sources
+        }
+        df_j = align_time_series(
+            {
+                name_: df_[df_.index >= first_bins[name_]]
+                for name_, df_ in sources.items()
+            },
+            REAL_TIME_AGGREGATIONS,
+            start=min(first_bins.values()),
+            end=end,
+        )
+        rounded = [
+            col_
+            for name_ in ROUNDED_SOURCES
+            if name_ in sources
+            for col_ in sources[name_].columns
+        ]
+        df_j[rounded] = df_j[rounded].round(2)
+
+    return get_live_features(df_j, raw, skipped)
+
+
+def get_buffered_bin(
+    buffers: RealTimeBuffers, sources: dict[str, pd.DataFrame]
+) -> pd.DataFrame:
+    """
+    Bins the new observations of each source into its ring buffer, and computes
+    the features of the most recent bin from zero-copy views of the buffers
+    (buffered path of `get_real_time_data`): its binned values, cleaned as the
+    frame path does, and the features of the engines (see
+    `get_buffered_features`); sources missing from this update are left out
+
+    Parameters
+    ----------
+    buffers : RealTimeBuffers
+        Ring buffers, updated in place (their lock is to be held by the caller)
+    sources : dict[str, pd.DataFrame]
+        Data retrieved from each available source
+
+    Returns
+    -------
+    pd.DataFrame
+        Single-row DataFrame with the features of the most recent bin
+    """
+    with stage("align"):
+        for name_, agg_ in REAL_TIME_AGGREGATIONS.items():
+            if name_ in sources:
+                buffers.update(
+                    name_,
+                    sources[name_],
+                    agg_,
+                    decimals=2 if name_ in ROUNDED_SOURCES else None,
+                )
+        latest = buffers.align()
+
+    values = {}
+    with stage("quality"):
+        for name_ in REAL_TIME_AGGREGATIONS:
+            if name_ not in sources or name_ not in buffers:
+                continue
+            columns = buffers[name_].columns
+            view = buffers[name_].view()
+            if DATA_QUALITY_SERVING:
+                last = fill_gaps(view.T, columns)[-1]
+            else:
+                last = view[:, -1].copy()
+                if "dst" in columns:
+                    # Dst data need to be repeated, since they're provided on an
+                    # hourly basis
+                    dst = view[columns.index("dst")]
+                    observed = np.flatnonzero(np.isfinite(dst))
+                    last[columns.index("dst")] = (
+                        dst[observed[-1]] if len(observed) else np.nan
+                    )
+            values.update(zip(columns, last))
+    values.update(get_buffered_features(buffers, sources))
+
+    return pd.DataFrame(
+        values,
+        index=pd.date_range(latest, periods=1, freq=buffers.freq, name="datetime"),
     )
 
 
+def get_buffered_features(
+    buffers: RealTimeBuffers, sources: dict[str, pd.DataFrame]
+) -> dict[str, float]:
+    """
+    Moving averages and variation labels of the most recent bin, from the feature
+    engine of each source (see `FeatureEngine`), which is only fed the bins
+    received since the previous update, rather than recomputing the features
+    over the live window
+
+    Each engine carries its state over from one update to the next, so its
+    features are those of the batch functions applied to the whole sequence of
+    bins since it was created, as in the training catalog; a bin only updates the
+    state once it can no longer change, i.e. once it is older than the last
+    observed bin of its source (and, with DATA_QUALITY_SERVING, than the longest
+    gap which could still be filled around it).
+
+    Parameters
+    ----------
+    buffers : RealTimeBuffers
+        Ring buffers, already updated with `sources` (see `get_buffered_bin`)
+    sources : dict[str, pd.DataFrame]
+        Data retrieved from each available source
+
+    Returns
+    -------
+    dict[str, float]
+        Features of the available sources
+    """
+    features = {}
+    with stage("moving_avg"):
+        for name_ in sources:
+            if name_ not in buffers:
+                continue
+            columns = buffers[name_].columns
+            moving_avg = {
+                col_: windows_
+                for col_, windows_ in FEATURE_MOVING_AVG.items()
+                if col_ in columns
+            }
+            variation = {
+                col_: span_
+                for col_, span_ in FEATURE_VARIATION.items()
+                if col_ in columns
+            }
+            if not moving_avg and not variation:
+                continue
+            if name_ not in buffers.engines:
+                buffers.engines[name_] = FeatureEngine(
+                    moving_avg,
+                    variation,
+                    centroids=get_variation_centroids() if variation else None,
+                    freq=buffers.freq,
+                )
+            engine = buffers.engines[name_]
+
+            fill, lag = None, 0
+            if DATA_QUALITY_SERVING:
+                fill = partial(fill_gaps, columns=columns)
+                rules = get_column_policies()
+                lag = max(rules[col_]["max_gap"] + 1 for col_ in engine.inputs)
+            settled = buffers.last_observed[name_] - lag * pd.Timedelta(buffers.freq)
+            features.update(engine.update_buffer(buffers[name_], settled, fill=fill))
+
+    return features
+
+
 def get_availability_score(
     df_data: pd.DataFrame, top_n_features: int = TOP_N_FEAT
 ) -> tuple[float, bool]:
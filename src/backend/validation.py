@@ -139,6 +139,10 @@ class OutputDataModel(BaseModel):
     input_availability_alert: bool = Field(
         description="Whether the input availability score is below a minimum reliability threshold identified by the modeller"
     )
+    input_skipped_sources: list[str] = Field(
+        default=[],
+        description="Data sources which did not answer within the latency budget (or failed), and whose inputs are therefore treated as missing",
+    )
     ie_fix: Optional[float] = Field(
         description="Auroral-zone magnetic activity produced by enhanced ionospheric currents flowing below and within the auroral oval in the sector covered by the FMI-IMAGE magnetometer network"
     )
@@ -0,0 +1,76 @@
+"""
+Compares the per-call overhead of the pandas-based inference path against the
+`FastScorer` one; run from `src` as `python -m benchmarks.inference`
+"""
+
+from time import perf_counter
+
+import catboost as cb
+import pandas as pd
+
+from model import MODEL_PATH
+from model.calibration import get_venn_abers_score, load_calibration_set
+from model.inference import FastScorer
+
+
+def benchmark_inference(
+    scorer: FastScorer, record: dict, n_runs: int = 200
+) -> dict[str, float]:
+    """
+    Compares the per-call overhead (in milliseconds) of the pandas-based
+    inference path against the `FastScorer` one, for a single record
+
+    Parameters
+    ----------
+    scorer : FastScorer
+        Scorer wrapping the model to be benchmarked
+    record : dict
+        Model input, e.g. the output of `InputDataModel.model_dump()`
+    n_runs : int, optional
+        Number of repetitions, by default 200
+
+    Returns
+    -------
+    dict[str, float]
+        Mean time per call of the raw and calibrated scoring, for both paths
+    """
+    timings = {}
+
+    start = perf_counter()
+    for _ in range(n_runs):
+        scorer.model.predict_proba(pd.DataFrame([record]))
+    timings["pandas_raw_ms"] = 1e3 * (perf_counter() - start) / n_runs
+
+    start = perf_counter()
+    for _ in range(n_runs):
+        scorer.model.predict_proba(scorer.to_features_data(record))
+    timings["numpy_raw_ms"] = 1e3 * (perf_counter() - start) / n_runs
+
+    if scorer.p_cal is not None:
+        start = perf_counter()
+        for _ in range(n_runs):
+            # The calibration set is re-scored at every call, as in the original path
+            score = scorer.model.predict_proba(pd.DataFrame([record]))
+            get_venn_abers_score(
+                p_cal=scorer.model.predict_proba(scorer.X_cal),
+                y_cal=scorer.y_cal,
+                p_test=score,
+            )
+        timings["pandas_calib_ms"] = 1e3 * (perf_counter() - start) / n_runs
+
+        start = perf_counter()
+        for _ in range(n_runs):
+            scorer.predict(record)
+        timings["numpy_calib_ms"] = 1e3 * (perf_counter() - start) / n_runs
+
+    return timings
+
+
+if __name__ == "__main__":
+    model = cb.CatBoostClassifier().load_model(MODEL_PATH)
+    X_cal, y_cal = load_calibration_set()
+    scorer = FastScorer(model, X_cal=X_cal, y_cal=y_cal)
+    # Any record will do: the overhead does not depend on the feature values
+    record = {col_: 0 for col_ in scorer.feature_names}
+    for name_, ms_ in benchmark_inference(scorer, record).items():
+        print(f"{name_}: {ms_:.3f}")
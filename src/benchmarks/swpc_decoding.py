@@ -0,0 +1,73 @@
+"""
+Compares the time spent decoding NOAA SWPC products with `pd.read_json` and with
+`decode_swpc_json`; run from `src` as `python -m benchmarks.swpc_decoding`
+"""
+
+from io import StringIO
+from time import perf_counter
+
+import pandas as pd
+import requests
+
+from backend import FETCH_DEADLINE
+from backend.io import decode_swpc_json
+
+PRODUCTS = [
+    "https://services.swpc.noaa.gov/products/solar-wind/mag-7-day.json",
+    "https://services.swpc.noaa.gov/products/solar-wind/plasma-7-day.json",
+    "https://services.swpc.noaa.gov/products/kyoto-dst.json",
+]
+
+
+def benchmark_swpc_decoding(content: bytes, n_runs: int = 20) -> dict[str, float]:
+    """
+    Compares the time (in milliseconds) spent decoding a NOAA SWPC product with
+    `pd.read_json` and with `decode_swpc_json`, e.g. on the 7-day variants of the
+    products (".../solar-wind/mag-7-day.json", ".../solar-wind/plasma-7-day.json")
+
+    Parameters
+    ----------
+    content : bytes
+        Raw JSON payload of the product
+    n_runs : int, optional
+        Number of repetitions, by default 20
+
+    Returns
+    -------
+    dict[str, float]
+        Mean time per decoding, for both paths
+    """
+
+    def decode_with_pandas():
+        df = pd.read_json(StringIO(content.decode()), convert_dates=False)
+        df.columns = df.iloc[0]
+        df = df[1:].reset_index(drop=True)
+        for col_ in df.columns:
+            if "time_" in col_:
+                df[col_] = pd.to_datetime(df[col_])
+            else:
+                df[col_] = pd.to_numeric(df[col_])
+        return df
+
+    timings = {}
+    for name_, decode_ in [
+        ("pandas_ms", decode_with_pandas),
+        ("numpy_ms", lambda: decode_swpc_json(content)),
+    ]:
+        start = perf_counter()
+        for _ in range(n_runs):
+            decode_()
+        timings[name_] = 1e3 * (perf_counter() - start) / n_runs
+
+    return timings
+
+
+if __name__ == "__main__":
+    for url_ in PRODUCTS:
+        timings = benchmark_swpc_decoding(
+            requests.get(url_, timeout=FETCH_DEADLINE).content
+        )
+        print(
+            f"{url_.rsplit('/', 1)[-1]}: pandas {timings['pandas_ms']:.1f} ms, "
+            f"numpy {timings['numpy_ms']:.1f} ms"
+        )
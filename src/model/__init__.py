@@ -7,11 +7,6 @@ MODEL_PATH = Path(
     # "47379e58abff4b18989898a5b6ecbe08",
     "model.cb",
 )
-CALIB_X_DATA_PATH = Path(
-    "assets",
-    "data",
-    "X_cal.pkl",
-)
 CALIB_Y_DATA_PATH = Path(
     "assets",
     "data",
@@ -1,9 +1,16 @@
+from pathlib import Path
+import logging
 import pickle
 
 import numpy as np
-from venn_abers import VennAbersCalibrator
+import pandas as pd
+from venn_abers import VennAbersCalibrator, VennAbers
 
-from . import CALIB_X_DATA_PATH, CALIB_Y_DATA_PATH
+from backend import ML_MODEL_COLS, FEATURE_STORE_PATH
+from backend.store import read_features
+from . import CALIB_Y_DATA_PATH
+
+logger = logging.getLogger(__name__)
 
 
 @np.errstate(divide="ignore", invalid="ignore")
@@ -20,8 +27,70 @@ def get_venn_abers_score(p_cal, y_cal, p_test):
     return score[:, 1]
 
 
-with open(CALIB_X_DATA_PATH, "rb") as f:
-    X_cal = pickle.load(f)
+@np.errstate(divide="ignore", invalid="ignore")
+def fit_venn_abers(p_cal, y_cal) -> VennAbers:
+    """
+    Fits the (inductive) Venn-ABERS calibrator once, so that calibrating new scores
+    only requires a lookup into the precomputed isotonic regressions
+
+    Parameters
+    ----------
+    p_cal : np.ndarray
+        Raw model scores of the calibration set, with shape (n_samples, 2)
+    y_cal : np.ndarray
+        Target of the calibration set
+
+    Returns
+    -------
+    VennAbers
+        Fitted calibrator, yielding the same scores as `get_venn_abers_score`
+    """
+    return VennAbers().fit(p_cal=p_cal, y_cal=np.asarray(y_cal))
+
 
-with open(CALIB_Y_DATA_PATH, "rb") as f:
-    y_cal = pickle.load(f)
+def load_calibration_set(
+    path: Path = FEATURE_STORE_PATH,
+) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    Loads the calibration set: its target from CALIB_Y_DATA_PATH, and its
+    features from the feature store (where they are backfilled from the training
+    catalog, see `backend.store.label_features`), so that the calibration scores
+    are computed on the same features the model is trained and served with
+
+    Parameters
+    ----------
+    path : Path, optional
+        Root of the feature store, by default FEATURE_STORE_PATH
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.Series]
+        Features (in `ML_MODEL_COLS` order) and target; both None if the store
+        does not hold the features of every calibration row, in which case
+        scores are served uncalibrated
+    """
+    with open(CALIB_Y_DATA_PATH, "rb") as f:
+        y_cal = pickle.load(f)
+
+    X_cal = read_features(
+        start=y_cal.index.min(),
+        end=y_cal.index.max(),
+        columns=list(ML_MODEL_COLS.keys()),
+        path=path,
+    ).reindex(y_cal.index)
+    n_missing = X_cal.isna().all(axis=1).sum()
+    if n_missing:
+        logger.warning(
+            f"Calibration features missing from the feature store for {n_missing} "
+            f"of {len(y_cal)} rows: scores are not calibrated"
+        )
+        return None, None
+
+    # Variation labels are nullable integers in the store
+    X_cal = X_cal.astype(
+        {
+            col_: type_ if type_ != "int" or X_cal[col_].notna().all() else "float"
+            for col_, type_ in ML_MODEL_COLS.items()
+        }
+    )
+    return X_cal, y_cal
@@ -0,0 +1,144 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier, FeaturesData
+
+from backend import ML_MODEL_COLS
+from backend.tracing import stage
+from model.calibration import fit_venn_abers
+
+
+class FastScorer:
+    """
+    Direct NumPy inference path for the CatBoost model, which bypasses pandas
+    and produces raw and calibrated scores in a single call
+
+    Numerical features are written into a preallocated float32 array (in
+    `ML_MODEL_COLS` order) and categorical ones into a small object array; both
+    are handed to CatBoost as `FeaturesData`, i.e. the low-level input format
+    that skips any DataFrame inspection and type conversion. Scores for the
+    calibration set are computed, and the Venn-ABERS calibrator fitted, only once
+    at instantiation time.
+
+    Parameters
+    ----------
+    model : CatBoostClassifier
+        Trained model
+    X_cal : pd.DataFrame, optional
+        Features of the calibration set, by default None (no calibration)
+    y_cal : Union[pd.Series, np.ndarray], optional
+        Target of the calibration set, by default None (no calibration)
+    """
+
+    def __init__(
+        self,
+        model: CatBoostClassifier,
+        X_cal: pd.DataFrame = None,
+        y_cal: Union[pd.Series, np.ndarray] = None,
+    ):
+        self.model = model
+        self.feature_names = list(ML_MODEL_COLS.keys())
+        if model.feature_names_ and model.feature_names_ != self.feature_names:
+            raise ValueError("Model features do not match ML_MODEL_COLS")
+
+        cat_idx = set(model.get_cat_feature_indices())
+        self.num_cols = [
+            col_ for i, col_ in enumerate(self.feature_names) if i not in cat_idx
+        ]
+        self.cat_cols = [
+            col_ for i, col_ in enumerate(self.feature_names) if i in cat_idx
+        ]
+
+        # Buffers for single-row scoring, reused across calls
+        self._num_row = np.empty((1, len(self.num_cols)), dtype=np.float32)
+        self._cat_row = np.empty((1, len(self.cat_cols)), dtype=object)
+
+        # Raw scores of the calibration set never change, so they are cached
+        self.X_cal = X_cal
+        if X_cal is not None and y_cal is not None:
+            self.p_cal = model.predict_proba(X_cal)
+            self.y_cal = np.asarray(y_cal)
+            self.calibrator = fit_venn_abers(self.p_cal, self.y_cal)
+        else:
+            self.p_cal, self.y_cal, self.calibrator = None, None, None
+
+    def _fill(self, num_data: np.ndarray, cat_data: np.ndarray, records: list[dict]):
+        for i, record in enumerate(records):
+            for j, col_ in enumerate(self.num_cols):
+                value = record.get(col_)
+                num_data[i, j] = np.nan if value is None else value
+            for j, col_ in enumerate(self.cat_cols):
+                value = record.get(col_)
+                # CatBoost hashes categorical values as strings
+                cat_data[i, j] = b"nan" if value is None else str(int(value)).encode()
+
+    def to_features_data(
+        self, data: Union[dict, list[dict], pd.DataFrame]
+    ) -> FeaturesData:
+        """
+        Converts model inputs to CatBoost low-level `FeaturesData`
+
+        Parameters
+        ----------
+        data : Union[dict, list[dict], pd.DataFrame]
+            A single record, a list of records or a DataFrame with (at least)
+            the `ML_MODEL_COLS` columns
+
+        Returns
+        -------
+        FeaturesData
+        """
+        if isinstance(data, pd.DataFrame):
+            num_data = data[self.num_cols].to_numpy(dtype=np.float32)
+            cat_data = (
+                data[self.cat_cols].astype(int).astype(str).to_numpy(dtype=bytes)
+            ).astype(object)
+        else:
+            records = [data] if isinstance(data, dict) else data
+            if len(records) == 1:
+                num_data, cat_data = self._num_row, self._cat_row
+                # FeaturesData flags its inputs as read-only, but we own the buffers
+                num_data.setflags(write=True)
+                cat_data.setflags(write=True)
+            else:
+                num_data = np.empty((len(records), len(self.num_cols)), np.float32)
+                cat_data = np.empty((len(records), len(self.cat_cols)), object)
+            self._fill(num_data, cat_data, records)
+
+        return FeaturesData(
+            num_feature_data=num_data,
+            cat_feature_data=cat_data,
+            num_feature_names=self.num_cols,
+            cat_feature_names=self.cat_cols,
+        )
+
+    def predict(
+        self, data: Union[dict, list[dict], pd.DataFrame]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Scores one or more observations
+
+        Parameters
+        ----------
+        data : Union[dict, list[dict], pd.DataFrame]
+            A single record, a list of records or a DataFrame with (at least)
+            the `ML_MODEL_COLS` columns
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            Raw scores and Venn-ABERS calibrated scores of the positive class;
+            the latter are NaN if no calibration set was provided
+        """
+        with stage("inference"):
+            p_test = self.model.predict_proba(self.to_features_data(data))
+
+        with stage("calibration"):
+            if self.calibrator is None:
+                p_calib = np.full(len(p_test), np.nan)
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    p_calib = self.calibrator.predict_proba(p_test)[0][:, 1]
+
+        return p_test[:, 1], p_calib
@@ -1,4 +1,6 @@
-from typing import Literal
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Literal
+import os
 
 import numpy as np
 import pandas as pd
@@ -65,6 +67,114 @@ def instantiate_and_fit_model(
     return model
 
 
+# Data of the cross-validation, shared by all the folds (set once in each worker
+# process, see `fit_folds`), so that each fold only slices its own train set
+_shared = {}
+
+
+def _share_data(X: pd.DataFrame, y: pd.Series):
+    _shared["X"], _shared["y"] = X, y
+
+
+def _fit_fold(
+    train_idx: np.ndarray,
+    test_idx: np.ndarray,
+    loss_function: str,
+    params: dict,
+) -> tuple[CatBoostClassifier, np.ndarray]:
+    # Trains the model of a fold and predicts its test set (in a worker process)
+    X, y = _shared["X"], _shared["y"]
+    X_test = X.iloc[test_idx]
+    model = instantiate_and_fit_model(
+        X_train=X.iloc[train_idx],
+        y_train=y.iloc[train_idx],
+        X_test=X_test,
+        y_test=y.iloc[test_idx],
+        loss_function=loss_function,
+        params=params,
+    )
+    return model, model.predict(X_test)
+
+
+def fit_folds(
+    X: pd.DataFrame,
+    y: pd.Series,
+    time_series_cross_validator: TimeSeriesSplit,
+    loss_function: str,
+    params: dict,
+    max_workers: int = 1,
+    thread_count: int = None,
+) -> Iterator[tuple[CatBoostClassifier, pd.Series, np.ndarray]]:
+    """
+    Trains the model of each cross-validation fold, either sequentially or in a
+    pool of processes, and yields the folds in order as soon as they (and all the
+    previous ones) are trained
+
+    CatBoost results depend on the number of threads, so every fold is trained
+    with the same thread budget, which does not depend on the number of workers:
+    given the same seed, models and predictions are identical whatever the number
+    of workers. The data are handed to each worker once, and each fold slices its
+    own train and test sets from them, so that only the folds being trained are
+    copied at any time. In the pool, the largest folds are submitted first, so
+    that the whole cross-validation takes about as long as the largest fold when
+    there are enough workers.
+
+    Parameters
+    ----------
+    X : pd.DataFrame
+        Input features
+    y : pd.Series
+        Target variable
+    time_series_cross_validator : TimeSeriesSplit
+        Cross-validator for time series
+    loss_function : str
+        Loss function for the model
+    params : dict
+        Hyper-parameters for the model
+    max_workers : int, optional
+        Number of worker processes, by default 1 (folds are trained sequentially
+        in the current process); with None, as many as the folds (up to the CPUs)
+    thread_count : int, optional
+        Threads of each fold, by default None: as set in `params` or, failing
+        that, the CPUs shared evenly between the folds, whether they are trained
+        sequentially or in parallel
+
+    Yields
+    ------
+    Iterator[tuple[CatBoostClassifier, pd.Series, np.ndarray]]
+        Trained model, test target and test predictions of each fold
+    """
+    folds = list(time_series_cross_validator.split(X))
+    n_cpus = os.cpu_count() or 1
+    n_workers = min(len(folds), n_cpus if max_workers is None else max_workers)
+    params = dict(params or {})
+    if thread_count is not None:
+        params["thread_count"] = thread_count
+    elif "thread_count" not in params:
+        params["thread_count"] = max(1, n_cpus // len(folds))
+
+    if n_workers <= 1:
+        _share_data(X, y)
+        try:
+            for train_idx, test_idx in folds:
+                model, y_pred = _fit_fold(train_idx, test_idx, loss_function, params)
+                yield model, y.iloc[test_idx], y_pred
+        finally:
+            _shared.clear()
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers, initializer=_share_data, initargs=(X, y)
+    ) as executor:
+        futures = {
+            i_: executor.submit(_fit_fold, *folds[i_], loss_function, params)
+            for i_ in sorted(range(len(folds)), key=lambda i_: -len(folds[i_][0]))
+        }
+        for i_, (_, test_idx) in enumerate(folds):
+            model, y_pred = futures[i_].result()
+            yield model, y.iloc[test_idx], y_pred
+
+
 def start_crossvalidated_run(
     X: pd.DataFrame,
     y: pd.Series,
@@ -76,6 +186,8 @@ def start_crossvalidated_run(
     log_params: bool = True,
     log_metrics: bool = True,
     log_model: bool = True,
+    max_workers: int = 1,
+    thread_count: int = None,
 ) -> tuple[CatBoostClassifier, tuple[list]]:
     """
     Convenience function to perform cross-validated training of a model.
@@ -104,6 +216,12 @@ def start_crossvalidated_run(
         Whether to log evaluation metrics, by default True
     log_model : bool, optional
         Whether to log the final model (if `model_signature` is also specified), by default True
+    max_workers : int, optional
+        Number of processes the folds are trained in, by default 1 (sequentially),
+        see `fit_folds`; logging always happens here, in fold order
+    thread_count : int, optional
+        Threads of each fold, by default None (see `fit_folds`); folds trained with
+        the same thread budget give the same results, sequentially or in parallel
 
     Returns
     -------
@@ -130,20 +248,17 @@ def start_crossvalidated_run(
                 rcs.append(r[1])
         else:
             # Train a model from scratch
-            for i, (train_idx, test_idx) in enumerate(
-                time_series_cross_validator.split(X)
-            ):
-                X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
-                y_train, y_test = y.iloc[train_idx], y.iloc[test_idx]
-
-                cat_model = instantiate_and_fit_model(
-                    X_train=X_train,
-                    y_train=y_train,
-                    X_test=X_test,
-                    y_test=y_test,
+            for i, (cat_model, y_test, y_pred) in enumerate(
+                fit_folds(
+                    X,
+                    y,
+                    time_series_cross_validator,
                     loss_function=model_loss,
                     params=model_params,
+                    max_workers=max_workers,
+                    thread_count=thread_count,
                 )
+            ):
                 # Check if h-params need to be logged
                 if log_params:
                     # See GitHub issue #8044 (MLflow) to understand why we need i
@@ -153,7 +268,6 @@ def start_crossvalidated_run(
                     }
                     mlflow.log_params(params)
 
-                y_pred = cat_model.predict(X_test)
                 # Evaluate in-fold metrics
                 p, r, f, _ = precision_recall_fscore_support(y_test, y_pred)
                 f1s.append(f[1])
@@ -0,0 +1,125 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backend.cache as cache
+from backend.cache import memoize
+
+CALLS = []
+
+
+@pytest.fixture(autouse=True)
+def preprocess_cache(tmp_path, monkeypatch):
+    # Each test starts from an empty cache of its own
+    CALLS.clear()
+    monkeypatch.setitem(cache._settings, "enabled", True)
+    monkeypatch.setitem(cache._settings, "path", tmp_path / "cache")
+    monkeypatch.setitem(cache._settings, "max_bytes", 2**30)
+    return tmp_path / "cache"
+
+
+def make_frame(n=48, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {"ie": rng.normal(100, 20, n), "iu": rng.normal(50, 10, n)},
+        index=pd.date_range("2024-05-10", periods=n, freq="30min", name="datetime"),
+    )
+
+
+@memoize()
+def smooth(df: pd.DataFrame, window: int = 4) -> tuple[pd.Series, np.ndarray]:
+    CALLS.append(window)
+    filtered = df["ie"].rolling(window).mean()
+    return filtered, np.sign(filtered.diff().to_numpy())
+
+
+@memoize(files=lambda file, **_: [file])
+def read_values(file: Path) -> pd.DataFrame:
+    CALLS.append(file)
+    return pd.read_csv(file)
+
+
+def make_versioned(version):
+    @memoize(version=version)
+    def scale(df: pd.DataFrame) -> pd.DataFrame:
+        CALLS.append(version)
+        return df * 2
+
+    return scale
+
+
+def test_results_are_reused():
+    df = make_frame()
+    filtered, signs = smooth(df)
+    cached_filtered, cached_signs = smooth(df, window=4)
+
+    assert CALLS == [4]
+    pd.testing.assert_series_equal(cached_filtered, filtered)
+    assert cached_filtered.index.freq == filtered.index.freq
+    np.testing.assert_array_equal(cached_signs, signs)
+
+
+def test_disabled_cache_recomputes(preprocess_cache, monkeypatch):
+    monkeypatch.setitem(cache._settings, "enabled", False)
+    df = make_frame()
+    smooth(df)
+    smooth(df)
+
+    assert CALLS == [4, 4]
+    assert not preprocess_cache.exists()
+
+
+def test_arguments_and_data_invalidate():
+    df = make_frame()
+    smooth(df)
+    smooth(df, window=6)
+    smooth(make_frame(seed=1))
+    # Same values, other index
+    smooth(df.shift(1, freq="30min"))
+    smooth(df)
+
+    assert CALLS == [4, 6, 4, 4]
+
+
+def test_input_files_invalidate(tmp_path):
+    file = tmp_path / "values.csv"
+    file.write_text("a,b\n1,2\n")
+    read_values(file)
+    read_values(file)
+    file.write_text("a,b\n1,2\n3,4\n")
+    df = read_values(file=file)
+
+    assert CALLS == [file, file]
+    assert len(df) == 2
+
+
+def test_versions_and_code_invalidate(monkeypatch):
+    df = make_frame()
+    make_versioned("1")(df)
+    make_versioned("1")(df)
+    make_versioned("2")(df)
+    assert CALLS == ["1", "2"]
+
+    # Any change to the source code of the module (or its dependencies)
+    monkeypatch.setattr(cache, "_code_version", lambda module_name: "changed")
+    make_versioned("2")(df)
+    assert CALLS == ["1", "2", "2"]
+
+
+def test_least_recently_used_entries_are_evicted(preprocess_cache, monkeypatch):
+    df = make_frame(n=2_000)
+    smooth(df, window=2)
+    entry_size = sum(f_.stat().st_size for f_ in preprocess_cache.glob("*/*"))
+    monkeypatch.setitem(cache._settings, "max_bytes", 2.5 * entry_size)
+
+    smooth(df, window=3)
+    # A hit refreshes the first entry, so the second one is evicted next
+    smooth(df, window=2)
+    smooth(df, window=4)
+    assert len(list(preprocess_cache.iterdir())) == 2
+
+    smooth(df, window=2)
+    smooth(df, window=3)
+    assert CALLS == [2, 3, 4, 3]
@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backend.coupling as coupling
+from backend.coupling import (
+    EARTH_RADIUS,
+    MU_0,
+    PROTON_MASS,
+    get_akasofu_epsilon,
+    get_borovsky,
+    get_clock_angle,
+    get_coupling_functions,
+    get_dynamic_pressure,
+    get_newell,
+    propagate_to_bow_shock,
+)
+
+
+def make_l1(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "speed": rng.uniform(250, 900, n),
+            "rho": rng.uniform(0.5, 30, n),
+            "bx": rng.normal(0, 5, n),
+            "by": rng.normal(0, 5, n),
+            "bz": rng.normal(0, 5, n),
+        },
+        index=pd.date_range("2024-05-10", periods=n, freq="1min", name="datetime"),
+    )
+
+
+def textbook_sin_half_clock(by, bz, folded=False):
+    # sin(theta / 2), from the clock angle itself
+    theta = np.arctan2(np.abs(by), np.abs(bz)) if folded else np.arctan2(by, bz)
+    return np.abs(np.sin(theta / 2))
+
+
+def test_clock_angle():
+    by = np.array([0.0, 1.0, 0.0, -1.0, 0.0])
+    bz = np.array([1.0, 0.0, -1.0, 0.0, 0.0])
+    np.testing.assert_allclose(get_clock_angle(by, bz), [0, 90, 180, -90, 0])
+    np.testing.assert_allclose(get_clock_angle(by, bz, degrees=False)[1], np.pi / 2)
+
+
+@pytest.mark.parametrize("folded", [False, True])
+def test_newell_matches_definition(folded):
+    df = make_l1(1_000)
+    speed, by, bz = df["speed"].values, df["by"].values, df["bz"].values
+    expected = (
+        speed ** (4 / 3)
+        * np.hypot(by, bz) ** (2 / 3)
+        * textbook_sin_half_clock(by, bz, folded) ** (8 / 3)
+    )
+    np.testing.assert_allclose(get_newell(speed, by, bz, folded=folded), expected)
+
+
+@pytest.mark.parametrize("with_bx", [False, True])
+def test_akasofu_epsilon_matches_definition(with_bx):
+    df = make_l1(1_000)
+    speed, bx, by, bz = (df[col_].values for col_ in ["speed", "bx", "by", "bz"])
+    b2 = by**2 + bz**2 + (bx**2 if with_bx else 0)
+    # In W, from SI units
+    expected = (
+        4
+        * np.pi
+        / MU_0
+        * speed
+        * 1e3
+        * b2
+        * 1e-18
+        * textbook_sin_half_clock(by, bz) ** 4
+        * (7 * EARTH_RADIUS) ** 2
+    )
+    epsilon = get_akasofu_epsilon(speed, by, bz, bx=bx if with_bx else None)
+    np.testing.assert_allclose(epsilon * 1e9, expected)
+
+
+def test_borovsky_matches_definition():
+    df = make_l1(1_000)
+    speed, rho, by, bz = (df[col_].values for col_ in ["speed", "rho", "by", "bz"])
+    # In V/m, from SI units
+    expected = (
+        0.4
+        * np.sqrt(MU_0 / 4)
+        * textbook_sin_half_clock(by, bz) ** 2
+        * np.sqrt(PROTON_MASS * rho * 1e6)
+        * (speed * 1e3) ** 2
+    )
+    np.testing.assert_allclose(get_borovsky(speed, rho, by, bz) / 1e3, expected)
+
+
+def test_dynamic_pressure():
+    # Typical quiet solar wind: about 1.3 nPa
+    np.testing.assert_allclose(get_dynamic_pressure(400.0, 5.0), 1.3381, rtol=1e-4)
+
+
+def test_no_transverse_field_no_coupling():
+    zeros = np.zeros(3)
+    speed, rho = np.full(3, 400.0), np.full(3, 5.0)
+    np.testing.assert_array_equal(get_newell(speed, zeros, zeros), 0)
+    np.testing.assert_array_equal(get_akasofu_epsilon(speed, zeros, zeros), 0)
+    np.testing.assert_array_equal(get_borovsky(speed, rho, zeros, zeros), 0)
+
+
+def test_kernels_are_chunked_and_write_into_out(monkeypatch):
+    df = make_l1(1_000)
+    speed, by, bz = df["speed"].values, df["by"].values, df["bz"].values
+    expected = get_newell(speed, by, bz)
+
+    monkeypatch.setattr(coupling, "_CHUNK_SIZE", 64)
+    out = np.empty(len(df))
+    result = get_newell(speed, by, bz, out=out)
+    assert result is out
+    np.testing.assert_array_equal(out, expected)
+    # Scalars broadcast against arrays
+    np.testing.assert_allclose(
+        get_newell(400.0, by, bz), get_newell(np.full(len(df), 400.0), by, bz)
+    )
+
+
+def test_coupling_functions_frame():
+    df = make_l1(100).assign(newell=-1.0)
+    out = get_coupling_functions(df)
+
+    assert list(out.columns) == [
+        *[col_ for col_ in df.columns if col_ != "newell"],
+        "clock_angle",
+        "newell",
+        "epsilon",
+        "borovsky",
+        "p_dyn",
+    ]
+    pd.testing.assert_frame_equal(
+        out[["speed", "rho", "bx", "by", "bz"]], df.iloc[:, :5]
+    )
+    np.testing.assert_allclose(
+        out["newell"], get_newell(df["speed"], df["by"], df["bz"], folded=True)
+    )
+    np.testing.assert_allclose(
+        out["epsilon"], get_akasofu_epsilon(df["speed"], df["by"], df["bz"], df["bx"])
+    )
+
+
+def make_samples(times, speeds):
+    return pd.DataFrame(
+        {"speed": speeds, "bz": np.arange(len(speeds), dtype=float)},
+        index=pd.DatetimeIndex(times),
+    )
+
+
+def test_propagation_delays():
+    distance = 1.2e6
+    df = make_samples(
+        ["2024-05-10 00:00", "2024-05-10 00:01", "2024-05-10 00:02"],
+        [600.0, 500.0, 400.0],
+    )
+    out = propagate_to_bow_shock(df, distance=distance)
+
+    delays = pd.to_timedelta(np.round(distance / df["speed"].values), unit="s")
+    expected = (df.index + delays).rename("datetime")
+    pd.testing.assert_index_equal(out.index, expected)
+    np.testing.assert_array_equal(out["bz"], df["bz"])
+
+
+def test_propagation_overtaking():
+    distance = 1.2e6
+    # The fast sample measured at 00:20 (1500 s to travel) reaches the bow shock
+    # before the slow one measured at 00:00 (3000 s), which it overtakes
+    df = make_samples(
+        ["2024-05-10 00:00", "2024-05-10 00:20", "2024-05-10 00:40"],
+        [400.0, 800.0, 800.0],
+    )
+    out = propagate_to_bow_shock(df, distance=distance)
+
+    assert out.index.is_monotonic_increasing
+    assert list(out["bz"]) == [1.0, 0.0, 2.0]
+
+    # On a grid, each time takes the sample standing at the bow shock by then
+    grid = propagate_to_bow_shock(df, distance=distance, freq="5min")
+    assert grid.index.is_monotonic_increasing
+    assert grid.index[0] == pd.Timestamp("2024-05-10 00:45")
+    assert grid.loc["2024-05-10 00:50", "bz"] == 0.0
+    assert grid.loc["2024-05-10 01:05", "bz"] == 2.0
+    # Beyond the tolerance, no sample is fresh enough
+    assert grid.loc["2024-05-10 00:55"].isna().all()
+
+
+def test_propagation_same_arrival_keeps_latest_measurement():
+    distance = 1.2e6
+    # 3000 s and 2400 s to travel: both arrive at 00:50
+    df = make_samples(["2024-05-10 00:00", "2024-05-10 00:10"], [400.0, 500.0])
+    out = propagate_to_bow_shock(df, distance=distance)
+    assert len(out) == 1
+    assert out["bz"].iloc[0] == 1.0
+
+
+def test_propagation_skips_invalid_speeds():
+    df = make_samples(
+        ["2024-05-10 00:00", "2024-05-10 00:01", "2024-05-10 00:02"],
+        [np.nan, 0.0, 500.0],
+    )
+    out = propagate_to_bow_shock(df, distance=1e6)
+    assert list(out["bz"]) == [2.0]
+
+    empty = propagate_to_bow_shock(df.iloc[:2], distance=1e6)
+    assert empty.empty
+    assert empty.index.name == "datetime"
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.dataset import (
+    SequenceDataset,
+    get_lagged_features,
+    get_supervised_dataset,
+    get_window_targets,
+)
+
+
+def make_grid(n):
+    return pd.date_range("2024-05-10", periods=n, freq="30min", name="datetime")
+
+
+def make_features(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        rng.normal(0, 1, (n, 3)), index=make_grid(n), columns=["ie", "iu", "hf"]
+    )
+
+
+def test_window_targets_match_rolling_sum():
+    rng = np.random.default_rng(0)
+    events = pd.Series(rng.choice([0, 1, 2, np.nan], 300), index=make_grid(300))
+    targets = get_window_targets(events, horizons=[1, 3, 6])
+
+    assert list(targets.columns) == ["tid_within_1h", "tid_within_3h", "tid_within_6h"]
+    for h_, col_ in zip([1, 3, 6], targets.columns):
+        steps = 2 * h_
+        # Events in the bin itself and in the next `steps` bins, as in the catalog
+        expected = (
+            (events.fillna(0) > 0)
+            .astype(int)
+            .rolling(steps + 1)
+            .sum()
+            .shift(-steps)
+            .gt(0)
+            .astype(int)
+        )
+        pd.testing.assert_series_equal(targets[col_], expected, check_names=False)
+        # The window of the last bins runs past the end of the series
+        assert (targets[col_].iloc[-steps:] == 0).all()
+
+
+def test_window_targets_time_interval():
+    index = pd.date_range("2024-05-10", periods=8, freq="1h")
+    events = pd.Series([0, 0, 0, 1, 0, 0, 0, 0], index=index)
+    targets = get_window_targets(events, horizons=[1], time_interval="1h", name="e")
+    assert list(targets["e_within_1h"]) == [0, 0, 1, 1, 0, 0, 0, 0]
+
+
+def test_lagged_features_match_shift():
+    df = make_features(n=20)
+    lagged = get_lagged_features(df, ["ie", "hf"], lags=[1, 3], leads=[2])
+
+    assert list(lagged.columns) == [
+        "ie_lag_1",
+        "hf_lag_1",
+        "ie_lag_3",
+        "hf_lag_3",
+        "ie_lead_2",
+        "hf_lead_2",
+    ]
+    for col_ in ["ie", "hf"]:
+        for k_ in [1, 3]:
+            pd.testing.assert_series_equal(
+                lagged[f"{col_}_lag_{k_}"], df[col_].shift(k_), check_names=False
+            )
+        pd.testing.assert_series_equal(
+            lagged[f"{col_}_lead_2"], df[col_].shift(-2), check_names=False
+        )
+
+    assert get_lagged_features(df, ["ie"]).shape == (len(df), 0)
+
+
+def test_supervised_dataset():
+    df = make_features(n=50)
+    events = pd.Series(1.0, index=df.index[[10, 40]])
+    dataset = get_supervised_dataset(
+        df, events, horizons=[3], lagged_cols=["ie"], lags=[1]
+    )
+
+    assert list(dataset.columns) == ["ie", "iu", "hf", "ie_lag_1", "tid_within_3h"]
+    pd.testing.assert_frame_equal(dataset[df.columns], df)
+    # Bins missing from the event series are not events
+    assert dataset["tid_within_3h"].sum() == 14
+    assert dataset["tid_within_3h"].iloc[4:11].all()
+
+
+def test_sequences_match_slices():
+    df = make_features(n=100)
+    y = pd.Series(np.arange(100, dtype=float), index=df.index)
+    dataset = SequenceDataset(
+        df, y, window=8, stride=3, horizon=2, batch_size=10, shuffle=False
+    )
+
+    starts = np.arange(0, 100 - 8 - 2 + 1, 3)
+    np.testing.assert_array_equal(dataset.samples, starts)
+    pd.testing.assert_index_equal(dataset.index, df.index[starts + 7])
+    assert len(dataset) == -(-len(starts) // 10)
+
+    batches = list(dataset)
+    X = np.concatenate([X_ for X_, _ in batches])
+    targets = np.concatenate([y_ for _, y_ in batches])
+    assert X.shape == (len(starts), 8, 3) and targets.shape == (len(starts), 1)
+    for i_, s_ in enumerate(starts):
+        np.testing.assert_array_equal(
+            X[i_], df.iloc[s_ : s_ + 8].to_numpy(dtype=np.float32)
+        )
+        assert targets[i_, 0] == s_ + 7 + 2
+
+    with pytest.raises(IndexError):
+        dataset[len(dataset)]
+
+
+def test_sequences_nan_policies():
+    df = make_features(n=60)
+    df.iloc[20, 1] = np.nan
+    y = pd.Series(0.0, index=df.index)
+    y.iloc[40] = np.nan
+
+    dropped = SequenceDataset(df, y, window=5, batch_size=100, shuffle=False)
+    # Windows over row 20, and the sample whose target is missing, are skipped
+    expected = [s_ for s_ in range(56) if not 16 <= s_ <= 20 and s_ + 4 != 40]
+    np.testing.assert_array_equal(dropped.samples, expected)
+
+    masked = SequenceDataset(
+        df, y, window=5, batch_size=100, shuffle=False, nan_policy="mask"
+    )
+    np.testing.assert_array_equal(
+        masked.samples, [s_ for s_ in range(56) if s_ + 4 != 40]
+    )
+    X, _ = masked[0]
+    assert not np.isnan(X).any()
+    assert X[16, 4, 1] == 0.0
+    # Masking does not alter the underlying matrix
+    assert np.isnan(masked.sequences[16, 4, 1])
+
+    with pytest.raises(ValueError):
+        SequenceDataset(df, y, nan_policy="zero")
+    with pytest.raises(ValueError):
+        SequenceDataset(df, y.iloc[1:])
+
+
+def test_sequences_shuffle_each_epoch():
+    df = make_features(n=100)
+    y = pd.Series(0.0, index=df.index)
+    dataset = SequenceDataset(df, y, window=4, batch_size=16, seed=0)
+
+    first = np.concatenate([X_[:, -1, 0] for X_, _ in dataset])
+    second = np.concatenate([X_[:, -1, 0] for X_, _ in dataset])
+    # Every sample once per epoch, in a new order
+    np.testing.assert_array_equal(np.sort(first), np.sort(second))
+    assert not np.array_equal(first, second)
+    np.testing.assert_array_equal(
+        np.sort(first), np.sort(df["ie"].to_numpy(np.float32)[3:])
+    )
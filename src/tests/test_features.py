@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend import FEATURE_MOVING_AVG, FEATURE_VARIATION
+from backend.buffer import RingBuffer
+from backend.features import FeatureEngine
+from backend.preprocess import fit_variation_centroids, get_categories, get_moving_avg
+
+
+def make_bins(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        np.round(rng.gamma(2.0, 50.0, (n, 3)), 2),
+        index=pd.date_range("2024-05-10", periods=n, freq="30min", name="datetime"),
+        columns=["hf", "ie", "iu"],
+    )
+    # Gaps, which moving averages skip until they leave the window
+    df.iloc[40:43, 0] = np.nan
+    df.iloc[100, 1:] = np.nan
+    return df
+
+
+@pytest.fixture
+def centroids():
+    df = make_bins(n=2_000, seed=1)
+    return {col_: fit_variation_centroids(df[col_]) for col_ in ["ie", "iu"]}
+
+
+def get_batch_features(df, centroids):
+    # Features of the frame, as the batch functions compute them
+    df_mav = df
+    for col_, windows_ in FEATURE_MOVING_AVG.items():
+        df_mav = get_moving_avg(df_mav, [col_], windows_)
+    features = df_mav.drop(columns=df.columns)
+    for col_, span_ in FEATURE_VARIATION.items():
+        _, labels = get_categories(
+            df[col_], window=span_, zero_phase=False, centroids=centroids[col_]
+        )
+        features[f"{col_}_variation"] = np.r_[0, labels]
+    return features
+
+
+def test_engine_matches_batch(centroids):
+    df = make_bins()
+    engine = FeatureEngine(centroids=centroids)
+    features = engine.update_frame(df)
+
+    assert engine.inputs == ["hf", "ie", "iu"]
+    expected = get_batch_features(df, centroids)[engine.columns]
+    pd.testing.assert_frame_equal(features, expected, check_dtype=False)
+    assert engine.features == features.iloc[-1].to_dict()
+
+
+def test_engine_revisions_and_missing_bins(centroids):
+    df = make_bins()
+    expected = FeatureEngine(centroids=centroids).update_frame(df)
+
+    engine = FeatureEngine(centroids=centroids)
+    for ts_, row_ in zip(df.index, df.to_dict("records")):
+        # Each bin is first seen half-filled, then revised
+        engine.update(ts_, {col_: value_ / 2 for col_, value_ in row_.items()})
+        features = engine.update(ts_, row_)
+    assert features == expected.iloc[-1].to_dict()
+
+    # Skipped bins are treated as missing
+    sparse = df.drop(index=df.index[150:153])
+    engine = FeatureEngine(centroids=centroids)
+    features = engine.update_frame(sparse)
+    missing = df.copy()
+    missing.iloc[150:153] = np.nan
+    reference = FeatureEngine(centroids=centroids).update_frame(missing)
+    pd.testing.assert_frame_equal(features, reference.loc[sparse.index])
+
+    with pytest.raises(ValueError):
+        engine.update(df.index[0], {})
+
+
+def test_engine_requires_centroids(centroids):
+    with pytest.raises(ValueError):
+        FeatureEngine(centroids={"ie": centroids["ie"]})
+    FeatureEngine(variation={}, centroids=None)
+
+
+def test_engine_save_and_load(tmp_path, centroids):
+    df = make_bins()
+    expected = FeatureEngine(centroids=centroids).update_frame(df)
+
+    engine = FeatureEngine(centroids=centroids)
+    engine.update_frame(df.iloc[:200])
+    engine.save(tmp_path / "engine.pickle")
+    restored = FeatureEngine.load(tmp_path / "engine.pickle")
+
+    pd.testing.assert_frame_equal(
+        restored.update_frame(df.iloc[200:]), expected.iloc[200:]
+    )
+
+
+def test_engine_update_buffer(centroids):
+    df = make_bins()
+    expected = FeatureEngine(centroids=centroids).update_frame(df)
+    buffer = RingBuffer(["iu", "ie", "hf"], capacity=48)
+    engine = FeatureEngine(centroids=centroids)
+
+    # Bins come in a few at a time; the last two are not settled yet
+    for end_ in range(10, len(df) + 1, 10):
+        chunk = df.iloc[end_ - 10 : end_]
+        buffer.extend(chunk.index, chunk[buffer.columns].to_numpy())
+        features = engine.update_buffer(buffer, settled=df.index[end_ - 2])
+
+        pd.testing.assert_series_equal(
+            pd.Series(features), expected.iloc[end_ - 1], check_names=False
+        )
+        assert engine.last_timestamp == df.index[end_ - 3]
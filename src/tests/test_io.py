@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.io import decode_swpc_json
+
+ROWS = [
+    ["time_tag", "propagated_time_tag", "speed", "density", "bz"],
+    ["2024-05-10 00:00:00.000", "2024-05-10 00:41:00.000", "400.5", "5.1", "-3.2"],
+    ["2024-05-10 00:01:00.000", "2024-05-10 00:42:00.000", 401.0, None, 2],
+    ["2024-05-10 00:02:00.000", "2024-05-10 00:43:00.000", None, "4.9", "0"],
+]
+
+
+@pytest.mark.parametrize("encode", [str, str.encode])
+def test_decode_swpc_json(encode):
+    df = decode_swpc_json(encode(json.dumps(ROWS)))
+
+    expected = pd.DataFrame(
+        {
+            "time_tag": pd.to_datetime([row_[0] for row_ in ROWS[1:]]),
+            "propagated_time_tag": pd.to_datetime([row_[1] for row_ in ROWS[1:]]),
+            "speed": [400.5, 401.0, np.nan],
+            "density": [5.1, np.nan, 4.9],
+            "bz": [-3.2, 2.0, 0.0],
+        }
+    )
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_decode_swpc_json_columns():
+    df = decode_swpc_json(json.dumps(ROWS), columns=["bz", "time_tag"])
+
+    assert list(df.columns) == ["bz", "time_tag"]
+    assert df["time_tag"].dtype == "datetime64[ns]"
+    np.testing.assert_array_equal(df["bz"], [-3.2, 2.0, 0.0])
+
+
+def test_decode_swpc_json_without_rows():
+    df = decode_swpc_json(json.dumps(ROWS[:1]), columns=["time_tag", "speed"])
+
+    assert df.empty
+    assert list(df.columns) == ["time_tag", "speed"]
+    assert df["speed"].dtype == float
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backend.utils as utils
+from backend.buffer import RealTimeBuffers
+from backend.preprocess import (
+    fit_variation_centroids,
+    get_categories,
+    get_moving_avg,
+    resample_time_series,
+)
+from backend.quality import apply_quality_policy
+
+NOW = pd.Timestamp("2024-05-10 12:07")
+STATIONS = ["at", "ff", "jr", "pq", "ro", "vt"]
+ENGINE_FEATURES = [
+    "hf_mav_2h",
+    "ie_mav_3h",
+    "ie_mav_12h",
+    "iu_mav_3h",
+    "iu_mav_12h",
+    "ie_variation",
+    "iu_variation",
+]
+
+
+def make_source(cols, freq, hours, seed, scale=100):
+    # Observations up to a few hours after NOW, which the tests reveal step by step
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(
+        end=NOW + pd.Timedelta(hours=3),
+        periods=int(pd.Timedelta(hours=hours + 3) / pd.Timedelta(freq)),
+        freq=freq,
+        name="datetime",
+    )
+    values = np.round(rng.gamma(2.0, scale / 2, (len(index), len(cols))), 2)
+    return pd.DataFrame(values, index=index, columns=cols), pd.Timedelta(hours=hours)
+
+
+SOURCES = {
+    "techtide_hf": make_source(["hf"], "15min", 24, seed=1),
+    "techtide_ionosondes": make_source(
+        [
+            f"{q_}_{s_}"
+            for q_ in ["spectral_contribution", "velocity", "azimuth"]
+            for s_ in STATIONS
+        ],
+        "5min",
+        24,
+        seed=2,
+    ),
+    "gfz_hp30": make_source(["hp_30"], "30min", 24, seed=3, scale=3),
+    "gfz_f107": make_source(["f_107_adj"], "1D", 240, seed=4),
+    "noaa_l1": make_source(["by", "bz", "speed", "rho", "newell"], "1min", 6, seed=5),
+    "noaa_dst": make_source(["dst"], "1h", 48, seed=6),
+}
+
+
+def make_sources(fmi_hours, end=NOW):
+    # What each source returns at `end`: its last hours of data
+    sources = {**SOURCES, "fmi": make_source(["iu", "ie"], "10s", fmi_hours, seed=7)}
+    return {
+        name_: df_.loc[end - span_ : end] for name_, (df_, span_) in sources.items()
+    }
+
+
+@pytest.fixture(autouse=True)
+def variation_centroids(monkeypatch):
+    # Fitted on the training catalog in production, on the synthetic FMI data here
+    df, _ = make_source(["iu", "ie"], "10s", 24, seed=7)
+    bins = df.resample("30min").median().round(2)
+    centroids = {col_: fit_variation_centroids(bins[col_]) for col_ in ["ie", "iu"]}
+    monkeypatch.setattr(utils, "get_variation_centroids", lambda: centroids)
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def utcnow(self):
+        return self.now.to_pydatetime()
+
+
+def patch_fetchers(monkeypatch, sources, now):
+    def fetchers(start, stop):
+        # Sources queried by time only return their data from the given start
+        return {
+            name_: (
+                lambda df_=df_.loc[pd.Timestamp(start.get(name_, df_.index[0])) :]: df_
+            )
+            for name_, df_ in sources.items()
+        }
+
+    monkeypatch.setattr(utils, "get_real_time_fetchers", fetchers)
+    monkeypatch.setattr(utils, "datetime", Clock(now))
+
+
+def get_batch_features(history, starts, quality_serving):
+    # Features of the last bin, with the batch functions applied to all the bins
+    # since the engine of each source started
+    if quality_serving:
+        history = apply_quality_policy(history)
+    hf = history.loc[starts["techtide_hf"] :]
+    fmi = history.loc[starts["fmi"] :]
+    features = {"hf_mav_2h": get_moving_avg(hf, ["hf"], [2])["hf_mav_2h"].iloc[-1]}
+    mav = get_moving_avg(fmi, ["ie", "iu"], [3, 12])
+    for col_ in ["ie", "iu"]:
+        for hours_ in [3, 12]:
+            features[f"{col_}_mav_{hours_}h"] = mav[f"{col_}_mav_{hours_}h"].iloc[-1]
+        _, labels = get_categories(
+            fmi[col_],
+            window=12,
+            zero_phase=False,
+            centroids=utils.get_variation_centroids()[col_],
+        )
+        features[f"{col_}_variation"] = np.insert(labels, 0, 0)[-1]
+    return pd.Series(features)
+
+
+@pytest.mark.parametrize("quality_serving", [False, True])
+@pytest.mark.parametrize("fmi_hours", [6, 12, 24])
+def test_buffered_features_match_batch_over_history(
+    monkeypatch, fmi_hours, quality_serving
+):
+    monkeypatch.setattr(utils, "DATA_QUALITY_SERVING", quality_serving)
+    # Gaps of one bin, which the policy interpolates, and of three bins
+    gaps = [NOW + pd.Timedelta(minutes=m_) for m_ in [23, 53, 83, 113, 143]]
+    buffers = RealTimeBuffers()
+    revealed = {}
+    for step_ in range(4):
+        end = NOW + step_ * pd.Timedelta("47min")
+        sources = make_sources(fmi_hours, end=end)
+        for name_ in ["techtide_hf", "fmi"]:
+            df_ = sources[name_]
+            bins = df_.index.floor("30min")
+            drop = bins.isin([gaps[0].floor("30min")]) | bins.isin(
+                [g_.floor("30min") for g_ in gaps[2:]]
+            )
+            sources[name_] = df_[~drop]
+            revealed[name_] = pd.concat([revealed.get(name_), sources[name_]])
+        patch_fetchers(monkeypatch, sources, end)
+        actual = utils.get_real_time_data(buffers=buffers)
+        if step_ == 0:
+            # The engines start from the first observed bin of their buffer
+            starts = {
+                name_: buffers[name_].times()[
+                    np.isfinite(buffers[name_].view()).any(axis=0)
+                ][0]
+                for name_ in revealed
+            }
+
+        history = pd.concat(
+            [
+                resample_time_series(
+                    df_[~df_.index.duplicated()], utils.REAL_TIME_AGGREGATIONS[name_]
+                ).round(2)
+                for name_, df_ in revealed.items()
+            ],
+            axis=1,
+        )
+        history = history.reindex(
+            pd.date_range(
+                min(starts.values()), actual.index[-1], freq="30min", name="datetime"
+            )
+        )
+        expected = get_batch_features(history, starts, quality_serving)
+        pd.testing.assert_series_equal(
+            actual.iloc[0][expected.index],
+            expected.astype(actual.iloc[0][expected.index].dtype),
+            check_names=False,
+        )
+
+
+@pytest.mark.parametrize("quality_serving", [False, True])
+@pytest.mark.parametrize("fmi_hours", [6, 12, 24])
+def test_buffered_path_matches_frame_path(monkeypatch, fmi_hours, quality_serving):
+    monkeypatch.setattr(utils, "DATA_QUALITY_SERVING", quality_serving)
+    buffers = RealTimeBuffers()
+    # Successive updates, as in the forecast loop
+    for step_ in range(4):
+        end = NOW + step_ * pd.Timedelta("47min")
+        sources = make_sources(fmi_hours, end=end)
+        patch_fetchers(monkeypatch, sources, end)
+        expected = utils.get_real_time_data()
+        actual = utils.get_real_time_data(buffers=buffers)
+        # Features of the engines carry over from one update to the next, unlike
+        # the ones computed on the live window: moving averages only differ by
+        # the rounding of their running sums, variation labels are not compared
+        pd.testing.assert_frame_equal(
+            actual.drop(columns=ENGINE_FEATURES), expected.drop(columns=ENGINE_FEATURES)
+        )
+        moving_avg = [col_ for col_ in ENGINE_FEATURES if "_mav_" in col_]
+        pd.testing.assert_frame_equal(
+            actual[moving_avg], expected[moving_avg], check_exact=False, atol=0.011
+        )
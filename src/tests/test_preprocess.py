@@ -0,0 +1,179 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backend.preprocess as preprocess
+from backend import IONOSONDE_LOCATIONS, LATITUDE, LONGITUDE, SZA_ANALYTICAL_TOLERANCE
+from backend.preprocess import (
+    build_solar_zenith_table,
+    fit_variation_centroids,
+    get_categories,
+    get_solar_position,
+    get_solar_zenith_analytical,
+    get_station_solar_zenith,
+    kmeans_1d,
+)
+
+
+def brute_force_kmeans(x, n_clusters):
+    # Lowest within-cluster sum of squares over all the splits of the sorted values
+    x = np.sort(x)
+    best = np.inf
+    for cuts_ in combinations(range(1, len(x)), n_clusters - 1):
+        cost = sum(
+            ((part_ - part_.mean()) ** 2).sum() for part_ in np.split(x, list(cuts_))
+        )
+        best = min(best, cost)
+    return best
+
+
+def within_cluster_cost(x, labels, n_clusters):
+    return sum(
+        ((x[labels == k_] - x[labels == k_].mean()) ** 2).sum()
+        for k_ in range(n_clusters)
+    )
+
+
+@pytest.mark.parametrize("n_clusters", [2, 3, 4])
+def test_kmeans_1d_is_optimal(n_clusters):
+    rng = np.random.default_rng(n_clusters)
+    for _ in range(20):
+        x = np.round(rng.normal(0, 1, 12), 1)
+        labels, centers = kmeans_1d(x, n_clusters=n_clusters)
+
+        assert np.isclose(
+            within_cluster_cost(x, labels, n_clusters),
+            brute_force_kmeans(x, n_clusters),
+        )
+        # Centres are ascending, and labels follow them
+        assert np.all(np.diff(centers) > 0)
+        np.testing.assert_allclose(
+            centers, [x[labels == k_].mean() for k_ in range(n_clusters)], atol=1e-12
+        )
+
+
+def test_kmeans_1d_rows_match_single_series():
+    rng = np.random.default_rng(0)
+    X = rng.gamma(2.0, 1.0, (50, 24))
+    labels, centers = kmeans_1d(X, n_clusters=3)
+
+    assert labels.shape == X.shape and centers.shape == (50, 3)
+    for row_, labels_, centers_ in zip(X, labels, centers):
+        single_labels, single_centers = kmeans_1d(row_, n_clusters=3)
+        np.testing.assert_array_equal(labels_, single_labels)
+        np.testing.assert_allclose(centers_, single_centers)
+
+
+def test_kmeans_1d_validates_input():
+    with pytest.raises(ValueError):
+        kmeans_1d(np.array([1.0, np.nan, 2.0, 3.0]))
+    with pytest.raises(ValueError):
+        kmeans_1d(np.array([1.0, 2.0]), n_clusters=3)
+
+
+def make_index_series(n=2_000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.Series(
+        np.cumsum(rng.normal(0, 5, n)) + 200,
+        index=pd.date_range("2024-01-01", periods=n, freq="30min"),
+        name="ie",
+    )
+
+
+def test_categories_with_fitted_centroids_match_clustering():
+    series = make_index_series()
+    centroids = fit_variation_centroids(series, window=12)
+
+    filtered, labels = get_categories(series, window=12, zero_phase=False)
+    filtered_fixed, labels_fixed = get_categories(
+        series, window=12, zero_phase=False, centroids=centroids
+    )
+
+    pd.testing.assert_series_equal(filtered_fixed, filtered)
+    # Optimal clusters of 1-D data are the cells of the nearest centre
+    np.testing.assert_array_equal(labels_fixed, labels)
+
+
+def test_categories_with_centroids_assign_nearest_centre():
+    series = make_index_series()
+    centroids = np.array([0.01, -0.01, 0.0])
+    filtered, labels = get_categories(
+        series, window=12, zero_phase=False, centroids=centroids
+    )
+
+    log_diff = np.diff(np.log1p(filtered.values + abs(filtered.min())))
+    nearest = np.argmin(np.abs(log_diff[:, None] - np.sort(centroids)), axis=1)
+    np.testing.assert_array_equal(labels, nearest)
+
+
+@pytest.fixture
+def solar_zenith_table(tmp_path, monkeypatch):
+    # A small table, stored aside from the shipped one
+    monkeypatch.setattr(preprocess, "SZA_TABLE_PATH", tmp_path / "sza_table.pickle")
+    preprocess._load_solar_zenith_table.cache_clear()
+    table = build_solar_zenith_table(
+        start="2024-03-01",
+        end="2024-03-03",
+        altitude=0,
+        path=tmp_path / "sza_table.pickle",
+    )
+    yield table
+    preprocess._load_solar_zenith_table.cache_clear()
+
+
+def test_analytical_solar_zenith_within_tolerance():
+    # Random times over the span of the table, at the site and at the stations
+    rng = np.random.default_rng(0)
+    start, end = pd.Timestamp("2014-01-01"), pd.Timestamp("2036-01-01")
+    time = pd.DatetimeIndex(
+        np.sort(rng.integers(start.value, end.value, 2_000)), tz="UTC"
+    )
+    sites = [(LATITUDE, LONGITUDE), *IONOSONDE_LOCATIONS.values()]
+
+    for lat_, lon_ in sites:
+        spa = get_solar_position(
+            time, latitude=lat_, longitude=lon_, altitude=0, method="spa"
+        )["zenith"].to_numpy()
+        analytical = get_solar_zenith_analytical(time, latitude=lat_, longitude=lon_)
+        assert np.max(np.abs(analytical - spa)) <= SZA_ANALYTICAL_TOLERANCE
+
+
+def test_solar_zenith_table_lookup(solar_zenith_table):
+    table = solar_zenith_table
+    # On the grid of the table, then off it (between bins, and after its end)
+    on_grid = pd.date_range("2024-03-01", "2024-03-02 23:30", freq="30min")
+    off_grid = pd.DatetimeIndex(["2024-03-01 00:10", "2024-03-05 00:00"])
+
+    zenith = get_solar_position(on_grid, altitude=0)["zenith"].to_numpy()
+    np.testing.assert_array_equal(zenith, table["zenith"])
+
+    zenith = get_solar_position(off_grid, altitude=0)["zenith"].to_numpy()
+    np.testing.assert_allclose(zenith, get_solar_zenith_analytical(off_grid))
+
+    # The table only covers its own site
+    for site_ in [{"latitude": 0.0, "altitude": 0}, {"altitude": 1_000}]:
+        zenith = get_solar_position(on_grid, **site_)["zenith"].to_numpy()
+        expected = get_solar_zenith_analytical(
+            on_grid, latitude=site_.get("latitude", LATITUDE)
+        )
+        np.testing.assert_allclose(zenith, expected)
+
+
+def test_station_solar_zenith():
+    time = pd.date_range("2024-05-10", periods=96, freq="30min", name="datetime")
+    df = get_station_solar_zenith(time, stations=["at", "ff", "vt"])
+
+    assert list(df.columns) == [
+        "solar_zenith_angle_at",
+        "solar_zenith_angle_ff",
+        "solar_zenith_angle_vt",
+    ]
+    pd.testing.assert_index_equal(df.index, time)
+    for st_ in ["at", "ff", "vt"]:
+        lat_, lon_ = IONOSONDE_LOCATIONS[st_]
+        expected = get_solar_zenith_analytical(time, latitude=lat_, longitude=lon_)
+        np.testing.assert_allclose(
+            df[f"solar_zenith_angle_{st_}"], np.round(expected, 1)
+        )
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from backend.quality import apply_quality_policy, fill_gaps, mask_invalid_values
+
+POLICY = {
+    "hf": {"columns": ["hf"], "fill": "interpolate", "max_gap": 2},
+    "dst": {"columns": ["dst"], "fill": "ffill", "max_gap": 1, "flag": True},
+    "l1": {
+        "columns": ["speed"],
+        "valid_range": {"speed": (0, 3_000)},
+        "fill": "interpolate",
+        "max_gap": 1,
+    },
+}
+
+
+def make_frame():
+    nan = np.nan
+    return pd.DataFrame(
+        {
+            "hf": [nan, 1.0, nan, nan, 4.0, nan, nan, nan, 8.0, nan],
+            "dst": [1.0, nan, 3.0, nan, nan, 6.0, 7.0, nan, nan, nan],
+            "speed": [400.0, 5e4, 420.0, nan, 440.0, -1.0, -1.0, 470.0, 480.0, nan],
+            "other": [nan, 1.0, nan, 3.0, nan, 5.0, nan, 7.0, nan, 9.0],
+        },
+        index=pd.date_range("2024-05-10", periods=10, freq="30min", name="datetime"),
+    )
+
+
+def test_apply_quality_policy():
+    df = apply_quality_policy(make_frame(), policy=POLICY)
+    nan = np.nan
+
+    # Inner gaps up to `max_gap` are interpolated, longer ones are left missing
+    np.testing.assert_allclose(
+        df["hf"], [nan, 1.0, 2.0, 3.0, 4.0, nan, nan, nan, 8.0, nan]
+    )
+    # Forward-filling also fills the trailing gap, if short enough
+    np.testing.assert_allclose(
+        df["dst"], [1.0, 1.0, 3.0, nan, nan, 6.0, 7.0, nan, nan, nan]
+    )
+    # Values out of range are gaps as well
+    np.testing.assert_allclose(
+        df["speed"], [400.0, 410.0, 420.0, 430.0, 440.0, nan, nan, 470.0, 480.0, nan]
+    )
+    pd.testing.assert_series_equal(df["other"], make_frame()["other"])
+
+    assert list(df["dst_gap"]) == [0, 1, 0, 1, 1, 0, 0, 1, 1, 1]
+    stats = df.attrs["gap_stats"]
+    assert stats.loc["speed", "n_invalid"] == 3
+    assert stats.loc["hf", "longest_gap"] == 3
+    assert stats.loc["dst", "n_filled"] == 1
+
+
+def test_fill_gaps_matches_frame_policy():
+    df = make_frame()
+    columns = ["other", "speed", "dst", "hf"]
+    values = df[columns].to_numpy()
+    filled = fill_gaps(values, columns, policy=POLICY)
+
+    expected = apply_quality_policy(df, policy=POLICY)[columns].to_numpy()
+    np.testing.assert_array_equal(filled, expected)
+    # The input is left as is
+    np.testing.assert_array_equal(values, df[columns].to_numpy())
+    np.testing.assert_array_equal(
+        fill_gaps(values[:0], columns, policy=POLICY), values[:0]
+    )
+
+
+def test_mask_invalid_values():
+    df = pd.DataFrame(
+        {
+            "speed": [400.0, 99999.9, 5e4, 410.0],
+            "bz": [-3.0, 999.99, 2.0, -250.0],
+            "other": [99999.9, 1.0, 2.0, 3.0],
+        }
+    )
+    masked = mask_invalid_values(df)
+
+    np.testing.assert_array_equal(masked["speed"], [400.0, np.nan, np.nan, 410.0])
+    np.testing.assert_array_equal(masked["bz"], [-3.0, np.nan, 2.0, np.nan])
+    pd.testing.assert_series_equal(masked["other"], df["other"])
+    assert masked.attrs["n_invalid"] == {"speed": 2, "bz": 2}
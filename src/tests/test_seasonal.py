@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.linalg import solve_toeplitz
+
+from backend.seasonal import get_acf, get_pacf
+
+N_LAGS = 24
+
+
+def make_series(n=2_000, seed=0):
+    # AR(2) processes plus a daily cycle, one per column
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, 1, (n, 2))
+    values = np.zeros((n, 2))
+    for t_ in range(2, n):
+        values[t_] = 0.6 * values[t_ - 1] - 0.2 * values[t_ - 2] + noise[t_]
+    values += np.sin(2 * np.pi * np.arange(n) / 48)[:, np.newaxis]
+    return pd.DataFrame(
+        values,
+        index=pd.date_range("2024-01-01", periods=n, freq="30min"),
+        columns=["ie", "iu"],
+    )
+
+
+def direct_acf(x, n_lags):
+    x = x - x.mean()
+    acov = np.array([np.dot(x[: len(x) - k_], x[k_:]) for k_ in range(n_lags + 1)])
+    return acov / acov[0]
+
+
+def test_acf_matches_definition():
+    df = make_series()
+    acf = get_acf(df, n_lags=N_LAGS)
+
+    assert list(acf.columns) == ["ie", "iu"]
+    assert list(acf.index) == list(range(N_LAGS + 1))
+    for col_ in df.columns:
+        np.testing.assert_allclose(acf[col_], direct_acf(df[col_].values, N_LAGS))
+
+
+def test_acf_missing_values_do_not_contribute():
+    df = make_series()
+    df_missing = df.copy()
+    df_missing.iloc[100:150, 0] = np.nan
+    df_missing.iloc[::7, 1] = np.nan
+    acf = get_acf(df_missing, n_lags=N_LAGS)
+
+    for col_ in df.columns:
+        filled = df_missing[col_].fillna(df_missing[col_].mean()).values
+        np.testing.assert_allclose(acf[col_], direct_acf(filled, N_LAGS))
+
+
+def test_pacf_matches_yule_walker():
+    df = make_series()
+    acf, pacf = get_acf(df, n_lags=N_LAGS), get_pacf(df, n_lags=N_LAGS)
+
+    assert pacf.shape == acf.shape
+    for col_ in df.columns:
+        r = acf[col_].values
+        # PACF at lag k: last coefficient of the AR(k) Yule-Walker solution
+        expected = [1.0] + [
+            solve_toeplitz(r[:k_], r[1 : k_ + 1])[-1] for k_ in range(1, N_LAGS + 1)
+        ]
+        np.testing.assert_allclose(pacf[col_], expected, atol=1e-10)
+    # An AR(2) process: the lag-2 coefficient shows up, later ones fade out
+    assert pacf.loc[2, "ie"] == pytest.approx(-0.2, abs=0.1)
+
+
+def test_against_statsmodels():
+    stattools = pytest.importorskip("statsmodels.tsa.stattools")
+    df = make_series()
+
+    np.testing.assert_allclose(
+        get_acf(df, n_lags=N_LAGS)["ie"], stattools.acf(df["ie"], nlags=N_LAGS)
+    )
+    np.testing.assert_allclose(
+        get_pacf(df, n_lags=N_LAGS)["ie"],
+        stattools.pacf(df["ie"], nlags=N_LAGS, method="ldb"),
+        atol=1e-10,
+    )
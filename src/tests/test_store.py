@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend import FEATURE_STORE_TARGETS, FORECAST_HOURS_IN_ADVANCE, ML_MODEL_COLS
+from backend.store import (
+    STORE_COLUMNS,
+    append_features,
+    get_months,
+    label_features,
+    read_features,
+    read_training_set,
+    write_features,
+)
+
+TARGET = FEATURE_STORE_TARGETS[0]
+STEPS = 2 * FORECAST_HOURS_IN_ADVANCE
+
+
+def make_rows(start, periods, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, periods=periods, freq="30min", name="datetime")
+    df = pd.DataFrame(
+        np.round(rng.gamma(2.0, 50.0, (periods, 3)), 2),
+        index=index,
+        columns=["ie_fix", "hf", "dst"],
+    )
+    df["ie_variation"] = rng.integers(0, 3, periods)
+    return df
+
+
+def test_upsert_across_months(tmp_path):
+    df = make_rows("2024-04-30 20:00", 16)
+    months = write_features(df, path=tmp_path)
+
+    assert months == [pd.Period("2024-04"), pd.Period("2024-05")]
+    assert get_months(tmp_path) == months
+    stored = read_features(path=tmp_path)
+    assert list(stored.columns) == STORE_COLUMNS
+    pd.testing.assert_frame_equal(
+        stored[df.columns], df, check_dtype=False, check_freq=False
+    )
+
+    # Overlapping rows replace the stored ones, except for their missing values
+    update = make_rows("2024-05-01 02:00", 4, seed=1)
+    update.loc[update.index[0], "hf"] = np.nan
+    write_features(update, path=tmp_path)
+    stored = read_features(path=tmp_path)
+
+    assert len(stored) == len(df)
+    assert stored.index.is_monotonic_increasing
+    np.testing.assert_allclose(stored.loc[update.index[1:], "hf"], update["hf"][1:])
+    assert stored.loc[update.index[0], "hf"] == pytest.approx(
+        df.loc[update.index[0], "hf"]
+    )
+    assert stored.loc[update.index[0], "dst"] == pytest.approx(
+        update.loc[update.index[0], "dst"]
+    )
+
+
+def test_read_range_and_columns(tmp_path):
+    write_features(make_rows("2024-03-31 12:00", 96), path=tmp_path)
+    df = read_features(
+        start="2024-04-01 00:00",
+        end="2024-04-01 05:30",
+        columns=["hf", "dst"],
+        path=tmp_path,
+    )
+
+    assert list(df.columns) == ["hf", "dst"]
+    assert df.index[0] == pd.Timestamp("2024-04-01 00:00")
+    assert df.index[-1] == pd.Timestamp("2024-04-01 05:30")
+
+    empty = read_features(start="2025-01-01", path=tmp_path)
+    assert empty.empty
+    assert list(empty.columns) == STORE_COLUMNS
+
+
+def test_invalid_rows_are_rejected(tmp_path):
+    df = make_rows("2024-05-01", 4)
+    with pytest.raises(ValueError):
+        write_features(df.assign(unknown=1.0), path=tmp_path)
+    with pytest.raises(ValueError):
+        write_features(df.set_axis(df.index + pd.Timedelta("10min")), path=tmp_path)
+    with pytest.raises(ValueError):
+        write_features(pd.concat([df, df.iloc[:1]]), path=tmp_path)
+    with pytest.raises(ValueError):
+        read_features(columns=["unknown"], path=tmp_path)
+    assert get_months(tmp_path) == []
+
+
+def test_append_live_rows(tmp_path, caplog):
+    # Columns which are not stored (e.g. the gap flags) are left out
+    df = make_rows("2024-05-01", 4)
+    append_features(df.assign(hf_gap=False), path=tmp_path)
+    pd.testing.assert_frame_equal(
+        read_features(columns=df.columns, path=tmp_path),
+        df,
+        check_dtype=False,
+        check_freq=False,
+    )
+
+    # Failures are only logged
+    off_grid = df.set_axis(df.index + pd.Timedelta("10min"))
+    append_features(off_grid, path=tmp_path)
+    assert "Live features not stored" in caplog.text
+    assert len(read_features(path=tmp_path)) == len(df)
+
+
+def make_events(start, periods, at):
+    index = pd.date_range(start, periods=periods, freq="30min", name="datetime")
+    events = pd.Series(0.0, index=index)
+    events.iloc[at] = 1.0
+    return events
+
+
+def test_label_stored_rows(tmp_path):
+    rows = make_rows("2024-05-01", 48)
+    write_features(rows, path=tmp_path)
+    # Events cover the first 20 bins only, with one at bin 10
+    label_features(make_events("2024-05-01", 20, at=[10]), path=tmp_path)
+
+    target = read_features(columns=[TARGET], path=tmp_path)[TARGET]
+    labelled = target.notna()
+    # Rows whose whole window is covered are labelled, the others are left as is
+    assert labelled.sum() == 20 - STEPS
+    assert not labelled.iloc[20 - STEPS :].any()
+    np.testing.assert_array_equal(
+        target[labelled], [int(10 - STEPS <= i_ <= 10) for i_ in range(20 - STEPS)]
+    )
+
+    features, y = read_training_set(path=tmp_path)
+    assert list(features.columns) == list(ML_MODEL_COLS.keys())
+    pd.testing.assert_series_equal(y, target[labelled].astype(int))
+
+
+def test_label_backfills_all_rows(tmp_path):
+    rows = make_rows("2024-05-01", 48)
+    label_features(make_events("2024-05-01", 20, at=[10]), df=rows, path=tmp_path)
+    stored = read_features(path=tmp_path)
+
+    # Rows too recent to be labelled are backfilled anyway
+    assert len(stored) == len(rows)
+    assert stored[TARGET].notna().sum() == 20 - STEPS
+
+    # Labelling never erases a target, even with events which no longer cover it
+    label_features(make_events("2024-05-01", 4, at=[]), df=rows, path=tmp_path)
+    pd.testing.assert_frame_equal(read_features(path=tmp_path), stored)
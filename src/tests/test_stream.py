@@ -0,0 +1,66 @@
+import asyncio
+
+from backend.stream import ForecastBroadcaster
+
+
+def parse_id(frame):
+    return int(frame.decode().split("\n")[0].removeprefix("id: "))
+
+
+async def take(iterator, n):
+    return [await anext(iterator) for _ in range(n)]
+
+
+def test_publish_skips_duplicate_reference_times():
+    broadcaster = ForecastBroadcaster(history=10)
+    first = broadcaster.publish('{"a": 1}', key="2024-05-10 12:00")
+    # The scheduled run and /predict computed the same forecast
+    assert broadcaster.publish('{"a": 2}', key="2024-05-10 12:00") == first
+    second = broadcaster.publish('{"a": 3}', key="2024-05-10 12:30")
+    # Forecasts without a key are always published
+    third = broadcaster.publish('{"a": 4}')
+    fourth = broadcaster.publish('{"a": 4}')
+
+    assert first < second < third < fourth
+    assert [id_ for id_, _ in broadcaster._events] == [first, second, third, fourth]
+    assert b'data: {"a": 3}' in broadcaster._events[1][1]
+
+
+def test_history_is_bounded():
+    broadcaster = ForecastBroadcaster(history=3)
+    ids = [broadcaster.publish(f'{{"a": {i_}}}', key=str(i_)) for i_ in range(5)]
+
+    assert [id_ for id_, _ in broadcaster._events] == ids[-3:]
+
+
+def test_subscribers_catch_up_and_follow():
+    async def scenario():
+        broadcaster = ForecastBroadcaster(history=10, keepalive=60)
+        broadcaster.bind(asyncio.get_running_loop())
+        ids = [broadcaster.publish(f'{{"a": {i_}}}', key=str(i_)) for i_ in range(3)]
+
+        # New subscribers only get the latest forecast, resuming ones what they missed
+        latest = broadcaster.subscribe()
+        resumed = broadcaster.subscribe(last_id=ids[0])
+        assert [parse_id(f_) for f_ in await take(latest, 1)] == ids[-1:]
+        assert [parse_id(f_) for f_ in await take(resumed, 2)] == ids[1:]
+
+        # Then each new forecast, as soon as it is published
+        pending = asyncio.ensure_future(take(latest, 1))
+        await asyncio.sleep(0)
+        new_id = broadcaster.publish('{"a": 3}', key="3")
+        frames = await asyncio.wait_for(pending, timeout=1)
+        assert [parse_id(f_) for f_ in frames] == [new_id]
+        assert [parse_id(f_) for f_ in await take(resumed, 1)] == [new_id]
+
+    asyncio.run(scenario())
+
+
+def test_keepalive():
+    async def scenario():
+        broadcaster = ForecastBroadcaster(keepalive=0.01)
+        broadcaster.bind(asyncio.get_running_loop())
+        frames = await take(broadcaster.subscribe(), 2)
+        assert frames == [b": keep-alive\n\n"] * 2
+
+    asyncio.run(scenario())